@@ -1,22 +1,84 @@
 """Custom Rasa actions."""
+import os
 import logging
-from datetime import datetime, timedelta
-from typing import Any, Text, Dict, List
+from datetime import datetime
+from typing import Any, Text, Dict, List, Optional, Tuple
 
 from word2number import w2n
 from rasa_sdk import Action, Tracker, FormValidationAction
-from rasa_sdk.events import SlotSet, ReminderScheduled, FollowupAction
+from rasa_sdk.events import SlotSet, FollowupAction
 from rasa_sdk.executor import CollectingDispatcher
 
 from . import utils
-from .dataset import Dataset
+from .dataset import load_dataset
+from .executor import AsyncDataset, DatasetExecutor
+from .results import SearchResults
+from .utterances import UtteranceCache
+from .metrics import metrics, timed
+from .timers import Timer, TimerService, TriggerIntentDispatcher
 
 # Init logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-# Load dataset globally
-dataset = Dataset()
+# Load dataset globally in the background, reloading it when the recipes change if DATASET_WATCH_INTERVAL (in seconds) is set.
+# The queries run in a pool of DATASET_WORKERS threads (or processes, if DATASET_EXECUTOR=process) out of the event loop.
+datasets = DatasetExecutor(load_dataset, interval=float(os.environ.get('DATASET_WATCH_INTERVAL', 0)), max_workers=int(os.environ.get('DATASET_WORKERS', 4)),
+                           processes=os.environ.get('DATASET_EXECUTOR', 'thread') == 'process')
+
+# Keep the search results in the actions server, the slots only store a cursor to them
+search_results = SearchResults()
+SEARCH_TOP_K = 100  # Max number of recipes kept for each search
+
+# Keep the last utterance of each conversation, to repeat it without scanning the tracker events
+utterances = UtteranceCache()
+
+# Cooking timers of the users, notified when expired through the HTTP API of the Rasa server at RASA_SERVER_URL (authenticated with RASA_TOKEN, if set)
+timers = TimerService(TriggerIntentDispatcher(os.environ.get('RASA_SERVER_URL', 'http://localhost:5005'), intent='EXTERNAL_timer_expired', entity='timer_name',
+                                              token=os.environ.get('RASA_TOKEN')))
+
+# Serve the actions and dataset metrics in the Prometheus format if METRICS_PORT is set
+metrics.gauge('dataset_ready', 'Whether the dataset is loaded.', lambda: datasets.ready)
+metrics.gauge('query_cache_hits', 'Number of dataset queries answered from the cache.', lambda: datasets.local.query_cache.hits if datasets.local is not None else 0)
+metrics.gauge('query_cache_misses', 'Number of dataset queries computed.', lambda: datasets.local.query_cache.misses if datasets.local is not None else 0)
+metrics.gauge('search_results', 'Number of search results stored in the actions server.', lambda: len(search_results))
+metrics.gauge('cached_utterances', 'Number of conversations whose last utterance is cached.', lambda: len(utterances))
+metrics.gauge('active_timers', 'Number of active cooking timers.', lambda: len(timers))
+if os.environ.get('METRICS_PORT'):
+    metrics.serve(int(os.environ['METRICS_PORT']), ready=lambda: datasets.ready)
+
+
+async def get_found_recipes(dataset: AsyncDataset, cursor: Optional[Dict[Text, Any]]) -> Tuple[Optional[List[int]], Optional[Dict[Text, Any]]]:
+    """Returns the recipes found and their cursor, running the search of the cursor again if its results are missing
+    (e.g. after a restart, or when another server handled the search) or were found in another version of the dataset."""
+    if not cursor:
+        return None, None
+    version = await dataset.get_version()
+    recipes_ids = search_results.get(cursor, version)
+    if recipes_ids is not None:
+        return recipes_ids, cursor
+    if cursor.get('query') is None:  # Cursor of a previous version of the actions server
+        return None, None
+    logger.info('Search results of version %s not found, searching again in version %s', cursor.get('version'), version)
+    recipes_ids = await dataset.search_recipes(*cursor['query'], top_k=SEARCH_TOP_K)
+    for prop, value, negative in cursor['filters']:
+        filtered_recipes_ids = set(await dataset.filter_recipes_by_property(recipes_ids, prop, value, negative=negative))
+        recipes_ids = [ recipe_id for recipe_id in recipes_ids if recipe_id in filtered_recipes_ids ]  # Keep the relevance order
+    if len(recipes_ids) == 0:
+        return None, None
+    cursor = search_results.move(search_results.put(recipes_ids, version, cursor['query'], cursor['filters']), cursor['position'])
+    return recipes_ids, cursor
+
+
+async def get_current_recipe_id(dataset: AsyncDataset, tracker: Tracker) -> Optional[int]:
+    """Returns the id of the current recipe, the one at the position of the search results if the dataset changed since
+    the search (the ids of the recipes are their positions in the dataset, which can change when it is reloaded)."""
+    cursor = tracker.get_slot('found_recipes')
+    if cursor and cursor.get('version') != await dataset.get_version():
+        recipes_ids, cursor = await get_found_recipes(dataset, cursor)
+        if recipes_ids is not None:
+            return recipes_ids[cursor['position']]
+    return tracker.get_slot('current_recipe_id')
 
 
 class ActionSearchRecipe(Action):
@@ -25,7 +87,10 @@ class ActionSearchRecipe(Action):
     def name(self) -> Text:
         return 'action_search_recipes'
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        dataset = await datasets.get()
         keywords = list(tracker.get_latest_entity_values('recipe'))
         ingredients = list(tracker.get_latest_entity_values('ingredient'))
         tags = list(tracker.get_latest_entity_values('tag'))
@@ -34,17 +99,18 @@ class ActionSearchRecipe(Action):
         if len(keywords) == 0 and len(ingredients) == 0 and len(tags) == 0 and cuisine is None:
             dispatcher.utter_message(response='utter_search_recipe_not_found')
             return []
-        recipes_ids = dataset.search_recipes(keywords, ingredients, tags, cuisine)
+        recipes_ids = await dataset.search_recipes(keywords, ingredients, tags, cuisine, top_k=SEARCH_TOP_K)
         logger.info('Found %d recipes', len(recipes_ids))
         if len(recipes_ids) == 0:
             dispatcher.utter_message(response='utter_search_recipe_not_found')
             return []
-        elif len(recipes_ids) == 1:  # Return the single recipe found
-            recipe = dataset.get_recipe(recipes_ids[0])
+        cursor = search_results.put(recipes_ids, await dataset.get_version(), [keywords, ingredients, tags, cuisine])
+        if len(recipes_ids) == 1:  # Return the single recipe found
+            recipe = await dataset.get_recipe(recipes_ids[0])
             dispatcher.utter_message(response='utter_search_recipe_found', recipe_title=recipe.title, image=recipe.image)
-            return [ SlotSet('found_recipes_ids', recipes_ids), SlotSet('current_recipe_id', recipe.id) ]
+            return [ SlotSet('found_recipes', cursor), SlotSet('current_recipe_id', recipe.id) ]
         else: # More alternatives found, asks the user for more details
-            return [ SlotSet('found_recipes_ids', recipes_ids), FollowupAction('action_refine_recipes_search_ask') ]
+            return [ SlotSet('found_recipes', cursor), SlotSet('refine_recipes_search_asked', None), FollowupAction('action_refine_recipes_search_ask') ]
 
 
 class ActionRefineRecipesSearchAsk(Action):
@@ -53,17 +119,25 @@ class ActionRefineRecipesSearchAsk(Action):
     def name(self) -> Text:
         return 'action_refine_recipes_search_ask'
     
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        recipes_ids = tracker.get_slot('found_recipes_ids')
-        prop, value = dataset.get_discriminative_properties(recipes_ids)
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        dataset = await datasets.get()
+        recipes_ids, cursor = await get_found_recipes(dataset, tracker.get_slot('found_recipes'))
+        if recipes_ids is None:  # Nothing found anymore, ask to search again
+            dispatcher.utter_message(response='utter_search_recipe_not_found')
+            return [ SlotSet('found_recipes', None) ]
+        asked_properties = tracker.get_slot('refine_recipes_search_asked') or []
+        prop, value = await dataset.plan_refinement_question(recipes_ids, asked_properties)
         logger.info('Refine search by %s with value %s', prop, value)
         if prop is not None: # Ask the user for more details
             dispatcher.utter_message(response='utter_refine_recipes_search', count=len(recipes_ids), tag=value)
-            return [ SlotSet('refine_recipes_search_prop', str(prop)), SlotSet('refine_recipes_search_value', value) ]
+            return [ SlotSet('refine_recipes_search_prop', str(prop)), SlotSet('refine_recipes_search_value', value),
+                     SlotSet('refine_recipes_search_asked', asked_properties + [ [str(prop), value] ]) ]
         else:  # If not discriminative property was found, return the first recipe
-            recipe = dataset.get_recipe(recipes_ids[0])
+            recipe = await dataset.get_recipe(recipes_ids[0])
             dispatcher.utter_message(response='utter_search_recipe_found', recipe_title=recipe.title, image=recipe.image)
-            return [ SlotSet('found_recipes_ids', recipes_ids), SlotSet('current_recipe_id', recipe.id) ]
+            return [ SlotSet('found_recipes', cursor), SlotSet('current_recipe_id', recipe.id) ]
 
 
 class ActionRefineRecipesSearchFilter(Action):
@@ -72,23 +146,35 @@ class ActionRefineRecipesSearchFilter(Action):
     def name(self) -> Text:
         return 'action_refine_recipes_search_filter'
     
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        recipes_ids = tracker.get_slot('found_recipes_ids')
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        dataset = await datasets.get()
+        recipes_ids, cursor = await get_found_recipes(dataset, tracker.get_slot('found_recipes'))
+        if recipes_ids is None:  # Nothing found anymore, ask to search again
+            dispatcher.utter_message(response='utter_search_recipe_not_found')
+            return [ SlotSet('found_recipes', None), SlotSet('refine_recipes_search_prop', None), SlotSet('refine_recipes_search_value', None) ]
         prop, value = tracker.get_slot('refine_recipes_search_prop'), tracker.get_slot('refine_recipes_search_value')
         # Filter the found recipes according to the user's positive or negative response. In case 'idk' is received, do not filter the recipes.
         user_response = tracker.latest_message['intent'].get('name')
         logger.info('User responeded with intent "%s" to filtering by %s with value %s', user_response, prop, value)
-        if user_response == 'affirm':
-            recipes_ids = dataset.filter_recipes_by_property(recipes_ids, prop, value, negative=False)
-        elif user_response == 'deny':
-            recipes_ids = dataset.filter_recipes_by_property(recipes_ids, prop, value, negative=True)
+        if user_response in ['affirm', 'deny']:
+            negative = user_response == 'deny'
+            filtered_recipes_ids = set(await dataset.filter_recipes_by_property(recipes_ids, prop, value, negative=negative))
+            recipes_ids = [ recipe_id for recipe_id in recipes_ids if recipe_id in filtered_recipes_ids ]  # Keep the relevance order
+            cursor = search_results.put(recipes_ids, cursor['version'], cursor['query'], cursor['filters'] + [ [prop, value, negative] ])
         logger.info('Filtered to %d recipes', len(recipes_ids))
+        # Ask again other questions, until a single recipe is left or no other property can split the recipes
+        if len(recipes_ids) > 1:
+            next_prop, _ = await dataset.plan_refinement_question(recipes_ids, tracker.get_slot('refine_recipes_search_asked') or [])
+            if next_prop is not None:
+                return [ SlotSet('found_recipes', cursor), SlotSet('refine_recipes_search_prop', None), SlotSet('refine_recipes_search_value', None),
+                         FollowupAction('action_refine_recipes_search_ask') ]
         # Return the first of the filtered recipes
-        recipe = dataset.get_recipe(recipes_ids[0])
+        recipe = await dataset.get_recipe(recipes_ids[0])
         dispatcher.utter_message(response='utter_search_recipe_found', recipe_title=recipe.title, image=recipe.image)
-        return [ SlotSet('found_recipes_ids', recipes_ids), SlotSet('current_recipe_id', recipe.id), 
+        return [ SlotSet('found_recipes', cursor), SlotSet('current_recipe_id', recipe.id), 
                  SlotSet('refine_recipes_search_prop', None), SlotSet('refine_recipes_search_value', None) ]
-        # TODO: ask again other questions
 
 
 class ActionSearchAlternativeRecipe(Action):
@@ -97,17 +183,19 @@ class ActionSearchAlternativeRecipe(Action):
     def name(self) -> Text:
         return 'action_search_alternative_recipe'
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        found_recipes_ids = tracker.get_slot('found_recipes_ids')
-        current_recipe_id = tracker.get_slot('current_recipe_id') # TODO: handle None recipe
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        dataset = await datasets.get()
+        found_recipes_ids, cursor = await get_found_recipes(dataset, tracker.get_slot('found_recipes'))
         if found_recipes_ids is None or len(found_recipes_ids) <= 1:
             dispatcher.utter_message(response='utter_search_recipe_not_found_alternative')
             return []
-        current_recipe_idx = found_recipes_ids.index(current_recipe_id)
-        new_recipe_id = found_recipes_ids[(current_recipe_idx + 1) % len(found_recipes_ids)]
-        recipe = dataset.get_recipe(new_recipe_id)
+        cursor = search_results.move(cursor, cursor['position'] + 1)  # Go to the next page of the results
+        new_recipe_id = found_recipes_ids[cursor['position']]
+        recipe = await dataset.get_recipe(new_recipe_id)
         dispatcher.utter_message(response='utter_search_recipe_found_alternative', recipe_title=recipe.title, image=recipe.image)
-        return [ SlotSet('current_recipe_id', new_recipe_id) ]
+        return [ SlotSet('found_recipes', cursor), SlotSet('current_recipe_id', new_recipe_id) ]
         
 
 class ActionTellExpectedTime(Action):
@@ -116,9 +204,12 @@ class ActionTellExpectedTime(Action):
     def name(self) -> Text:
         return 'action_tell_expected_time'
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        recipe_id = tracker.get_slot('current_recipe_id') # TODO: handle None recipe
-        recipe = dataset.get_recipe(recipe_id)
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        dataset = await datasets.get()
+        recipe_id = await get_current_recipe_id(dataset, tracker) # TODO: handle None recipe
+        recipe = await dataset.get_recipe(recipe_id)
         dispatcher.utter_message(response='utter_expected_time', prep_time=str(recipe.prep_time), cook_time=str(recipe.cook_time))
         return []
 
@@ -127,6 +218,8 @@ class ActionUpdatePeopleCount(Action):
     def name(self) -> Text:
         return 'action_update_people_count'
 
+    @timed('action')
+    @utterances.observed
     def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         intent = tracker.latest_message['intent'].get('name')
         if intent == 'tell_people_count_one':
@@ -146,9 +239,12 @@ class ActionListIngredients(Action):
     def name(self) -> Text:
         return 'action_list_ingredients'
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        recipe_id = tracker.get_slot('current_recipe_id')  # TODO: handle None recipe
-        recipe = dataset.get_recipe(recipe_id)
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        dataset = await datasets.get()
+        recipe_id = await get_current_recipe_id(dataset, tracker)  # TODO: handle None recipe
+        recipe = await dataset.get_recipe(recipe_id)
         people_count = next(tracker.get_latest_entity_values('CARDINAL'), tracker.get_slot('people_count')) # Use value o entity or current slot as fallback
         logger.info('Listing ingredients for recipe %s and "%s" people, found %d ingredients', recipe.id, people_count, len(recipe.ingredients))
         if people_count is None:
@@ -158,7 +254,7 @@ class ActionListIngredients(Action):
             # Update ingredients amount to adapt to the specified people_count
             people_count = w2n.word_to_num(str(people_count))
             logger.info('Update recipe to adapt to %d people', people_count)
-            recipe.set_servings(people_count)
+            recipe = recipe.set_servings(people_count)
         ingredients_list = '\n'.join([ f'  - {ingredient}' for ingredient in recipe.ingredients ])
         people_count_str = f'{people_count} people' if people_count > 1 else '1 person'
         dispatcher.utter_message(response='utter_list_ingredients', ingredients_list=ingredients_list, people_count_str=people_count_str)
@@ -171,13 +267,16 @@ class ActionSearchIngredientsSubstitutes(Action):
     def name(self) -> Text:
         return 'action_search_ingredients_substitutes'
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        dataset = await datasets.get()
         ingredients = list(tracker.get_latest_entity_values('ingredient'))
         if len(ingredients) == 0:
             dispatcher.utter_message(response='utter_ingredient_substitute_no_ingredient')
             return []
         # Search for substitutes
-        substitutes = dataset.search_ingredients_substitutes(ingredients)
+        substitutes = await dataset.search_ingredients_substitutes(ingredients)
         logger.info('Substitute for ingredients %s = %s', ingredients, substitutes)
         # Utter substitutes
         if len(substitutes) == 0:
@@ -193,14 +292,17 @@ class ActionTellIngredientAmount(Action):
     def name(self) -> Text:
         return 'action_tell_ingredient_amount'
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        recipe_id = tracker.get_slot('current_recipe_id')  # TODO: handle None recipe
-        recipe = dataset.get_recipe(recipe_id)
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        dataset = await datasets.get()
+        recipe_id = await get_current_recipe_id(dataset, tracker)  # TODO: handle None recipe
+        recipe = await dataset.get_recipe(recipe_id)
         people_count = next(tracker.get_latest_entity_values('CARDINAL'), tracker.get_slot('people_count'))  # Use value of entity or current slot as fallback
         asked_ingredients = list(tracker.get_latest_entity_values('ingredient'))
         if len(asked_ingredients) > 0:
             if people_count is not None: # Update ingredients amount to adapt to the specified people_count
-                recipe.set_servings(w2n.word_to_num(str(people_count)))
+                recipe = recipe.set_servings(w2n.word_to_num(str(people_count)))
             amounts = [ ingr.to_str(default_amount='some') for ingr in recipe.ingredients if any(asked_ingr in ingr.name for asked_ingr in asked_ingredients) ]
             if len(amounts) > 0:
                 amounts_str = utils.join_list_str(amounts)
@@ -219,23 +321,56 @@ class ActionListStepsLoop(FormValidationAction):
     def name(self) -> Text:
         return 'validate_list_steps_loop'
 
-    def validate_list_steps_done(self, value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any])-> Dict[Text, Any]:
-        recipe_id = tracker.get_slot('current_recipe_id') # TODO: handle None recipe
-        recipe = dataset.get_recipe(recipe_id)
+    @timed('action')
+    async def validate_list_steps_done(self, value: Any, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any])-> Dict[Text, Any]:
+        dataset = await datasets.get()
+        recipe_id = await get_current_recipe_id(dataset, tracker) # TODO: handle None recipe
+        steps = await dataset.get_step_index(recipe_id)
         current_step_idx = tracker.get_slot('current_step_idx')
-        current_step_idx += 1 # Go to the next step
-        if current_step_idx >= len(recipe.steps):
+        intent = tracker.latest_message['intent'].get('name')
+        if intent == 'ask_steps_left':
+            steps_left = steps.steps_left(current_step_idx)
+            logger.info('%d steps left in recipe %s', steps_left, recipe_id)
+            steps_left_str = f'{steps_left} steps' if steps_left != 1 else 'one step'
+            dispatcher.utter_message(response='utter_steps_left' if steps_left > 0 else 'utter_steps_left_none', steps_left_str=steps_left_str)
+            return dict(current_step_idx=current_step_idx, list_steps_done=None)
+        if intent == 'ask_step_ingredient':
+            ingredients = list(tracker.get_latest_entity_values('ingredient'))
+            found = sorted({ step_idx for ingredient in ingredients for step_idx in steps.find(ingredient) })
+            logger.info('Ingredients %s are used in steps %s of recipe %s', ingredients, found, recipe_id)
+            ingredients_str = utils.join_list_str(ingredients)
+            if len(found) > 0:
+                steps_str = ('steps ' if len(found) > 1 else 'step ') + utils.join_list_str([ str(step_idx + 1) for step_idx in found ])
+                dispatcher.utter_message(response='utter_step_ingredient_found', ingredients_str=ingredients_str, steps_str=steps_str)
+            else:
+                dispatcher.utter_message(response='utter_step_ingredient_not_found', ingredients_str=ingredients_str or 'that')
+            return dict(current_step_idx=current_step_idx, list_steps_done=None)
+        if intent == 'previous_step':
+            current_step_idx = max(current_step_idx - 1, 0) # Go back to the previous step
+        elif intent == 'go_to_step':
+            position_str = next(tracker.get_latest_entity_values('ORDINAL'), next(tracker.get_latest_entity_values('CARDINAL'), None))
+            position = utils.parse_position(position_str) if position_str is not None else None
+            if position == -1:
+                position = len(steps)
+            if position is None or not 1 <= position <= len(steps):
+                logger.info('Step "%s" not found in recipe %s', position_str, recipe_id)
+                dispatcher.utter_message(response='utter_step_not_found', steps_count=len(steps))
+                return dict(current_step_idx=current_step_idx, list_steps_done=None)
+            current_step_idx = position - 1
+        else:
+            current_step_idx += 1 # Go to the next step
+        if current_step_idx >= len(steps):
             # All the steps have been read
-            logger.info('All the steps of recipe %s have been read', recipe.id)
+            logger.info('All the steps of recipe %s have been read', recipe_id)
             dispatcher.utter_message(response='utter_list_steps_end')
             return dict(current_step_idx=-1, list_steps_done=True)
         else:
-            # Read next step
-            logger.info('Reading step %d/%d of recipe %s', current_step_idx + 1, len(recipe.steps), recipe.id)
-            current_step_descr = utils.lower_first_letter(recipe.steps[current_step_idx].description)
+            # Read the step
+            logger.info('Reading step %d/%d of recipe %s', current_step_idx + 1, len(steps), recipe_id)
+            current_step_descr = steps.descriptions[current_step_idx]
             if current_step_idx == 0:
                 dispatcher.utter_message(response='utter_list_steps_first', step_description=current_step_descr)
-            elif current_step_idx < len(recipe.steps) - 1:
+            elif current_step_idx < len(steps) - 1:
                 dispatcher.utter_message(response='utter_list_steps_next', step_description=current_step_descr)
             else:
                 dispatcher.utter_message(response='utter_list_steps_last', step_description=current_step_descr)
@@ -248,32 +383,118 @@ class ActionSetTimer(Action):
     def name(self) -> Text:
         return 'action_set_timer'
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    @timed('action')
+    @utterances.observed
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         time_str = next(tracker.get_latest_entity_values('TIME'), None)  #TODO: handle None case
-        if time_str is not None:
-            amount, unit = utils.parse_time_str(time_str)
-            if amount is not None and unit is not None:
-                trigger_time = datetime.now() + timedelta(**{unit: amount})
-                logger.info('Set a timer for %d %s, trigger at %s', amount, unit, trigger_time)
-                dispatcher.utter_message(response='utter_set_timer_done', time=f'{amount} {unit}')
-                return [ ReminderScheduled(trigger_date_time=trigger_time, intent_name='EXTERNAL_timer_expired', kill_on_user_message=False) ]
+        timer_name = next(tracker.get_latest_entity_values('timer_name'), None)
+        duration = utils.parse_duration(time_str) if time_str is not None else None
+        if duration is not None:
+            duration_str = utils.format_duration(duration.total_seconds())
+            timer = timers.start(tracker.sender_id, timer_name or duration_str, duration.total_seconds())
+            logger.info('Set timer "%s" for %s, trigger at %s', timer.name, duration_str, datetime.fromtimestamp(timer.deadline))
+            dispatcher.utter_message(response='utter_set_timer_done', time=duration_str)
+            return [ ]
         logger.info('Could not set timer for entity "%s"', time_str)
         dispatcher.utter_message(response='utter_set_timer_error', time=time_str)
         return [ ]
 
 
+def find_timer(dispatcher: CollectingDispatcher, tracker: Tracker) -> Optional[Timer]:
+    """Returns the timer of the user referred by the timer_name entity (which can be omitted if there is a single timer),
+    or None after telling the user why it could not be found."""
+    timer_name = next(tracker.get_latest_entity_values('timer_name'), None)
+    found = timers.find(tracker.sender_id, timer_name)
+    if len(found) == 1:
+        return found[0]
+    if len(found) > 1:
+        dispatcher.utter_message(response='utter_ask_which_timer', timers_list=utils.join_list_str([ timer.name for timer in found ], last_sep='or'))
+    elif timer_name is not None:
+        dispatcher.utter_message(response='utter_timer_not_found', timer_name=timer_name)
+    else:
+        dispatcher.utter_message(response='utter_list_timers_empty')
+    return None
+
+
+class ActionListTimers(Action):
+    """List the running timers of the user, with the time left."""
+
+    def name(self) -> Text:
+        return 'action_list_timers'
+
+    @timed('action')
+    @utterances.observed
+    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        user_timers = timers.list(tracker.sender_id)
+        logger.info('Found %d timers', len(user_timers))
+        if len(user_timers) == 0:
+            dispatcher.utter_message(response='utter_list_timers_empty')
+        else:
+            timers_list = utils.join_list_str([ f'{timer.name} with {utils.format_duration(timer.remaining())} left' for timer in user_timers ])
+            timers_count_str = f'{len(user_timers)} timers' if len(user_timers) > 1 else 'a timer'
+            dispatcher.utter_message(response='utter_list_timers', timers_list=timers_list, timers_count_str=timers_count_str)
+        return []
+
+
+class ActionCancelTimer(Action):
+    """Cancel a running timer of the user."""
+
+    def name(self) -> Text:
+        return 'action_cancel_timer'
+
+    @timed('action')
+    @utterances.observed
+    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        timer = find_timer(dispatcher, tracker)
+        if timer is not None:
+            if timers.cancel(timer):
+                logger.info('Cancelled timer "%s"', timer.name)
+                dispatcher.utter_message(response='utter_cancel_timer_done', timer_name=timer.name)
+            else:
+                dispatcher.utter_message(response='utter_timer_not_found', timer_name=timer.name)
+        return []
+
+
+class ActionExtendTimer(Action):
+    """Add time to a running timer of the user."""
+
+    def name(self) -> Text:
+        return 'action_extend_timer'
+
+    @timed('action')
+    @utterances.observed
+    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        time_str = next(tracker.get_latest_entity_values('TIME'), None)
+        duration = utils.parse_duration(time_str) if time_str is not None else None
+        if duration is None:
+            logger.info('Could not extend timer for entity "%s"', time_str)
+            dispatcher.utter_message(response='utter_set_timer_error', time=time_str)
+            return []
+        timer = find_timer(dispatcher, tracker)
+        if timer is not None:
+            extended = timers.extend(timer, duration.total_seconds())
+            if extended is not None:
+                duration_str = utils.format_duration(duration.total_seconds())
+                logger.info('Extended timer "%s" by %s', timer.name, duration_str)
+                dispatcher.utter_message(response='utter_extend_timer_done', timer_name=timer.name, time=duration_str, remaining=utils.format_duration(extended.remaining()))
+            else:
+                dispatcher.utter_message(response='utter_timer_not_found', timer_name=timer.name)
+        return []
+
+
 class ActionRepeatLastUtterance(Action):
     """Repeat the last utterance sent to the user."""
 
     def name(self) -> Text:
         return "action_repeat_last_utterance"
 
+    @timed('action')
+    @utterances.observed
     def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        logger.info(f'Repeating last utterance')
-        for event in reversed(tracker.events):
-            if event.get('event') == 'bot': # Get utterances until a user message is found
-                dispatcher.utter_message(text=event.get('text'))
-                break
+        logger.info('Repeating last utterance')
+        utterance = utterances.last(tracker.sender_id)
+        if utterance is not None:
+            dispatcher.utter_message(**utterance)
         return []
 
 
@@ -283,6 +504,8 @@ class ActionResetListStepsLoop(Action):
     def name(self) -> Text:
         return 'action_reset_list_steps_loop'
 
+    @timed('action')
+    @utterances.observed
     def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         logger.info('Resetting the list_steps_loop slots')
         return [ SlotSet('current_step_idx', -1), SlotSet('list_steps_done', None) ]
@@ -0,0 +1,53 @@
+"""Memoization of the dataset queries."""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Text
+
+
+class QueryCache():
+    """Bounded LRU cache of query results, with hit/miss counters.
+
+    Keys are prefixed by the version of the dataset that computed the result, so the same cache can be shared
+    across dataset versions without ever returning stale results.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get_or_compute(self, version: Text, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Returns the cached result for the given key, computing and storing it if missing."""
+        key = (version, key)
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+        value = compute()  # Computed outside the lock, concurrent misses on the same key just compute it twice
+        if self.max_size > 0:
+            with self._lock:
+                self._items[key] = value
+                self._items.move_to_end(key)
+                while len(self._items) > self.max_size:
+                    self._items.popitem(last=False)
+        return value
+
+    def invalidate(self, version: Optional[Text] = None):
+        """Remove the results computed by versions different from the given one, or all of them if no version is given."""
+        with self._lock:
+            if version is None:
+                self._items.clear()
+            else:
+                for key in [ key for key in self._items if key[0] != version ]:
+                    del self._items[key]
+
+    def stats(self) -> Dict[Text, int]:
+        """Returns the cache counters."""
+        return dict(size=len(self._items), max_size=self.max_size, hits=self.hits, misses=self.misses)
@@ -0,0 +1,158 @@
+"""Dataset stored in memory-mapped numpy arrays, shared by all the actions server processes of a host."""
+import os
+import glob
+import shutil
+import logging
+from collections import Counter
+from typing import List, Optional, Set, Text
+
+import yaml
+import numpy as np
+
+from . import ingest, snapshot
+from .cache import QueryCache
+from .corpus import Corpus, CORPUS_VERSION, ranges
+from .dataset import BaseDataset, Ingredient, Recipe, RecipeProperty, Step, PROJECT_ROOT, RECIPES_PATH, INGREDIENTS_SUBSTITUTES_PATH
+from .index import FIRST_KEY_BASE
+
+logger = logging.getLogger(__name__)
+
+CORPUS_PATH = os.path.join(PROJECT_ROOT, '.cache', 'corpus')
+
+
+class CompactDataset(BaseDataset):
+    """Dataset containing the recipes data used by the agent, stored in a memory-mapped Corpus.
+
+    The corpus is built from the source YAML files in a directory named after their hash, so that the processes
+    loading the same version of the recipes map the same files.
+    """
+
+    def __init__(self, recipes_path: Text = RECIPES_PATH, ingredients_substitutes_path: Text = INGREDIENTS_SUBSTITUTES_PATH,
+                 corpus_path: Text = CORPUS_PATH, recipes_cache_size: int = 1024, query_cache: Optional[QueryCache] = None):
+        super().__init__(recipes_path, ingredients_substitutes_path, recipes_cache_size=recipes_cache_size, query_cache=query_cache)
+        self.corpus_path = corpus_path
+        self.version = snapshot.hash_files([recipes_path, ingredients_substitutes_path], f'corpus-{CORPUS_VERSION}')
+        path = f'{corpus_path}-{self.version[:16]}'
+        self._corpus = Corpus.load(path)
+        if self._corpus is None:
+            self._build(path)
+            self._corpus = Corpus.load(path)
+        self.n_recipes = self._corpus.n_recipes
+        self._set_property_columns(list(zip(self._corpus.property_kinds, self._corpus.property_values.tolist())))
+
+    def reload(self) -> 'CompactDataset':
+        """Returns a new version of the dataset with the current content of the source files."""
+        dataset = CompactDataset(self.recipes_path, self.ingredients_substitutes_path, corpus_path=self.corpus_path,
+                                 recipes_cache_size=self.recipes_cache_size, query_cache=self.query_cache)
+        self.query_cache.invalidate(dataset.version)
+        return dataset
+
+    def _build(self, path: Text):
+        logger.info('Building dataset corpus %s', path)
+        with open(self.ingredients_substitutes_path, 'r', encoding='utf-8') as f:
+            raw_ingredients_substitutes = yaml.load(f, Loader=ingest.YAML_LOADER)
+        recipes = ingest.iter_recipes(self.recipes_path, progress=ingest.log_progress(f'Loading {self.recipes_path}'))
+        corpus = Corpus.build(recipes, [ next(iter(i.items())) for i in raw_ingredients_substitutes ])
+        corpus.save(path)
+        # Remove the previous versions, the processes still using them keep their mapping until they reload
+        for old_path in glob.glob(f'{self.corpus_path}-*'):
+            if old_path != path and not old_path.endswith('.tmp'):
+                shutil.rmtree(old_path, ignore_errors=True)
+
+    @property
+    def recipes(self) -> List[Text]:
+        """Returns a list of all the available recipes titles."""
+        return sorted(set(self._corpus.titles.tolist()))
+
+    @property
+    def ingredients(self) -> List[Text]:
+        """Returns a list of all the available ingredients."""
+        return sorted(self._corpus.ingredient_names.tolist())
+
+    @property
+    def tags(self) -> List[Text]:
+        """Returns a list of all the available tags."""
+        return sorted( value for kind, value in self.property_columns if kind == RecipeProperty.TAG.value )
+
+    @property
+    def cuisines(self) -> List[Text]:
+        """Returns a list of all the available cuisines."""
+        return sorted( value for kind, value in self.property_columns if kind == RecipeProperty.CUISINE.value )
+
+    def get_recipe(self, recipe_id: int) -> Recipe:
+        """Converts a recipe id to the corresponding Recipe objects. The returned recipe is cached and must not be modified."""
+        c = self._corpus
+        recipe_id = int(recipe_id)
+        if not 0 <= recipe_id < self.n_recipes:
+            raise KeyError(recipe_id)
+        image_code, cuisine_code = c.image_codes[recipe_id], c.cuisine_codes[recipe_id]
+        ingredients = range(c.ingredient_offsets[recipe_id], c.ingredient_offsets[recipe_id + 1])
+        steps = range(c.step_offsets[recipe_id], c.step_offsets[recipe_id + 1])
+        return Recipe(
+            id=recipe_id,
+            title=c.titles[recipe_id],
+            image=c.images[image_code] if image_code >= 0 else None,
+            tags=tuple( c.tags[code] for code in c.tag_codes[c.tag_offsets[recipe_id]:c.tag_offsets[recipe_id + 1]] ),
+            cuisine=c.cuisines[cuisine_code] if cuisine_code >= 0 else None,
+            prep_time=int(c.prep_times[recipe_id]),
+            cook_time=int(c.cook_times[recipe_id]),
+            servings=int(c.servings[recipe_id]),
+            ingredients=tuple( Ingredient(recipe_id, c.ingredient_names[c.ingredient_name_codes[i]], float(c.ingredient_amounts[i]),
+                                          c.units[c.ingredient_unit_codes[i]] if c.ingredient_unit_codes[i] >= 0 else None) for i in ingredients ),
+            steps=tuple( Step(recipe_id, step_index, c.steps[i]) for step_index, i in enumerate(steps) ),
+            amounts=np.array(c.ingredient_amounts[ingredients.start:ingredients.stop], dtype=np.float64),
+        )
+
+    def _search_titles(self, keywords: List[Text]) -> Set[int]:
+        recipes_ids = set()
+        for keyword in keywords:
+            recipes_ids.update(self._corpus.titles_lower.find(keyword.lower()).tolist())
+        return recipes_ids
+
+    def _count_ingredients(self, ingredients: List[Text]) -> Counter:
+        matches = np.zeros(len(self._corpus.ingredient_names_lower), dtype=bool)
+        for ingredient in ingredients:
+            matches[self._corpus.ingredient_names_lower.find(ingredient.lower())] = True
+        counts = np.bincount(self._corpus.ingredient_recipes[matches[self._corpus.ingredient_name_codes]], minlength=self.n_recipes)
+        return Counter(dict(zip(np.flatnonzero(counts).tolist(), counts[counts > 0].tolist())))
+
+    def _column_recipes(self, column: int) -> np.ndarray:
+        return self._corpus.column_recipes[self._corpus.column_offsets[column]:self._corpus.column_offsets[column + 1]]
+
+    def _search_tags(self, tags: List[Text]) -> Set[int]:
+        recipes_ids = None
+        for tag in tags:
+            column = self._property_columns_ids.get((RecipeProperty.TAG.value, tag))
+            if column is None:
+                return set()
+            recipes_ids = self._column_recipes(column) if recipes_ids is None else np.intersect1d(recipes_ids, self._column_recipes(column), assume_unique=True)
+        return set(recipes_ids.tolist()) if recipes_ids is not None else set()
+
+    def _search_cuisine(self, cuisine: Text) -> Set[int]:
+        recipes_ids = set()
+        for column in self._corpus.property_values_lower.find(cuisine.lower()).tolist():
+            if self.property_columns[column][0] == RecipeProperty.CUISINE.value:
+                recipes_ids.update(self._column_recipes(column).tolist())
+        return recipes_ids
+
+    def _search_ingredients_substitutes(self, ingredients: List[Text]) -> List[Text]:
+        matches = set()
+        for ingredient in (ingredients if len(ingredients) > 0 else ['']):
+            matches.update(self._corpus.substitute_names_lower.find(ingredient.lower()).tolist())
+        return list(dict.fromkeys( self._corpus.substitutes[i] for i in sorted(matches) ))  # Unique, in order of appearance
+
+    def _properties_counts(self, rows: np.ndarray) -> np.ndarray:
+        items = ranges(self._corpus.property_offsets, rows)
+        return np.bincount(self._corpus.property_columns[items], minlength=len(self.property_columns))
+
+    def _properties_first_keys(self, rows: np.ndarray) -> np.ndarray:
+        items = ranges(self._corpus.property_offsets, rows)
+        first_keys = np.full(len(self.property_columns), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first_keys, self._corpus.property_columns[items], self._corpus.property_recipes[items] * FIRST_KEY_BASE + self._corpus.property_positions[items])
+        first_keys[first_keys == np.iinfo(np.int64).max] = -1
+        return first_keys
+
+    def _properties_mask(self, rows: np.ndarray, columns: List[int]) -> np.ndarray:
+        items = ranges(self._corpus.property_offsets, rows)
+        items = items[np.isin(self._corpus.property_columns[items], columns)]
+        return np.isin(rows, self._corpus.property_recipes[items])
@@ -0,0 +1,195 @@
+"""Compact representation of the recipes in numpy arrays, that can be memory-mapped and shared between processes."""
+import os
+import re
+import json
+import shutil
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+import numpy as np
+
+from . import ingest, quantities
+
+# Increase when the layout of the arrays changes
+CORPUS_VERSION = 2
+
+
+class StringTable():
+    """Strings stored in a single UTF-8 buffer, each followed by a NUL byte, with the offset where each one starts.
+
+    Substring queries scan the whole buffer with a single regex search, the NUL separators prevent matches across strings.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, strings: Iterable[Text]) -> 'StringTable':
+        data, offsets = bytearray(), [0]
+        for string in strings:
+            data += string.encode('utf-8') + b'\0'
+            offsets.append(len(data))
+        return cls(np.frombuffer(bytes(data), dtype=np.uint8), np.array(offsets, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Text:
+        return self.data[self.offsets[i]:self.offsets[i + 1] - 1].tobytes().decode('utf-8')
+
+    def tolist(self) -> List[Text]:
+        return self.data.tobytes().decode('utf-8').split('\0')[:-1]
+
+    def find(self, term: Text) -> np.ndarray:
+        """Returns the sorted indices of the strings containing the given term."""
+        if term == '':
+            return np.arange(len(self))
+        pattern = re.compile(re.escape(term.encode('utf-8')))
+        positions = np.fromiter(( m.start() for m in pattern.finditer(memoryview(self.data)) ), dtype=np.int64)
+        return np.unique(np.searchsorted(self.offsets, positions, side='right') - 1)
+
+
+class Vocabulary():
+    """Builder of a table of distinct strings, mapping each string to its code (None to -1)."""
+
+    def __init__(self):
+        self.codes: Dict[Text, int] = {}
+
+    def __call__(self, string: Optional[Text]) -> int:
+        if string is None:
+            return -1
+        return self.codes.setdefault(string, len(self.codes))
+
+    def table(self, lower: bool = False) -> StringTable:
+        return StringTable.build( string.lower() if lower else string for string in self.codes )
+
+
+def ranges(offsets: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Returns the indices of the items of the given rows, in a CSR layout where row i has the items offsets[i]:offsets[i+1]."""
+    starts, ends = offsets[rows], offsets[rows + 1]
+    lengths = ends - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Index of each item: start of its row + position in the row
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+class Corpus():
+    """Recipes stored as numpy arrays: strings in StringTables, categorical values as integer codes and the ingredients,
+    steps and properties of each recipe as CSR ranges.
+
+    The arrays are saved as .npy files and memory-mapped read-only when loaded: all the processes loading the same
+    corpus share a single copy in the page cache, which is never written to (unlike python objects, whose reference
+    counts dirty the pages they are stored in).
+    """
+
+    def __init__(self, arrays: Dict[Text, np.ndarray], meta: Dict[Text, Any]):
+        self.arrays = arrays
+        self.meta = meta
+        self.n_recipes: int = meta['n_recipes']
+        self.property_kinds: List[Text] = meta['property_kinds']
+        for name in meta['tables']:
+            setattr(self, name, StringTable(arrays[f'{name}.data'], arrays[f'{name}.offsets']))
+        for name in meta['columns']:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def build(cls, recipes: Iterable[Dict[Text, Any]], substitutes: List[Tuple[Text, Text]]) -> 'Corpus':
+        """Build the corpus from the parsed recipes and (ingredient, substitute) pairs."""
+        images, cuisines, tags, names, units, properties = Vocabulary(), Vocabulary(), Vocabulary(), Vocabulary(), Vocabulary(), Vocabulary()
+        property_kinds = []
+        columns = { name: [] for name in ['image_codes', 'cuisine_codes', 'prep_times', 'cook_times', 'servings', 'tag_offsets', 'tag_codes',
+                                          'ingredient_offsets', 'ingredient_recipes', 'ingredient_name_codes', 'ingredient_amounts', 'ingredient_unit_codes',
+                                          'step_offsets', 'property_offsets', 'property_recipes', 'property_columns', 'property_positions'] }
+        titles, steps = [], []
+        for name in ['tag_offsets', 'ingredient_offsets', 'step_offsets', 'property_offsets']:
+            columns[name].append(0)
+        for recipe_id, recipe in enumerate(recipes):
+            recipe_tags = ingest.recipe_tags(recipe)
+            titles.append(recipe['title'])
+            columns['image_codes'].append(images(recipe.get('image')))
+            columns['cuisine_codes'].append(cuisines(recipe.get('cuisine')))
+            columns['prep_times'].append(recipe['prep_time'])
+            columns['cook_times'].append(recipe['cook_time'])
+            columns['servings'].append(recipe['servings'])
+            columns['tag_codes'] += [ tags(tag) for tag in recipe_tags ]
+            columns['tag_offsets'].append(len(columns['tag_codes']))
+            for ingredient in recipe['ingredients']:
+                amount, unit = quantities.parse_amount(ingredient.get('amount'))
+                columns['ingredient_recipes'].append(recipe_id)
+                columns['ingredient_name_codes'].append(names(ingredient['name']))
+                columns['ingredient_amounts'].append(amount if amount is not None else np.nan)
+                columns['ingredient_unit_codes'].append(units(unit))
+            columns['ingredient_offsets'].append(len(columns['ingredient_recipes']))
+            steps += recipe['steps']
+            columns['step_offsets'].append(len(steps))
+            # Properties (tags, then cuisine) sorted by first appearance, each one at most once per recipe
+            recipe_properties = {}
+            for kind, values in (('tag', recipe_tags), ('cuisine', [recipe['cuisine']] if recipe.get('cuisine') is not None else [])):
+                for position, value in enumerate(values):
+                    column = properties(f'{kind}\0{value}')
+                    if column == len(property_kinds):
+                        property_kinds.append(kind)
+                    recipe_properties.setdefault(column, position)
+            for column, position in recipe_properties.items():
+                columns['property_recipes'].append(recipe_id)
+                columns['property_columns'].append(column)
+                columns['property_positions'].append(position)
+            columns['property_offsets'].append(len(columns['property_recipes']))
+        dtypes = dict(ingredient_amounts=np.float64, property_positions=np.int16)
+        arrays = { name: np.array(values, dtype=dtypes.get(name, np.int64)) for name, values in columns.items() }
+        # Recipes of each property, sorted by property and recipe, to get the recipes having a property without a scan
+        order = np.lexsort((arrays['property_recipes'], arrays['property_columns']))
+        arrays['column_recipes'] = arrays['property_recipes'][order]
+        arrays['column_offsets'] = np.searchsorted(arrays['property_columns'][order], np.arange(len(property_kinds) + 1))
+        tables = dict(
+            titles=StringTable.build(titles),
+            titles_lower=StringTable.build( title.lower() for title in titles ),
+            images=images.table(),
+            cuisines=cuisines.table(),
+            tags=tags.table(),
+            ingredient_names=names.table(),
+            ingredient_names_lower=names.table(lower=True),
+            units=units.table(),
+            steps=StringTable.build(steps),
+            property_values=StringTable.build( key.split('\0', 1)[1] for key in properties.codes ),
+            property_values_lower=StringTable.build( key.split('\0', 1)[1].lower() for key in properties.codes ),
+            substitute_names_lower=StringTable.build( name.lower() for name, _ in substitutes ),
+            substitutes=StringTable.build( substitute for _, substitute in substitutes ),
+        )
+        for name, table in tables.items():
+            arrays[f'{name}.data'], arrays[f'{name}.offsets'] = table.data, table.offsets
+        meta = dict(version=CORPUS_VERSION, n_recipes=len(titles), property_kinds=property_kinds, tables=list(tables), columns=[ name for name in arrays if '.' not in name ])
+        return cls(arrays, meta)
+
+    def save(self, path: Text):
+        """Save the corpus in the given directory. The directory is written atomically, and left as is if it already exists."""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:  # Already saved by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: Text) -> Optional['Corpus']:
+        """Memory-map the corpus saved in the given directory, returns None if missing or saved by a different version."""
+        try:
+            with open(os.path.join(path, 'meta.json'), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != CORPUS_VERSION:
+            return None
+        arrays = {}
+        for name in meta['columns'] + [ f'{table}.{part}' for table in meta['tables'] for part in ['data', 'offsets'] ]:
+            try:
+                arrays[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            except ValueError:  # Empty arrays can't be memory-mapped
+                arrays[name] = np.load(os.path.join(path, f'{name}.npy'))
+        return cls(arrays, meta)
@@ -1,17 +1,24 @@
 import os
-import yaml
+import re
+import heapq
 import numpy as np
-import pandas as pd
-from dataclasses import dataclass
-from collections import defaultdict
+from dataclasses import dataclass, field, replace
+from collections import Counter
+from functools import lru_cache
 from enum import Enum
-from typing import List, Text, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Set, Text, Optional, Tuple
+
+from . import quantities
+from .cache import QueryCache
+from .metrics import timed
 
 PROJECT_ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+RECIPES_PATH = os.path.join(PROJECT_ROOT, 'data', 'recipes', 'recipes.yml')
+INGREDIENTS_SUBSTITUTES_PATH = os.path.join(PROJECT_ROOT, 'data', 'recipes', 'ingredients_substitutes.yml')
 
-@dataclass
+@dataclass(frozen=True)
 class Ingredient:
-    recipe_id: int
+    recipe_id: Optional[int]  # None for the ingredients of a shopping list of several recipes
     name: Text
     amount: Optional[float]
     unit: Optional[Text]
@@ -19,8 +26,8 @@ class Ingredient:
     def to_str(self, default_amount: Text = '') -> Text:
         res = ''
         if self.amount is not None and not np.isnan(self.amount): 
-            res += f'{self.amount:{ ".0f" if self.amount.is_integer() else ".1f"}}'
-            res += f'{self.unit} of ' if self.unit else ' '
+            res += quantities.format_quantity(self.amount, self.unit)
+            res += ' of ' if self.unit else ' '
         elif default_amount:
             res += f'{default_amount} '
         res += self.name
@@ -30,7 +37,7 @@ class Ingredient:
         return self.to_str()
 
 
-@dataclass
+@dataclass(frozen=True)
 class Step:
     recipe_id: int
     step_index: int
@@ -40,23 +47,115 @@ class Step:
         return self.description
 
 
-@dataclass
+@dataclass(frozen=True)
 class Recipe:
     id: int
     title: Text
     image: Optional[Text]
-    tags: List[Text]
+    tags: Tuple[Text, ...]
     cuisine: Optional[Text]
     prep_time: int
     cook_time: int
     servings: int
-    ingredients: List[Ingredient]
-    steps: List[Step]
+    ingredients: Tuple[Ingredient, ...]
+    steps: Tuple[Step, ...]
+    amounts: np.ndarray = field(default=None, repr=False, compare=False)  # Amounts of the ingredients, NaN if missing
+
+    def __post_init__(self):
+        if self.amounts is None:  # Not given by the storage backend
+            object.__setattr__(self, 'amounts', np.array([ np.nan if ingredient.amount is None else ingredient.amount for ingredient in self.ingredients ], dtype=np.float64))
+        self.amounts.flags.writeable = False  # Shared by the copies of the cached recipe
+
+    def set_servings(self, servings: int) -> 'Recipe':
+        """Returns a copy of the recipe with the ingredients amounts scaled to the given servings."""
+        amounts = np.ceil(self.amounts * (servings / self.servings))
+        ingredients = tuple( replace(ingredient, amount=amount) for ingredient, amount in zip(self.ingredients, amounts.tolist()) )
+        return replace(self, servings=servings, ingredients=ingredients, amounts=amounts)
+
+
+def shopping_list(recipes: Iterable[Tuple[Recipe, Optional[int]]]) -> List[Ingredient]:
+    """Returns the ingredients needed to cook the given (recipe, servings) pairs, the recipe servings if None.
+
+    The amounts are scaled as in Recipe.set_servings, converted to the base unit of their dimension (see quantities.UNITS)
+    and summed for each ingredient name, then shown in the largest unit they do not exceed. Ingredients without an amount
+    are listed only if no amount of them is needed. Ingredients are sorted by first appearance.
+    """
+    recipes = list(recipes)
+    ingredients = [ ingredient for recipe, _ in recipes for ingredient in recipe.ingredients ]
+    if len(ingredients) == 0:
+        return []
+    # Scale and convert all the amounts at once
+    ratios = np.repeat([ servings / recipe.servings if servings is not None else 1.0 for recipe, servings in recipes ], [ len(recipe.ingredients) for recipe, _ in recipes ])
+    amounts = np.concatenate([ recipe.amounts for recipe, _ in recipes ])
+    groups, sizes = quantities.unit_sizes([ ingredient.unit for ingredient in ingredients ])
+    base_amounts = np.ceil(amounts * ratios) * sizes
+    # Sum the amounts of each (name, group)
+    keys = {}
+    key_ids = np.array([ keys.setdefault((ingredient.name.lower(), group if not np.isnan(amount) else None), len(keys)) for ingredient, group, amount in zip(ingredients, groups, base_amounts) ])
+    totals = np.bincount(key_ids, weights=np.nan_to_num(base_amounts), minlength=len(keys))
+    firsts = np.full(len(keys), len(ingredients))
+    np.minimum.at(firsts, key_ids, np.arange(len(ingredients)))
+    quantified = { name for name, group in keys if group is not None }
+    recipe_id = recipes[0][0].id if len(recipes) == 1 else None
+    result = []
+    for (name, group), total, first in zip(keys, totals.tolist(), firsts.tolist()):
+        if group is None:
+            if name not in quantified:
+                result.append(Ingredient(recipe_id, ingredients[first].name, None, None))
+            continue
+        amount, unit = quantities.to_display_unit(total, group)
+        result.append(Ingredient(recipe_id, ingredients[first].name, amount, unit))
+    return result
+
+
+def keyword_stem(word: Text) -> Text:
+    """Lowercase word without the plural "s", to match e.g. "eggs" with "egg"."""
+    word = word.lower()
+    return word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+
+
+@dataclass(frozen=True)
+class StepIndex:
+    """Steps of a recipe prepared for the step-by-step navigation."""
+    recipe_id: int
+    descriptions: Tuple[Text, ...]  # With the first letter lowered, to be read after an introduction (e.g. "Then, ...")
+    keywords: Dict[Text, Tuple[int, ...]]  # Indices of the steps mentioning each ingredient name and word (stemmed)
+
+    @classmethod
+    def build(cls, recipe: Recipe) -> 'StepIndex':
+        keywords: Dict[Text, List[int]] = {}
+        steps_words = [ [ keyword_stem(word) for word in re.findall(r'[a-z]{3,}', step.description.lower()) ] for step in recipe.steps ]
+        for step_index, words in enumerate(steps_words):
+            for word in dict.fromkeys(words):
+                keywords.setdefault(word, []).append(step_index)
+        # Ingredients names, matched by all their words (e.g. "garlic cloves" in "Add the garlic and the cloves")
+        for ingredient in recipe.ingredients:
+            name = ' '.join( keyword_stem(word) for word in ingredient.name.split() )
+            if ' ' in name and name not in keywords:
+                name_words = set(name.split())
+                steps = [ step_index for step_index, words in enumerate(steps_words) if name_words.issubset(words) ]
+                if len(steps) > 0:
+                    keywords[name] = steps
+        return cls(
+            recipe_id=recipe.id,
+            descriptions=tuple( step.description[:1].lower() + step.description[1:] for step in recipe.steps ),
+            keywords={ keyword: tuple(steps) for keyword, steps in keywords.items() },
+        )
+
+    def __len__(self) -> int:
+        return len(self.descriptions)
 
-    def set_servings(self, servings: int):
-        for ingredient in self.ingredients:
-            ingredient.amount = np.ceil(ingredient.amount * (servings / self.servings))
-        self.servings = servings
+    def steps_left(self, current_step_idx: int) -> int:
+        """Returns the number of steps after the current one, all of them if the reading did not start (-1)."""
+        return len(self.descriptions) - current_step_idx - 1
+
+    def find(self, term: Text) -> Tuple[int, ...]:
+        """Returns the indices of the steps mentioning the given ingredient or word, or any of the words of the term."""
+        words = [ keyword_stem(word) for word in term.split() ]
+        steps = self.keywords.get(' '.join(words))
+        if steps is None:
+            steps = tuple(sorted({ step_index for word in words for step_index in self.keywords.get(word, ()) }))
+        return steps
 
 
 class RecipeProperty(str, Enum):
@@ -67,103 +166,191 @@ class RecipeProperty(str, Enum):
 
 
 
-class Dataset():
-    """Dataset containing the recipes data used by the agent."""
-
-    def __init__(self):
-        # Load the data
-        recipes_path = os.path.join(PROJECT_ROOT, 'data', 'recipes', 'recipes.yml')
-        with open(recipes_path, 'r', encoding='utf-8') as f:
-            raw_recipes = yaml.load(f, Loader=yaml.FullLoader)
-        ingredients_substitutes_path = os.path.join(PROJECT_ROOT, 'data', 'recipes', 'ingredients_substitutes.yml')
-        with open(ingredients_substitutes_path, 'r', encoding='utf-8') as f:
-            raw_ingredients_substitutes = yaml.load(f, Loader=yaml.FullLoader)
-        # Convert to DataFrame
-        self._df_recipes = pd.DataFrame([ dict(id=i, **r) for i, r in enumerate(raw_recipes)])
-        self._df_ingredients = pd.DataFrame([ dict(recipe_id=i, **ingr) for i, r in enumerate(raw_recipes) for ingr in r['ingredients'] ])
-        self._df_steps = pd.DataFrame([ dict(recipe_id=i, step_index=j, description=desc) for i, r in enumerate(raw_recipes) for j, desc in enumerate(r['steps']) ])
-        self._df_ingredients_substitutes = pd.DataFrame([next(iter(i.items())) for i  in raw_ingredients_substitutes], columns=['name', 'substitute'])
-        # Post-processing
-        self._df_recipes = self._df_recipes.drop(['ingredients', 'steps'], axis=1).set_index('id')
-        self._df_recipes[(self._df_recipes.prep_time + self._df_recipes.cook_time) < 30]['tags'].apply(lambda tags: tags.append('quick'))  # Add "quick" tag to short recipes
-        self._df_ingredients[['amount', 'unit']] = self._df_ingredients.amount.fillna('').astype(str).str.split(r'(\d+)(.*)', expand=True)[[1,2]]
-        self._df_ingredients['amount'] = self._df_ingredients['amount'].astype(float)
+class BaseDataset():
+    """Base class of the datasets containing the recipes data used by the agent.
+
+    Subclasses implement the storage backend: they store the recipes with ids from 0 to n_recipes - 1 and implement the
+    lookups used by the queries below, which take care of normalizing, memoizing and ranking the results.
+    """
+
+    def __init__(self, recipes_path: Text, ingredients_substitutes_path: Text, recipes_cache_size: int = 1024, query_cache: Optional[QueryCache] = None):
+        self.recipes_path = recipes_path
+        self.ingredients_substitutes_path = ingredients_substitutes_path
+        self.recipes_cache_size = recipes_cache_size
+        self.get_recipe = timed('dataset')(lru_cache(maxsize=recipes_cache_size)(self.get_recipe))  # Recipes are immutable, so they can be shared between requests
+        self.get_step_index = timed('dataset')(lru_cache(maxsize=recipes_cache_size)(self.get_step_index))
+        self.query_cache = query_cache if query_cache is not None else QueryCache()  # Results of the most frequent queries
+        self.version: Text = ''
+        self.n_recipes = 0
+        self.property_columns: List[Tuple[Text, Text]] = []  # (kind, value) of each recipe property, sorted by first appearance
+
+    def _memoize(self, key: Tuple, compute: Callable[[], Any]) -> Any:
+        """Returns the memoized result of the given query, computing it if missing."""
+        return self.query_cache.get_or_compute(self.version, key, compute)
+
+    def _set_property_columns(self, columns: List[Tuple[Text, Text]]):
+        self.property_columns = columns
+        self._property_kinds = np.array([ kind for kind, _ in columns ], dtype=object)
+        self._property_columns_ids = { (kind, value): i for i, (kind, value) in enumerate(columns) }
+
+    def _rows(self, recipes_ids: Iterable[int]) -> np.ndarray:
+        """Sorted ids of the given recipes, ignoring unknown and duplicated ids."""
+        rows = np.unique(np.fromiter(recipes_ids, dtype=np.int64))
+        return rows[(rows >= 0) & (rows < self.n_recipes)]
 
     @property
     def recipes(self) -> List[Text]:
         """Returns a list of all the available recipes titles."""
-        return sorted(self._df_recipes.title.unique().tolist())
+        raise NotImplementedError
 
     @property
     def ingredients(self) -> List[Text]:
         """Returns a list of all the available ingredients."""
-        return sorted(self._df_ingredients.name.unique().tolist())
+        raise NotImplementedError
 
     @property
     def tags(self) -> List[Text]:
         """Returns a list of all the available tags."""
-        return sorted(self._df_recipes.tags.explode().dropna().unique().tolist())
+        raise NotImplementedError
 
     @property
     def cuisines(self) -> List[Text]:
         """Returns a list of all the available cuisines."""
-        return sorted(self._df_recipes.cuisine.dropna().unique().tolist())
+        raise NotImplementedError
 
     def get_recipe(self, recipe_id: int) -> Recipe:
-        """Converts a recipe id to the corresponding Recipe objects."""
-        df_recipe = self._df_recipes.loc[recipe_id]
-        df_ingredients = self._df_ingredients[self._df_ingredients.recipe_id == recipe_id]
-        df_steps = self._df_steps[self._df_steps.recipe_id == recipe_id].sort_values(by='step_index')
-        ingredients = [ Ingredient(**ingr) for ingr in df_ingredients.to_dict('records') ]
-        steps = [ Step(**step) for step in df_steps.to_dict('records') ]
-        recipe = Recipe(id=recipe_id, **df_recipe, ingredients=ingredients, steps=steps)
-        return recipe
-
-    def search_recipes(self, keywords: List[Text], ingredients: List[Text], tags: List[Text], cuisine: Optional[Text]) -> List[int]:
-        """Search for recipes matching the given keywords, ingredients, tags and cuisine."""
+        """Converts a recipe id to the corresponding Recipe objects. The returned recipe is cached and must not be modified."""
+        raise NotImplementedError
+
+    def get_step_index(self, recipe_id: int) -> StepIndex:
+        """Returns the steps of a recipe indexed for the navigation, built once per recipe. The returned index is cached and must not be modified."""
+        return StepIndex.build(self.get_recipe(recipe_id))
+
+    def reload(self) -> 'BaseDataset':
+        """Returns a new version of the dataset with the current content of the source files."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources of this version of the dataset, once it has been replaced by a new version."""
+        pass
+
+    # Lookups implemented by the storage backends
+
+    def _search_titles(self, keywords: List[Text]) -> Set[int]:
+        """Recipes whose title contains any of the keywords."""
+        raise NotImplementedError
+
+    def _count_ingredients(self, ingredients: List[Text]) -> Counter:
+        """Number of ingredients of each recipe containing any of the given ones."""
+        raise NotImplementedError
+
+    def _search_tags(self, tags: List[Text]) -> Set[int]:
+        """Recipes having all the given tags (at least one)."""
+        raise NotImplementedError
+
+    def _search_cuisine(self, cuisine: Text) -> Set[int]:
+        """Recipes whose cuisine contains the given one."""
+        raise NotImplementedError
+
+    def _search_ingredients_substitutes(self, ingredients: List[Text]) -> List[Text]:
+        """Substitutes of the ingredients containing any of the given ones, in order of appearance."""
+        raise NotImplementedError
+
+    def _properties_counts(self, rows: np.ndarray) -> np.ndarray:
+        """Number of the given recipes having each property."""
+        raise NotImplementedError
+
+    def _properties_first_keys(self, rows: np.ndarray) -> np.ndarray:
+        """Order of the first appearance of each property in the given recipes, as recipe_id * 2^15 + position (-1 if missing)."""
+        raise NotImplementedError
+
+    def _properties_mask(self, rows: np.ndarray, columns: List[int]) -> np.ndarray:
+        """Mask of the given recipes having any of the given properties."""
+        raise NotImplementedError
+
+    # Queries
+
+    @timed('dataset', sized=True)
+    def search_recipes(self, keywords: List[Text], ingredients: List[Text], tags: List[Text], cuisine: Optional[Text], top_k: Optional[int] = None) -> List[int]:
+        """Search for recipes matching the given keywords, ingredients, tags and cuisine.
+
+        By default all the recipes found are returned, sorted by id. If top_k is given, only the top_k most relevant recipes
+        are returned, sorted by relevance.
+        """
+        # Normalize the query (the search is case-insensitive and does not depend on the order nor on duplicates, e.g. an
+        # entity found by several extractors), so that it can be memoized
+        keywords = sorted(set(k.lower() for k in keywords))
+        ingredients = sorted(set(i.lower() for i in ingredients))
+        tags = sorted(set(t.lower() for t in tags))
+        cuisine = cuisine.lower() if cuisine is not None else None
+        key = ('search_recipes', tuple(keywords), tuple(ingredients), tuple(tags), cuisine, top_k)
+        return list(self._memoize(key, lambda: tuple(self._search_recipes(keywords, ingredients, tags, cuisine, top_k))))
+
+    def _search_recipes(self, keywords: List[Text], ingredients: List[Text], tags: List[Text], cuisine: Optional[Text], top_k: Optional[int]) -> List[int]:
         # Pre-processing
-        tags = set(t.lower() for t in tags)
         keywords = [ k for k in keywords if k not in tags and k != cuisine ]
         ingredients = [ i for i in ingredients if i not in tags and i != cuisine ]
-        # Search with filters
-        recipes_mask = True
+        # Search with filters, by intersecting the recipes found by each index, starting from the first one (all the
+        # recipes are enumerated only if there is no filter)
+        filters: List[Callable[[], Set[int]]] = []
         if len(keywords) > 0:
-            recipes_mask &= self._df_recipes['title'].str.contains('|'.join(keywords + ingredients), case=False) # Any of the keywords (use also the ingredients)
+            filters.append(lambda: self._search_titles(keywords + ingredients)) # Any of the keywords (use also the ingredients)
         if len(ingredients) > 0:
-            results = self._df_ingredients[self._df_ingredients['name'].str.contains('|'.join(ingredients), case=False)] # All of the ingredients
-            results = results.groupby('recipe_id', as_index=False).name.count().rename(columns=dict(name='count')) # Count number of ingredients occurences
-            results = results[results['count'] == len(ingredients)].recipe_id.to_list() # Returns only the recipes containing all the given ingredients
-            recipes_mask &= self._df_recipes.index.isin(results)
+            filters.append(lambda: { recipe_id for recipe_id, count in self._count_ingredients(ingredients).items() if count == len(ingredients) }) # All of the ingredients
         if len(tags) > 0:
-            recipes_mask &= self._df_recipes['tags'].apply(tags.issubset) # All of the tags
+            filters.append(lambda: self._search_tags(tags)) # All of the tags
         if cuisine is not None:
-            recipes_mask &= self._df_recipes['cuisine'].str.contains(cuisine, case=False)
-        recipe_ids = self._df_recipes[recipes_mask].index.tolist()
-        return recipe_ids
+            filters.append(lambda: self._search_cuisine(cuisine))
+        recipe_ids: Optional[Set[int]] = None
+        for search in filters:
+            recipe_ids = search() if recipe_ids is None else recipe_ids & search()
+            if len(recipe_ids) == 0:
+                break
+        if recipe_ids is None:
+            recipe_ids = set(range(self.n_recipes))
+        if top_k is None:
+            return sorted(recipe_ids)
+        # Rank by number of matched keywords (tags and cuisine are required, so they are matched by all the recipes)
+        scores = Counter()
+        for keyword in (keywords + ingredients if len(keywords) > 0 else []):
+            scores.update(self._search_titles([keyword]) & recipe_ids)
+        for ingredient in ingredients:
+            scores.update(set(self._count_ingredients([ingredient])) & recipe_ids)
+        return heapq.nlargest(top_k, recipe_ids, key=lambda recipe_id: (scores[recipe_id], -recipe_id))  # Break ties by id
 
+    @timed('dataset', sized=True)
     def search_ingredients_substitutes(self, ingredients: List[Text]) -> List[Text]:
         """Search for an alternative to the given ingredient."""
-        substitutes = self._df_ingredients_substitutes[self._df_ingredients_substitutes['name'].str.contains('|'.join(ingredients), case=False)].substitute.unique().tolist()
-        return substitutes
+        ingredients = sorted(set(i.lower() for i in ingredients))
+        return list(self._memoize(('search_ingredients_substitutes', tuple(ingredients)), lambda: tuple(self._search_ingredients_substitutes(ingredients))))
 
+    @timed('dataset')
     def get_discriminative_properties(self, recipes_ids: List[int]) -> Tuple[RecipeProperty, Text]:
         """Returns a list of recipe properties that are present (or not present) in a single recipe from the given group."""
-        recipes = self._df_recipes[self._df_recipes.index.isin(recipes_ids)]
-        n_recipes = len(recipes)
-        # Try to search for a discriminative property by counting their occurences
-        properties = { RecipeProperty.TAG: defaultdict(int), RecipeProperty.CUISINE: defaultdict(int) }
-        for recipe in recipes.itertuples():
-            for tag in recipe.tags:
-                properties[RecipeProperty.TAG][tag] += 1
-            if recipe.cuisine is not None:
-                properties[RecipeProperty.CUISINE][recipe.cuisine] += 1
+        rows = self._rows(recipes_ids)
+        return self._memoize(('get_discriminative_properties', rows.tobytes()), lambda: self._get_discriminative_properties(rows))
+
+    def _get_discriminative_properties(self, rows: np.ndarray) -> Tuple[RecipeProperty, Text]:
+        n_recipes = len(rows)
+        # Count the occurences of each property in the given recipes
+        counts = self._properties_counts(rows)
+        first_keys = None
         # Get most discrimaniting properties name, based on the number of times they appear (or not appear) in the given recipes.
         discriminative_properties = []
-        for pname, pcounts in properties.items():
-            if len(pcounts) > 0:
-                pcounts = { k: min(c, n_recipes - c) for k, c in pcounts.items() if c < n_recipes }
-                best_value, best_count = min(pcounts.items(), key=lambda item: item[1]) if len(pcounts) > 0 else (None, float('inf'))
-                discriminative_properties.append((pname, best_value, best_count))
+        for pname in RecipeProperty:
+            columns = np.flatnonzero(self._property_kinds == pname.value)
+            pcounts = counts[columns]
+            if (pcounts > 0).any():
+                columns, pcounts = columns[(pcounts > 0) & (pcounts < n_recipes)], pcounts[(pcounts > 0) & (pcounts < n_recipes)]
+                if len(columns) > 0:
+                    pcounts = np.minimum(pcounts, n_recipes - pcounts)
+                    best_columns = columns[pcounts == pcounts.min()]
+                    if len(best_columns) > 1:  # Break ties by order of appearance
+                        first_keys = self._properties_first_keys(rows) if first_keys is None else first_keys
+                        best_columns = best_columns[[first_keys[best_columns].argmin()]]
+                    discriminative_properties.append((pname, self.property_columns[best_columns[0]][1], pcounts.min()))
+                else:
+                    discriminative_properties.append((pname, None, float('inf')))
         # Between the properties types, return the one with the lowest count
         if len(discriminative_properties) > 0:
             prop, pvalue, _ = min(discriminative_properties, key=lambda item: item[2])
@@ -171,16 +358,64 @@ class Dataset():
             prop, pvalue = None, None
         return prop, pvalue
 
+    @timed('dataset')
+    def plan_refinement_question(self, recipes_ids: List[int], asked_properties: List[Tuple[RecipeProperty, Text]] = ()) -> Tuple[Optional[RecipeProperty], Optional[Text]]:
+        """Returns the property to ask the user about to narrow down the given recipes, excluding the already asked ones.
+
+        The chosen property minimizes the expected number of remaining recipes after the (yes or no) answer, i.e. it splits
+        the recipes as evenly as possible, so that the recipes are narrowed down to one in about log2(n) questions.
+        """
+        rows = self._rows(recipes_ids)
+        n_recipes = len(rows)
+        counts = self._properties_counts(rows).astype(float)
+        # Expected remaining recipes, times n_recipes: with p=c/n, p*c + (1-p)*(n-c)
+        expected_remaining = counts ** 2 + (n_recipes - counts) ** 2
+        expected_remaining[(counts == 0) | (counts == n_recipes)] = np.inf  # Questions that do not split the recipes
+        for prop, value in asked_properties:
+            column = self._property_columns_ids.get((str(prop), value))
+            if column is not None:
+                expected_remaining[column] = np.inf
+        if len(expected_remaining) == 0 or np.isinf(expected_remaining.min()):
+            return None, None
+        prop, value = self.property_columns[int(expected_remaining.argmin())]
+        return RecipeProperty(prop), value
+
+    @timed('dataset', sized=True)
     def filter_recipes_by_property(self, recipes_ids: List[int], prop: RecipeProperty, value: Text, negative: bool = False) -> List[int]:
         """Filter the given recipes by the given property value."""
-        recipes = self._df_recipes[self._df_recipes.index.isin(recipes_ids)]
+        rows = self._rows(recipes_ids)
         if prop == RecipeProperty.TAG:
-            filtered_recipes_mask = recipes['tags'].apply(lambda tags: value in tags)
+            columns = [ i for i, (k, v) in enumerate(self.property_columns) if k == RecipeProperty.TAG.value and v == value ]
         elif prop == RecipeProperty.CUISINE:
-            filtered_recipes_mask = recipes['cuisine'].str.contains(value, case=False).fillna(False)
+            columns = [ i for i, (k, v) in enumerate(self.property_columns) if k == RecipeProperty.CUISINE.value and value.lower() in v.lower() ]
         else:
             raise ValueError(f'Unknown property: {prop}')
+        filtered_recipes_mask = self._properties_mask(rows, columns)
         if negative:
             filtered_recipes_mask = ~filtered_recipes_mask
-        filtered_recipes_ids = recipes[filtered_recipes_mask].index.tolist()
+        filtered_recipes_ids = rows[filtered_recipes_mask].tolist()
         return filtered_recipes_ids
+
+
+def load_dataset(backend: Optional[Text] = None, **kwargs) -> BaseDataset:
+    """Load the dataset with the given storage backend, "pandas" (in memory), "compact" (memory-mapped arrays, shared
+    between processes) or "sqlite" (on disk). By default the backend is read from the DATASET_BACKEND environment variable."""
+    backend = (backend or os.environ.get('DATASET_BACKEND') or 'pandas').lower()
+    if backend == 'pandas':
+        from .pandas_dataset import Dataset
+        return Dataset(**kwargs)
+    if backend == 'compact':
+        from .compact_dataset import CompactDataset
+        return CompactDataset(**kwargs)
+    if backend == 'sqlite':
+        from .sqlite_dataset import SqliteDataset
+        return SqliteDataset(**kwargs)
+    raise ValueError(f'Unknown dataset backend: {backend}')
+
+
+def __getattr__(name: Text) -> Any:
+    # The pandas backend is imported on first use, so that importing this module does not import pandas
+    if name == 'Dataset':
+        from .pandas_dataset import Dataset
+        return Dataset
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
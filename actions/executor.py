@@ -0,0 +1,99 @@
+"""Execution of the dataset queries out of the asyncio event loop of the actions server."""
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional, Text
+
+from .dataset import BaseDataset
+from .reload import DatasetReloader
+
+# Dataset of the current worker process, when running the queries in a process pool
+_worker_datasets: Optional[DatasetReloader] = None
+
+
+def _init_worker(load: Callable[[], BaseDataset], interval: Optional[float]):
+    global _worker_datasets
+    _worker_datasets = DatasetReloader(load, interval=interval)
+
+
+def _wait_worker() -> Text:
+    return _worker_datasets.get().version
+
+
+def _call_in_worker(method: Text, args: tuple, kwargs: dict) -> Any:
+    return getattr(_worker_datasets.get(), method)(*args, **kwargs)
+
+
+class AsyncDataset():
+    """Proxy of a dataset, whose methods are coroutines running the queries in the executor."""
+
+    def __init__(self, executor: 'DatasetExecutor', dataset: Optional[BaseDataset] = None):
+        self._executor = executor
+        self._dataset = dataset
+
+    async def get_version(self) -> Text:
+        """Version of the dataset answering the queries (of one of the workers, with processes)."""
+        if self._dataset is not None:
+            return self._dataset.version
+        return await self._executor.run(_wait_worker)
+
+    def __getattr__(self, method: Text) -> Callable:
+        async def call(*args, **kwargs):
+            return await self._executor.call(self._dataset, method, *args, **kwargs)
+        return call
+
+
+class DatasetExecutor():
+    """Runs the dataset queries in a pool of threads or processes, so that a slow query does not block the other conversations.
+
+    With threads, the workers share the dataset of this process, and the number of workers bounds the number of
+    concurrent queries. With processes, each worker loads and hot reloads its own copy of the dataset, so that the
+    queries also run in parallel on multiple cores (at the cost of the memory of a dataset per worker). The workers
+    reload their datasets independently, so while a new version is being loaded, the consecutive queries of an action
+    can be answered by different versions: actions that keep recipe ids between queries (e.g. the search results)
+    must check the version they were computed with, see AsyncDataset.get_version.
+    """
+
+    def __init__(self, load: Callable[[], BaseDataset], interval: Optional[float] = None, max_workers: int = 4, processes: bool = False):
+        self.max_workers = max_workers
+        self.processes = processes
+        self._datasets: Optional[DatasetReloader] = None
+        self._pool: Executor
+        if processes:
+            # Spawn the workers instead of forking, since this process already runs other threads
+            self._pool = ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker, initargs=(load, interval))
+            self._warm_up = [ self._pool.submit(_wait_worker) for _ in range(max_workers) ]  # Start the workers and load their datasets
+        else:
+            self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix='dataset')
+            self._datasets = DatasetReloader(load, interval=interval)
+
+    @property
+    def ready(self) -> bool:
+        """Whether the dataset is loaded (by all the workers, with processes)."""
+        if self.processes:
+            return all( f.done() and f.exception() is None for f in self._warm_up )
+        return self._datasets.ready
+
+    @property
+    def local(self) -> Optional[BaseDataset]:
+        """The dataset of this process if it is loaded, None with processes."""
+        return self._datasets.get() if self._datasets is not None and self._datasets.ready else None
+
+    async def get(self) -> AsyncDataset:
+        """Returns the current version of the dataset, waiting for it to be loaded without blocking the event loop."""
+        if self.processes:
+            return AsyncDataset(self)
+        if self._datasets.ready:
+            return AsyncDataset(self, self._datasets.get())
+        return AsyncDataset(self, await self.run(self._datasets.get))
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run the given function in a worker of the pool (a module-level function, with processes)."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+
+    async def call(self, dataset: Optional[BaseDataset], method: Text, *args, **kwargs) -> Any:
+        """Call a method of the dataset in a worker of the pool."""
+        if self.processes:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, _call_in_worker, method, args, kwargs)
+        return await self.run(getattr(dataset, method), *args, **kwargs)
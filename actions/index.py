@@ -0,0 +1,143 @@
+"""Indexes used to search and filter the recipes without scanning the whole dataset."""
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Text, Tuple
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'\w+')
+FIRST_KEY_BASE = 1 << 15  # Max number of properties of the same kind in a recipe
+
+
+def tokenize(text: Text) -> List[Text]:
+    """Split a text into its lowercase word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SubstringIndex():
+    """Index of text values (e.g. titles or ingredient names) supporting case-insensitive substring queries.
+
+    Each distinct value keeps the postings of the recipes it appears in, together with the number of rows
+    containing it. Queries are resolved by scanning the (small) tokens vocabulary instead of all the rows.
+    """
+
+    def __init__(self, items: Iterable[Tuple[int, Optional[Text]]], token_cache_size: int = 4096):
+        self._postings: Dict[Text, Counter] = defaultdict(Counter)  # Value -> { recipe_id: rows count }
+        for recipe_id, value in items:
+            if isinstance(value, str):
+                self._postings[value.lower()][recipe_id] += 1
+        self._postings = dict(self._postings)
+        self._tokens: Dict[Text, Set[Text]] = defaultdict(set)  # Token -> values containing it
+        for value in self._postings:
+            for token in tokenize(value):
+                self._tokens[token].add(value)
+        self._tokens = dict(self._tokens)
+        self._token_cache_size = token_cache_size
+        self._match_token = lru_cache(maxsize=token_cache_size)(self._match_token)
+
+    def __getstate__(self) -> Dict[Text, Any]:
+        state = self.__dict__.copy()
+        del state['_match_token']  # The cache wrapper can't be pickled, it is recreated when loading
+        return state
+
+    def __setstate__(self, state: Dict[Text, Any]):
+        self.__dict__.update(state)
+        self._match_token = lru_cache(maxsize=self._token_cache_size)(self._match_token)
+
+    def _match_token(self, query_token: Text) -> Set[Text]:
+        """Returns the values having at least one token that contains the given query token."""
+        values = set()
+        for token, token_values in self._tokens.items():
+            if query_token in token:
+                values |= token_values
+        return values
+
+    def match(self, term: Text) -> Set[Text]:
+        """Returns all the indexed values containing the given term."""
+        term = term.lower()
+        query_tokens = tokenize(term)
+        if len(query_tokens) == 0:  # No word to look up (e.g. punctuation only), fallback to a full scan
+            return { value for value in self._postings if term in value }
+        # Each token of the term must be part of a token of the value, check the longest (most selective) one
+        candidates = self._match_token(max(query_tokens, key=len))
+        return { value for value in candidates if term in value }
+
+    def count(self, terms: Iterable[Text]) -> Counter:
+        """Returns, for each recipe, the number of rows matching any of the given terms."""
+        values = set()
+        for term in terms:
+            values |= self.match(term)
+        counts = Counter()
+        for value in values:
+            counts.update(self._postings[value])
+        return counts
+
+    def search(self, terms: Iterable[Text]) -> Set[int]:
+        """Returns the ids of the recipes with at least one row matching any of the given terms."""
+        return set(self.count(terms))
+
+
+class RecipeIndex():
+    """Inverted indexes over the titles, ingredients, tags and cuisines of the recipes."""
+
+    def __init__(self, titles: Iterable[Tuple[int, Text]], ingredients: Iterable[Tuple[int, Text]],
+                 tags: Iterable[Tuple[int, Iterable[Text]]], cuisines: Iterable[Tuple[int, Optional[Text]]]):
+        self.titles = SubstringIndex(titles)
+        self.ingredients = SubstringIndex(ingredients)
+        self.cuisines = SubstringIndex(cuisines)
+        self.tags: Dict[Text, Set[int]] = defaultdict(set)
+        for recipe_id, recipe_tags in tags:
+            for tag in recipe_tags:
+                self.tags[tag].add(recipe_id)
+        self.tags = dict(self.tags)
+
+    def search_titles(self, keywords: List[Text]) -> Set[int]:
+        """Recipes whose title contains any of the keywords."""
+        return self.titles.search(keywords)
+
+    def search_tags(self, tags: Iterable[Text]) -> Set[int]:
+        """Recipes having all the given tags, intersecting their postings from the smallest one (none if no tag is given)."""
+        postings = sorted(( self.tags.get(tag, set()) for tag in tags ), key=len)
+        return set(postings[0]).intersection(*postings[1:]) if len(postings) > 0 else set()
+
+    def search_cuisine(self, cuisine: Text) -> Set[int]:
+        """Recipes whose cuisine contains the given one."""
+        return self.cuisines.search([cuisine])
+
+
+class PropertyMatrix():
+    """Boolean recipes x properties matrix, used to count and filter the recipes properties with vectorized operations.
+
+    Each column is a (kind, value) property, e.g. ('tag', 'vegan'). Columns are sorted by first appearance in the recipes,
+    and the position of each property in its recipe is kept to break ties in the same order of a sequential scan.
+    """
+
+    def __init__(self, n_recipes: int, properties: Iterable[Tuple[int, Text, Text, int]]):
+        columns: Dict[Tuple[Text, Text], int] = {}
+        rows, cols, positions = [], [], []
+        for recipe_id, kind, value, position in properties:
+            rows.append(recipe_id)
+            cols.append(columns.setdefault((kind, value), len(columns)))
+            positions.append(position)
+        self.columns: List[Tuple[Text, Text]] = list(columns)
+        self.matrix = np.zeros((n_recipes, len(columns)), dtype=bool)
+        self.matrix[rows, cols] = True
+        self.positions = np.zeros((n_recipes, len(columns)), dtype=np.int16)
+        self.positions[rows, cols] = positions
+
+    def counts(self, rows: np.ndarray) -> np.ndarray:
+        """Number of recipes having each property, among the given rows."""
+        return self.matrix[rows].sum(axis=0)
+
+    def first_keys(self, rows: np.ndarray) -> np.ndarray:
+        """Order of the first appearance of each property in the given rows, as recipe_id * 2^15 + position (-1 if missing)."""
+        if len(rows) == 0:
+            return np.full(len(self.columns), -1, dtype=np.int64)
+        present = self.matrix[rows]
+        first_rows = present.argmax(axis=0)
+        keys = rows[first_rows] * FIRST_KEY_BASE + self.positions[rows[first_rows], np.arange(len(self.columns))]
+        return np.where(present.any(axis=0), keys, -1)
+
+    def mask(self, rows: np.ndarray, columns: List[int]) -> np.ndarray:
+        """Mask of the given rows having any of the given properties."""
+        return self.matrix[np.ix_(rows, columns)].any(axis=1)
@@ -0,0 +1,137 @@
+"""Parsing of the recipes YAML files."""
+import os
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+import yaml
+
+from . import quantities
+
+logger = logging.getLogger(__name__)
+
+# Use the C-accelerated loader when PyYAML is built with libyaml
+YAML_LOADER = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+RECIPES_COLUMNS = ['id', 'title', 'image', 'tags', 'cuisine', 'prep_time', 'cook_time', 'servings']
+INGREDIENTS_COLUMNS = ['recipe_id', 'name', 'amount', 'unit']
+STEPS_COLUMNS = ['recipe_id', 'step_index', 'description']
+
+
+def iter_yaml_items(lines: Iterable[Text]) -> Iterator[Text]:
+    """Split the source of a YAML file with a top-level block sequence into the source of each item.
+
+    Each item starts with a "- " at the beginning of a line, the lines before the first item (e.g. comments) are skipped.
+    """
+    item_lines = None
+    for line in lines:
+        if line.startswith('- ') or line.rstrip('\r\n') == '-':
+            if item_lines is not None:
+                yield ''.join(item_lines)
+            item_lines = [line]
+        elif item_lines is not None:
+            item_lines.append(line)
+    if item_lines is not None:
+        yield ''.join(item_lines)
+
+
+def log_progress(label: Text, step: float = 0.1) -> Callable[[int, int], None]:
+    """Returns a progress callback that logs the percentage of completion every given fraction of the total."""
+    next_fraction = step
+    def report(done: int, total: int):
+        nonlocal next_fraction
+        if total > 0 and done / total >= next_fraction:
+            logger.info('%s: %d%%', label, 100 * done // total)
+            next_fraction = (done / total // step + 1) * step
+    return report
+
+
+def iter_recipe_sources(path: Text, progress: Optional[Callable[[int, int], None]] = None) -> Iterator[Tuple[Text, Text]]:
+    """Read the recipes file one recipe at a time, without loading the whole file in memory, yielding the hash and
+    source of each recipe. The progress callback is called after each recipe with the number of bytes read and the size
+    of the file. Nothing is yielded if the file is not a top-level block sequence.
+    """
+    total, done = os.path.getsize(path), 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for source in iter_yaml_items(f):
+            data = source.encode('utf-8')
+            done += len(data)
+            yield hashlib.sha1(data).hexdigest(), source
+            if progress is not None:
+                progress(done, total)
+
+
+def parse_recipe(source: Text) -> Dict[Text, Any]:
+    """Parse the source of a single recipe, as yielded by iter_recipe_sources."""
+    return yaml.load(source, Loader=YAML_LOADER)[0]
+
+
+def iter_recipes(path: Text, progress: Optional[Callable[[int, int], None]] = None) -> Iterator[Dict[Text, Any]]:
+    """Parse the recipes file one recipe at a time, without loading the whole file in memory."""
+    n_items = 0
+    for _, source in iter_recipe_sources(path, progress):
+        n_items += 1
+        yield parse_recipe(source)
+    if n_items == 0:  # Not a block sequence, parse the whole file at once
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from yaml.load(f, Loader=YAML_LOADER) or []
+        if progress is not None:
+            progress(1, 1)
+
+
+def parse_recipes(path: Text) -> List[Dict[Text, Any]]:
+    """Parse the recipes file, one recipe at a time."""
+    return list(iter_recipes(path))
+
+
+def recipe_tags(recipe: Dict[Text, Any]) -> List[Text]:
+    """Returns the tags of a parsed recipe, with the "quick" tag added to short recipes."""
+    tags = list(recipe.get('tags') or [])
+    if recipe['prep_time'] + recipe['cook_time'] < 30:
+        tags.append('quick')
+    return tags
+
+
+class RecipeColumns():
+    """Columnar buffers of the recipes, ingredients and steps tables, filled one recipe at a time.
+
+    Appending the parsed recipes as they are streamed avoids keeping both the parsed documents and the tables in memory.
+    """
+
+    def __init__(self):
+        self.recipes: Dict[Text, List[Any]] = { column: [] for column in RECIPES_COLUMNS }
+        self.ingredients: Dict[Text, List[Any]] = { column: [] for column in INGREDIENTS_COLUMNS }
+        self.steps: Dict[Text, List[Any]] = { column: [] for column in STEPS_COLUMNS }
+
+    def __len__(self) -> int:
+        return len(self.recipes['id'])
+
+    def append(self, recipe: Dict[Text, Any]) -> int:
+        """Append a parsed recipe to the buffers, and returns its id."""
+        return self.append_rows(
+            (recipe['title'], recipe.get('image'), recipe_tags(recipe), recipe.get('cuisine'), recipe['prep_time'], recipe['cook_time'], recipe['servings']),
+            [ (ingredient['name'], *quantities.parse_amount(ingredient.get('amount'))) for ingredient in recipe['ingredients'] ],
+            recipe['steps'],
+        )
+
+    def append_rows(self, recipe: Tuple, ingredients: Iterable[Tuple], steps: Iterable[Text]) -> int:
+        """Append the rows of a recipe (e.g. copied from a previous version of the tables), and returns its id.
+
+        The rows are the values of the columns without the recipe id (and the step index for the steps).
+        """
+        recipe_id = len(self)
+        for column, value in zip(RECIPES_COLUMNS, (recipe_id, *recipe)):
+            self.recipes[column].append(value)
+        for ingredient in ingredients:
+            for column, value in zip(INGREDIENTS_COLUMNS, (recipe_id, *ingredient)):
+                self.ingredients[column].append(value)
+        for step_index, description in enumerate(steps):
+            for column, value in zip(STEPS_COLUMNS, (recipe_id, step_index, description)):
+                self.steps[column].append(value)
+        return recipe_id
+
+    def extend(self, recipes: Iterable[Dict[Text, Any]]) -> 'RecipeColumns':
+        """Append all the given recipes to the buffers."""
+        for recipe in recipes:
+            self.append(recipe)
+        return self
@@ -0,0 +1,175 @@
+"""Instrumentation of the actions and dataset queries: latency and result size histograms, exposed in the Prometheus text format."""
+import os
+import time
+import bisect
+import logging
+import threading
+import functools
+import inspect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'cooking_assistant'
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 10000, 100000)
+
+
+class Histogram():
+    """Cumulative histogram with fixed buckets, in the Prometheus format."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[Tuple[Text, int]]:
+        """Returns the (upper bound, number of values lower or equal to it) of each bucket."""
+        cumulative, total = [], 0
+        for bound, count in zip([ f'{b:g}' for b in self.buckets ] + ['+Inf'], self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class CallStats():
+    """Statistics of the calls to an instrumented function."""
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.errors = 0
+
+
+class Metrics():
+    """Registry of the call statistics of the instrumented functions, grouped by kind (e.g. action or dataset) and name.
+
+    Calls slower than slow_call_threshold seconds are logged, if given.
+    """
+
+    def __init__(self, slow_call_threshold: Optional[float] = None):
+        self.slow_call_threshold = slow_call_threshold
+        self._stats: Dict[Tuple[Text, Text], CallStats] = {}
+        self._gauges: Dict[Text, Tuple[Text, Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind: Text, name: Text, duration: float, size: Optional[int] = None, error: bool = False):
+        """Record a call of the given duration in seconds, with the size of its result if any."""
+        with self._lock:
+            stats = self._stats.get((kind, name))
+            if stats is None:
+                stats = self._stats[(kind, name)] = CallStats()
+            stats.latency.observe(duration)
+            if size is not None:
+                stats.size.observe(size)
+            stats.errors += error
+        if self.slow_call_threshold is not None and duration >= self.slow_call_threshold:
+            logger.warning('Slow call to %s %s: %.1fms%s', kind, name, duration * 1000, ' (failed)' if error else '')
+
+    def gauge(self, name: Text, help_text: Text, fn: Callable[[], float]):
+        """Register a gauge, whose value is read from the given function when the metrics are exported."""
+        self._gauges[name] = (help_text, fn)
+
+    def timed(self, kind: Text, sized: bool = False) -> Callable:
+        """Decorator recording the latency, errors and (if sized) the result length of each call to the decorated function."""
+        def decorator(fn: Callable) -> Callable:
+            name = fn.__qualname__
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    start, result, error = time.perf_counter(), None, True
+                    try:
+                        result = await fn(*args, **kwargs)
+                        error = False
+                        return result
+                    finally:
+                        self.observe(kind, name, time.perf_counter() - start, len(result) if sized and result is not None else None, error)
+                return async_wrapper
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start, result, error = time.perf_counter(), None, True
+                try:
+                    result = fn(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    self.observe(kind, name, time.perf_counter() - start, len(result) if sized and result is not None else None, error)
+            return wrapper
+        return decorator
+
+    def export(self) -> Text:
+        """Returns the metrics in the Prometheus text format."""
+        with self._lock:
+            items = [ (kind, name, stats.latency.cumulative_counts(), stats.latency.sum, stats.latency.count,
+                       stats.size.cumulative_counts(), stats.size.sum, stats.size.count, stats.errors)
+                      for (kind, name), stats in sorted(self._stats.items()) ]
+        lines = [
+            f'# HELP {METRICS_PREFIX}_call_duration_seconds Latency of the calls.',
+            f'# TYPE {METRICS_PREFIX}_call_duration_seconds histogram',
+        ]
+        for kind, name, buckets, total, count, *_ in items:
+            labels = f'kind="{kind}",name="{name}"'
+            lines += [ f'{METRICS_PREFIX}_call_duration_seconds_bucket{{{labels},le="{bound}"}} {n}' for bound, n in buckets ]
+            lines += [ f'{METRICS_PREFIX}_call_duration_seconds_sum{{{labels}}} {total:.6f}', f'{METRICS_PREFIX}_call_duration_seconds_count{{{labels}}} {count}' ]
+        lines += [
+            f'# HELP {METRICS_PREFIX}_call_errors_total Number of calls that raised an exception.',
+            f'# TYPE {METRICS_PREFIX}_call_errors_total counter',
+        ]
+        lines += [ f'{METRICS_PREFIX}_call_errors_total{{kind="{kind}",name="{name}"}} {errors}' for kind, name, *_, errors in items ]
+        lines += [
+            f'# HELP {METRICS_PREFIX}_result_size Number of items returned by the calls.',
+            f'# TYPE {METRICS_PREFIX}_result_size histogram',
+        ]
+        for kind, name, _, _, _, buckets, total, count, _ in items:
+            if count == 0:
+                continue
+            labels = f'kind="{kind}",name="{name}"'
+            lines += [ f'{METRICS_PREFIX}_result_size_bucket{{{labels},le="{bound}"}} {n}' for bound, n in buckets ]
+            lines += [ f'{METRICS_PREFIX}_result_size_sum{{{labels}}} {total:g}', f'{METRICS_PREFIX}_result_size_count{{{labels}}} {count}' ]
+        for name, (help_text, fn) in sorted(self._gauges.items()):
+            lines += [ f'# HELP {METRICS_PREFIX}_{name} {help_text}', f'# TYPE {METRICS_PREFIX}_{name} gauge', f'{METRICS_PREFIX}_{name} {fn():g}' ]
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: Text = '0.0.0.0', ready: Optional[Callable[[], bool]] = None) -> ThreadingHTTPServer:
+        """Serve the metrics on http://host:port/metrics, from a background thread.
+
+        If given, the ready function is exposed on http://host:port/ready, which returns 503 until it returns True.
+        """
+        registry = self
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/ready' and ready is not None:
+                    is_ready = ready()
+                    self.send_response(200 if is_ready else 503)
+                    self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                    self.end_headers()
+                    self.wfile.write(b'ready\n' if is_ready else b'loading\n')
+                    return
+                if path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.export().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                pass  # Do not log each scrape
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        logger.info('Serving metrics on http://%s:%d/metrics', host, port)
+        return server
+
+
+# Registry shared by the actions server, slow calls are logged if METRICS_SLOW_CALL_THRESHOLD (seconds) is set
+metrics = Metrics(slow_call_threshold=float(os.environ['METRICS_SLOW_CALL_THRESHOLD']) if os.environ.get('METRICS_SLOW_CALL_THRESHOLD') else None)
+timed = metrics.timed
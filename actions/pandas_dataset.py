@@ -0,0 +1,174 @@
+"""Dataset stored in memory in pandas DataFrames."""
+import os
+import yaml
+import numpy as np
+import pandas as pd
+from collections import Counter
+from typing import Any, Dict, List, Set, Text, Optional
+
+from . import ingest, snapshot
+from .cache import QueryCache
+from .dataset import BaseDataset, Ingredient, Recipe, RecipeProperty, Step, PROJECT_ROOT, RECIPES_PATH, INGREDIENTS_SUBSTITUTES_PATH
+from .index import RecipeIndex, PropertyMatrix
+
+SNAPSHOT_PATH = os.path.join(PROJECT_ROOT, '.cache', 'dataset.snapshot')
+
+
+class Dataset(BaseDataset):
+    """Dataset containing the recipes data used by the agent, stored in memory in pandas DataFrames."""
+
+    def __init__(self, recipes_path: Text = RECIPES_PATH, ingredients_substitutes_path: Text = INGREDIENTS_SUBSTITUTES_PATH,
+                 snapshot_path: Optional[Text] = SNAPSHOT_PATH, recipes_cache_size: int = 1024, query_cache: Optional[QueryCache] = None,
+                 previous: Optional['Dataset'] = None):
+        super().__init__(recipes_path, ingredients_substitutes_path, recipes_cache_size=recipes_cache_size, query_cache=query_cache)
+        self.snapshot_path = snapshot_path
+        # Load the compiled snapshot if it is up to date with the source files, otherwise rebuild it
+        self.version = snapshot.hash_files([recipes_path, ingredients_substitutes_path], pd.__version__)
+        state = snapshot.load_snapshot(snapshot_path, self.version) if snapshot_path is not None else None
+        if state is None:
+            state = self._build(recipes_path, ingredients_substitutes_path, previous)
+            if snapshot_path is not None:
+                snapshot.save_snapshot(snapshot_path, self.version, state)
+        self._df_recipes = state['df_recipes']
+        self._df_ingredients = state['df_ingredients']
+        self._df_steps = state['df_steps']
+        self._df_ingredients_substitutes = state['df_ingredients_substitutes']
+        self._index = state['index']
+        self._ingredients_offsets = state['ingredients_offsets']
+        self._steps_offsets = state['steps_offsets']
+        self._properties = state['properties']
+        self._recipe_hashes = state['recipe_hashes']
+        self.n_recipes = len(self._df_recipes)
+        self._set_property_columns(self._properties.columns)
+
+    def reload(self) -> 'Dataset':
+        """Returns a new version of the dataset with the current content of the source files.
+
+        Only the recipes changed since this version are parsed again, and the queries cache is shared with the new version.
+        """
+        dataset = Dataset(self.recipes_path, self.ingredients_substitutes_path, snapshot_path=self.snapshot_path, recipes_cache_size=self.recipes_cache_size,
+                          query_cache=self.query_cache, previous=self)
+        self.query_cache.invalidate(dataset.version)
+        return dataset
+
+    @staticmethod
+    def _build(recipes_path: Text, ingredients_substitutes_path: Text, previous: Optional['Dataset'] = None) -> Dict[Text, Any]:
+        """Parse the source YAML files and build the dataset tables and indexes.
+
+        The recipes whose source is unchanged since the previous version (same hash) are copied from its tables instead
+        of being parsed again, so that only the hash of each recipe has to be kept besides the tables.
+        """
+        # Stream the recipes into columnar buffers
+        columns, recipe_hashes = ingest.RecipeColumns(), []
+        if previous is not None:
+            previous_ids = { key: recipe_id for recipe_id, key in enumerate(previous._recipe_hashes) }
+            previous_recipes = previous._df_recipes[ingest.RECIPES_COLUMNS[1:]].to_numpy(dtype=object)
+            previous_ingredients = previous._df_ingredients[ingest.INGREDIENTS_COLUMNS[1:]].to_numpy(dtype=object)
+            previous_steps = previous._df_steps.description.to_numpy(dtype=object)
+        for key, source in ingest.iter_recipe_sources(recipes_path, progress=ingest.log_progress(f'Loading {recipes_path}')):
+            recipe_id = previous_ids.get(key) if previous is not None else None
+            if recipe_id is not None:
+                columns.append_rows(previous_recipes[recipe_id],
+                                    previous_ingredients[previous._ingredients_offsets[recipe_id]:previous._ingredients_offsets[recipe_id + 1]],
+                                    previous_steps[previous._steps_offsets[recipe_id]:previous._steps_offsets[recipe_id + 1]])
+            else:
+                columns.append(ingest.parse_recipe(source))
+            recipe_hashes.append(key)
+        if len(recipe_hashes) == 0:  # Not a block sequence, parsed at once
+            columns.extend(ingest.iter_recipes(recipes_path))
+        with open(ingredients_substitutes_path, 'r', encoding='utf-8') as f:
+            raw_ingredients_substitutes = yaml.load(f, Loader=ingest.YAML_LOADER)
+        # Convert to DataFrame
+        df_recipes = pd.DataFrame(columns.recipes).set_index('id')
+        df_ingredients = pd.DataFrame(columns.ingredients)
+        df_ingredients['amount'] = df_ingredients['amount'].astype(float)
+        df_steps = pd.DataFrame(columns.steps)
+        df_ingredients_substitutes = pd.DataFrame([next(iter(i.items())) for i  in raw_ingredients_substitutes], columns=['name', 'substitute'])
+        del columns
+        # Rows of each recipe are contiguous, store where they start to get them without scanning the tables
+        ingredients_offsets = np.searchsorted(df_ingredients.recipe_id.values, np.arange(len(df_recipes) + 1))
+        steps_offsets = np.searchsorted(df_steps.recipe_id.values, np.arange(len(df_recipes) + 1))
+        # Build the properties matrix, with the recipes tags and cuisines
+        properties = PropertyMatrix(len(df_recipes), (
+            (recipe_id, kind, value, position) for recipe_id, tags, cuisine in zip(df_recipes.index, df_recipes.tags, df_recipes.cuisine)
+            for kind, values in ((RecipeProperty.TAG.value, tags), (RecipeProperty.CUISINE.value, [cuisine] if pd.notna(cuisine) else []))
+            for position, value in enumerate(values)
+        ))
+        # Build the search indexes
+        index = RecipeIndex(
+            titles=df_recipes.title.items(),
+            ingredients=zip(df_ingredients.recipe_id, df_ingredients.name),
+            tags=df_recipes.tags.items(),
+            cuisines=df_recipes.cuisine.items(),
+        )
+        return dict(df_recipes=df_recipes, df_ingredients=df_ingredients, df_steps=df_steps,
+                    df_ingredients_substitutes=df_ingredients_substitutes, index=index,
+                    ingredients_offsets=ingredients_offsets, steps_offsets=steps_offsets, properties=properties, recipe_hashes=recipe_hashes)
+
+    @property
+    def recipes(self) -> List[Text]:
+        """Returns a list of all the available recipes titles."""
+        return sorted(self._df_recipes.title.unique().tolist())
+
+    @property
+    def ingredients(self) -> List[Text]:
+        """Returns a list of all the available ingredients."""
+        return sorted(self._df_ingredients.name.unique().tolist())
+
+    @property
+    def tags(self) -> List[Text]:
+        """Returns a list of all the available tags."""
+        return sorted(self._df_recipes.tags.explode().dropna().unique().tolist())
+
+    @property
+    def cuisines(self) -> List[Text]:
+        """Returns a list of all the available cuisines."""
+        return sorted(self._df_recipes.cuisine.dropna().unique().tolist())
+
+    def get_recipe(self, recipe_id: int) -> Recipe:
+        """Converts a recipe id to the corresponding Recipe objects. The returned recipe is cached and must not be modified."""
+        recipe_id = int(recipe_id)
+        df_recipe = self._df_recipes.loc[recipe_id]
+        df_ingredients = self._df_ingredients.iloc[self._ingredients_offsets[recipe_id]:self._ingredients_offsets[recipe_id + 1]]
+        df_steps = self._df_steps.iloc[self._steps_offsets[recipe_id]:self._steps_offsets[recipe_id + 1]]
+        ingredients = tuple( Ingredient(recipe_id, ingr.name, float(ingr.amount), ingr.unit if pd.notna(ingr.unit) else None) for ingr in df_ingredients.itertuples() )
+        steps = tuple( Step(recipe_id, int(step.step_index), step.description) for step in df_steps.itertuples() )
+        recipe = Recipe(
+            id=recipe_id,
+            title=df_recipe.title,
+            image=df_recipe.image if pd.notna(df_recipe.image) else None,
+            tags=tuple(df_recipe.tags),
+            cuisine=df_recipe.cuisine if pd.notna(df_recipe.cuisine) else None,
+            prep_time=int(df_recipe.prep_time),
+            cook_time=int(df_recipe.cook_time),
+            servings=int(df_recipe.servings),
+            ingredients=ingredients,
+            steps=steps,
+            amounts=df_ingredients.amount.to_numpy(dtype=np.float64, copy=True),
+        )
+        return recipe
+
+    def _search_titles(self, keywords: List[Text]) -> Set[int]:
+        return self._index.search_titles(keywords)
+
+    def _count_ingredients(self, ingredients: List[Text]) -> Counter:
+        return self._index.ingredients.count(ingredients)
+
+    def _search_tags(self, tags: List[Text]) -> Set[int]:
+        return self._index.search_tags(tags)
+
+    def _search_cuisine(self, cuisine: Text) -> Set[int]:
+        return self._index.search_cuisine(cuisine)
+
+    def _search_ingredients_substitutes(self, ingredients: List[Text]) -> List[Text]:
+        substitutes = self._df_ingredients_substitutes[self._df_ingredients_substitutes['name'].str.contains('|'.join(ingredients), case=False)].substitute.unique().tolist()
+        return substitutes
+
+    def _properties_counts(self, rows: np.ndarray) -> np.ndarray:
+        return self._properties.counts(rows)
+
+    def _properties_first_keys(self, rows: np.ndarray) -> np.ndarray:
+        return self._properties.first_keys(rows)
+
+    def _properties_mask(self, rows: np.ndarray, columns: List[int]) -> np.ndarray:
+        return self._properties.mask(rows, columns)
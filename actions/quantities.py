@@ -0,0 +1,121 @@
+"""Parsing and conversion of the ingredients quantities."""
+import re
+from enum import Enum
+from fractions import Fraction
+from typing import Any, Dict, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+
+
+class Dimension(str, Enum):
+    MASS = 'mass'
+    VOLUME = 'volume'
+    COUNT = 'count'
+    def __str__(self) -> Text:
+        return self.value
+
+
+# Canonical units, with their dimension and size in the base unit of the dimension (grams, milliliters or pieces)
+UNITS: Dict[Text, Tuple[Dimension, float]] = {
+    'mg': (Dimension.MASS, 0.001),
+    'g': (Dimension.MASS, 1.0),
+    'kg': (Dimension.MASS, 1000.0),
+    'oz': (Dimension.MASS, 28.349523125),
+    'lb': (Dimension.MASS, 453.59237),
+    'ml': (Dimension.VOLUME, 1.0),
+    'cl': (Dimension.VOLUME, 10.0),
+    'dl': (Dimension.VOLUME, 100.0),
+    'l': (Dimension.VOLUME, 1000.0),
+    'tsp': (Dimension.VOLUME, 4.92892159375),
+    'tbsp': (Dimension.VOLUME, 14.78676478125),
+    'fl oz': (Dimension.VOLUME, 29.5735295625),
+    'cup': (Dimension.VOLUME, 236.5882365),
+    '': (Dimension.COUNT, 1.0),
+}
+
+UNIT_ALIASES = dict(
+    gram='g', grams='g', gr='g', kilogram='kg', kilograms='kg', kilo='kg', kilos='kg', milligram='mg', milligrams='mg',
+    ounce='oz', ounces='oz', pound='lb', pounds='lb', lbs='lb',
+    milliliter='ml', milliliters='ml', millilitre='ml', millilitres='ml', liter='l', liters='l', litre='l', litres='l',
+    teaspoon='tsp', teaspoons='tsp', tablespoon='tbsp', tablespoons='tbsp', tbs='tbsp', cups='cup',
+    **{ 'fl. oz': 'fl oz', 'fluid ounce': 'fl oz', 'fluid ounces': 'fl oz' },
+)
+
+# Units written right after the number (e.g. "200g"), the others are separated by a space (e.g. "2 cups")
+ABBREVIATED_UNITS = {'mg', 'g', 'kg', 'ml', 'cl', 'dl', 'l'}
+UNIT_PLURALS = dict(cup='cups')
+
+# Units used to show the aggregated quantities, from the largest: the first one not exceeding the quantity is used
+DISPLAY_UNITS = {
+    Dimension.MASS: ['kg', 'g'],
+    Dimension.VOLUME: ['l', 'ml'],
+    Dimension.COUNT: [''],
+}
+
+VULGAR_FRACTIONS = { '½': ' 1/2', '⅓': ' 1/3', '⅔': ' 2/3', '¼': ' 1/4', '¾': ' 3/4', '⅛': ' 1/8' }
+AMOUNT_PATTERN = re.compile(r'^\s*(\d+\s+\d+\s*/\s*\d+|\d+\s*/\s*\d+|\d+(?:[.,]\d+)?)\s*(.*?)\s*$')
+
+
+def parse_number(text: Text) -> float:
+    """Parse an integer, decimal, fraction or mixed number (e.g. "1 1/2")."""
+    text = re.sub(r'\s*/\s*', '/', text.replace(',', '.'))
+    if '/' not in text:
+        return float(text)
+    parts = text.split()
+    return float(sum( Fraction(part) for part in parts ))
+
+
+def normalize_unit(unit: Text) -> Text:
+    """Returns the canonical spelling of a unit, or the unit itself if unknown (e.g. "cloves")."""
+    unit = unit.strip()
+    lower = unit.lower()
+    lower = UNIT_ALIASES.get(lower, lower)
+    return lower if lower in UNITS else unit
+
+
+def parse_amount(amount: Any) -> Tuple[Optional[float], Optional[Text]]:
+    """Split the amount of an ingredient (e.g. "200g", "1 1/2 cups" or 2) into the number and the canonical unit,
+    (None, None) if it does not start with a number."""
+    if amount is None:
+        return None, None
+    text = str(amount)
+    for fraction, replacement in VULGAR_FRACTIONS.items():
+        text = text.replace(fraction, replacement)
+    match = AMOUNT_PATTERN.match(text)
+    if match is None:
+        return None, None
+    return parse_number(match.group(1)), normalize_unit(match.group(2))
+
+
+def format_number(value: float) -> Text:
+    return f'{value:{ ".0f" if float(value).is_integer() else ".1f"}}'
+
+
+def format_quantity(amount: float, unit: Optional[Text]) -> Text:
+    """Returns the quantity as text, e.g. "200g" or "2 cups"."""
+    if not unit:
+        return format_number(amount)
+    if unit in ABBREVIATED_UNITS:
+        return f'{format_number(amount)}{unit}'
+    return f'{format_number(amount)} {UNIT_PLURALS.get(unit, unit) if amount > 1 else unit}'
+
+
+def unit_sizes(units: Sequence[Optional[Text]]) -> Tuple[List[Optional[Text]], np.ndarray]:
+    """Returns the group of each unit, i.e. its dimension (or the unit itself if unknown), and its size in the base unit of the group."""
+    groups, sizes = [], np.ones(len(units))
+    for i, unit in enumerate(units):
+        dimension, size = UNITS.get(unit if unit is not None else '', (None, 1.0))
+        groups.append(dimension.value if dimension is not None else f'unit:{unit}')
+        sizes[i] = size
+    return groups, sizes
+
+
+def to_display_unit(quantity: float, group: Text) -> Tuple[float, Text]:
+    """Convert a quantity in the base unit of the given group (see unit_sizes) to the largest unit it does not exceed."""
+    if group.startswith('unit:'):
+        return quantity, group[len('unit:'):]
+    units = DISPLAY_UNITS[Dimension(group)]
+    for unit in units:
+        if quantity >= UNITS[unit][1]:
+            return quantity / UNITS[unit][1], unit
+    return quantity / UNITS[units[-1]][1], units[-1]
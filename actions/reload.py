@@ -0,0 +1,112 @@
+"""Background loading and hot reload of the dataset when its source files change."""
+import os
+import logging
+import threading
+from typing import Callable, Dict, Optional, Text, Tuple
+
+from .dataset import BaseDataset
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetReloader():
+    """Holds the current version of the dataset, and swaps in a new version when the source files change.
+
+    The first version is loaded in a background thread, so that the actions server can start serving requests
+    immediately: only the requests that need the dataset wait for it to be loaded. New versions are also built in a
+    background thread, while the requests keep being served by the current one. Actions should get the dataset once per
+    request, so that in-flight requests complete against the version they started with. The replaced versions are
+    closed after close_delay seconds, when their in-flight requests are done.
+    """
+
+    def __init__(self, load: Callable[[], BaseDataset], interval: Optional[float] = None, close_delay: float = 60):
+        self._load = load
+        self._dataset: Optional[BaseDataset] = None
+        self._error: Optional[Exception] = None
+        self._loaded = threading.Event()
+        self._mtimes = {}
+        self._interval = interval
+        self._close_delay = close_delay
+        self._stop = threading.Event()
+        self._thread = None
+        threading.Thread(target=self._warm_up, name='dataset-loader', daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        """Whether the dataset is loaded and can be used without waiting."""
+        return self._dataset is not None
+
+    def get(self, timeout: Optional[float] = None) -> BaseDataset:
+        """Returns the current version of the dataset, waiting for it to be loaded if needed."""
+        if not self._loaded.wait(timeout):
+            raise TimeoutError('The dataset is still loading')
+        if self._dataset is None:
+            raise RuntimeError('The dataset could not be loaded') from self._error
+        return self._dataset
+
+    def _warm_up(self):
+        try:
+            dataset = self._load()
+            self._mtimes = self._get_mtimes(dataset)
+            self._dataset = dataset
+            logger.info('Loaded dataset, version %s', dataset.version)
+        except Exception as e:
+            logger.exception('Could not load the dataset')
+            self._error = e
+        finally:
+            self._loaded.set()
+        if self._interval and self._dataset is not None:
+            self.start()
+
+    @staticmethod
+    def _get_mtimes(dataset: BaseDataset) -> Dict[Text, Optional[Tuple[float, int]]]:
+        mtimes = {}
+        for path in [dataset.recipes_path, dataset.ingredients_substitutes_path]:
+            try:
+                stat = os.stat(path)
+                mtimes[path] = (stat.st_mtime, stat.st_size)
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def reload(self, force: bool = False) -> bool:
+        """Reload the dataset if the source files changed. Returns True if a new version was swapped in."""
+        current = self.get()
+        mtimes = self._get_mtimes(current)
+        if not force and mtimes == self._mtimes:
+            return False
+        try:
+            dataset = current.reload()
+        except Exception:
+            logger.exception('Could not reload the dataset, keeping version %s', current.version)
+            return False
+        finally:
+            self._mtimes = mtimes  # Do not retry the same broken files until they change again
+        if dataset.version == current.version:
+            dataset.close()
+            return False
+        logger.info('Reloaded dataset, version %s -> %s', current.version, dataset.version)
+        self._dataset = dataset  # Atomic swap, the in-flight requests keep using the old version until it is closed
+        closer = threading.Timer(self._close_delay, current.close)
+        closer.daemon = True
+        closer.start()
+        return True
+
+    def start(self):
+        """Start watching the source files in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='dataset-reloader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching the source files."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self._interval):
+            self.reload()
@@ -0,0 +1,60 @@
+"""Server-side cache of the recipes search results, referenced in the conversation slots by compact cursors."""
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Text, Tuple
+
+
+class SearchResults():
+    """Bounded LRU store of search results, with expiration.
+
+    The slots only hold a cursor with the handle of the results, the position of the current recipe, and the query,
+    filters and dataset version that produced them, so that the tracker payload does not grow with the number of recipes
+    found. The results are only a cache: if they are missing (e.g. after a restart, or when another server handles the
+    conversation) or were found in another version of the dataset, the query of the cursor can be run again.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 24 * 60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._results: 'OrderedDict[Text, Tuple[float, List[int]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def put(self, recipes_ids: List[int], version: Text, query: Sequence[Any], filters: Sequence[Sequence[Any]] = ()) -> Dict[Text, Any]:
+        """Store the results of the query (keywords, ingredients, tags, cuisine) with the given filters ((property, value,
+        negative) in order of application) on the given version of the dataset, and returns a cursor pointing to the first recipe.
+
+        The handle is derived from the query, so storing the same results again replaces them instead of adding a copy."""
+        query, filters = list(query), [ list(f) for f in filters ]
+        handle = hashlib.sha1(json.dumps([version, query, filters]).encode('utf-8')).hexdigest()[:32]
+        with self._lock:
+            self._results[handle] = (time.monotonic(), list(recipes_ids))
+            self._results.move_to_end(handle)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)  # Evict the least recently used results
+        return dict(handle=handle, position=0, count=len(recipes_ids), version=version, query=query, filters=filters)
+
+    def get(self, cursor: Optional[Dict[Text, Any]], version: Text) -> Optional[List[int]]:
+        """Returns the results referenced by the given cursor, or None if they are missing, expired or from another version of the dataset."""
+        if not cursor or cursor.get('version') != version:
+            return None
+        with self._lock:
+            item = self._results.get(cursor['handle'])
+            if item is None:
+                return None
+            created_at, recipes_ids = item
+            if time.monotonic() - created_at > self.ttl:
+                del self._results[cursor['handle']]
+                return None
+            self._results.move_to_end(cursor['handle'])
+        return recipes_ids
+
+    @staticmethod
+    def move(cursor: Dict[Text, Any], position: int) -> Dict[Text, Any]:
+        """Returns a new cursor pointing to the given position of the same results, wrapping around at the end."""
+        return dict(cursor, position=position % cursor['count'] if cursor['count'] > 0 else 0)
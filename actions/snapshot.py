@@ -0,0 +1,57 @@
+"""Compiled on-disk snapshots of the dataset, to avoid parsing the recipes YAML files at every startup."""
+import os
+import mmap
+import pickle
+import hashlib
+import logging
+from typing import Any, Dict, Iterable, Optional, Text
+
+logger = logging.getLogger(__name__)
+
+# Increase when the format of the snapshot or of the stored state changes
+SNAPSHOT_VERSION = 8
+
+
+def hash_files(paths: Iterable[Text], *extra: Text) -> Text:
+    """Compute a content hash of the given files (and extra strings), used as key of the snapshot."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    for value in extra:
+        digest.update(value.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def save_snapshot(path: Text, key: Text, state: Dict[Text, Any]):
+    """Write the given state to a snapshot file. The file is replaced atomically, so that concurrent readers never see a partial snapshot."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(dict(version=SNAPSHOT_VERSION, key=key), f, protocol=pickle.HIGHEST_PROTOCOL)  # Header, checked before loading the state
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning('Could not write dataset snapshot to %s: %s', path, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_snapshot(path: Text, key: Text) -> Optional[Dict[Text, Any]]:
+    """Load the state from a snapshot file. Returns None if the snapshot is missing, stale or unreadable."""
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return None
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            header = pickle.load(buffer)  # Read directly from the mapped file, without copying it in memory first
+            if header.get('version') != SNAPSHOT_VERSION or header.get('key') != key:
+                logger.info('Dataset snapshot %s is stale, rebuilding it', path)
+                return None
+            return pickle.load(buffer)
+    except Exception as e:
+        logger.warning('Could not load dataset snapshot from %s: %s', path, e)
+        return None
+
@@ -0,0 +1,319 @@
+"""Dataset stored in a local SQLite database, for corpora too large to be kept in memory."""
+import os
+import glob
+import json
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Text, Tuple
+
+import yaml
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where the previous versions are kept
+    fcntl = None
+
+from . import ingest, quantities, snapshot
+from .cache import QueryCache
+from .dataset import BaseDataset, Ingredient, Recipe, RecipeProperty, Step, PROJECT_ROOT, RECIPES_PATH, INGREDIENTS_SUBSTITUTES_PATH
+from .index import FIRST_KEY_BASE
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PATH = os.path.join(PROJECT_ROOT, '.cache', 'dataset.sqlite')
+
+# Increase when the schema changes
+SCHEMA_VERSION = 3
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE recipes (id INTEGER PRIMARY KEY, title TEXT, image TEXT, cuisine TEXT, prep_time INTEGER, cook_time INTEGER, servings INTEGER);
+CREATE TABLE ingredients (id INTEGER PRIMARY KEY, recipe_id INTEGER, name TEXT, amount REAL, unit TEXT);
+CREATE INDEX ingredients_recipe_id ON ingredients (recipe_id);
+CREATE TABLE steps (id INTEGER PRIMARY KEY, recipe_id INTEGER, step_index INTEGER, description TEXT);
+CREATE INDEX steps_recipe_id ON steps (recipe_id, step_index);
+CREATE TABLE substitutes (id INTEGER PRIMARY KEY, name TEXT, substitute TEXT);
+CREATE TABLE properties (id INTEGER PRIMARY KEY, kind TEXT, value TEXT, UNIQUE (kind, value));
+CREATE TABLE recipe_properties (property_id INTEGER, recipe_id INTEGER, position INTEGER, PRIMARY KEY (property_id, recipe_id)) WITHOUT ROWID;
+CREATE INDEX recipe_properties_recipe_id ON recipe_properties (recipe_id, property_id);
+'''
+
+# Trigram full-text indexes support case-insensitive substring (LIKE) queries, requires SQLite 3.34+
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE recipes_fts USING fts5(title, content='recipes', content_rowid='id', tokenize='trigram');
+CREATE VIRTUAL TABLE ingredients_fts USING fts5(name, content='ingredients', content_rowid='id', tokenize='trigram');
+INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild');
+INSERT INTO ingredients_fts (ingredients_fts) VALUES ('rebuild');
+'''
+
+
+def like_condition(column: Text, term: Text) -> Tuple[Text, List[Text]]:
+    """Condition (and its parameters) matching the rows whose column contains the term, case-insensitive.
+
+    The LIKE has no ESCAPE clause, which would prevent the use of the trigram indexes: the terms containing the LIKE
+    wildcards are checked again literally on the candidate rows.
+    """
+    if '%' in term or '_' in term:
+        return f'({column} LIKE ? AND instr(lower({column}), lower(?)) > 0)', [f'%{term}%', term]
+    return f'{column} LIKE ?', [f'%{term}%']
+
+
+def like_conditions(column: Text, terms: List[Text]) -> Tuple[List[Text], List[Text]]:
+    """Conditions matching each of the terms, and their parameters."""
+    conditions, params = [], []
+    for term in terms:
+        condition, term_params = like_condition(column, term)
+        conditions.append(condition)
+        params += term_params
+    return conditions, params
+
+
+class SqliteDataset(BaseDataset):
+    """Dataset containing the recipes data used by the agent, stored in a SQLite database.
+
+    The database is built from the source YAML files in a file named after their hash, so that the requests still
+    served by a previous version keep reading its own file. Each dataset holds a shared lock on its version while it is
+    open, and building a new version removes the previous ones that no dataset (of any process) holds anymore.
+    Titles and ingredients are indexed with FTS5 when available, tags and cuisines in an indexed properties table.
+    """
+
+    def __init__(self, recipes_path: Text = RECIPES_PATH, ingredients_substitutes_path: Text = INGREDIENTS_SUBSTITUTES_PATH,
+                 database_path: Text = DATABASE_PATH, recipes_cache_size: int = 1024, query_cache: Optional[QueryCache] = None):
+        super().__init__(recipes_path, ingredients_substitutes_path, recipes_cache_size=recipes_cache_size, query_cache=query_cache)
+        self.database_path = database_path
+        self.version = snapshot.hash_files([recipes_path, ingredients_substitutes_path], f'sqlite-{SCHEMA_VERSION}')
+        root, ext = os.path.splitext(database_path)
+        self.path = f'{root}-{self.version[:16]}{ext}'
+        self._local = threading.local()  # SQLite connections can't be shared between threads
+        self._connections: List[sqlite3.Connection] = []  # Connections of all the threads, closed with the dataset
+        self._connections_lock = threading.Lock()
+        self._lock_fd = self._lock_version()
+        if self._get_meta('version') != self.version:
+            self._build()
+        self.n_recipes = int(self._get_meta('n_recipes'))
+        self._fts = self._get_meta('fts') == '1'
+        self._set_property_columns(self._execute('SELECT kind, value FROM properties ORDER BY id'))
+
+    def reload(self) -> 'SqliteDataset':
+        """Returns a new version of the dataset with the current content of the source files."""
+        dataset = SqliteDataset(self.recipes_path, self.ingredients_substitutes_path, database_path=self.database_path,
+                                recipes_cache_size=self.recipes_cache_size, query_cache=self.query_cache)
+        self.query_cache.invalidate(dataset.version)
+        return dataset
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Used by this thread only, but closed by the thread releasing the dataset
+            connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _close_connections(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        self._local = threading.local()
+        for connection in connections:
+            connection.close()
+
+    def close(self):
+        """Close the connections of all the threads, and release the version so that it can be removed by the next build."""
+        self._close_connections()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _lock_version(self) -> Optional[int]:
+        """Take a shared lock on the lock file of this version, returns its file descriptor."""
+        if fcntl is None:
+            return None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        while True:
+            fd = os.open(f'{self.path}.lock', os.O_RDWR | os.O_CREAT)
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                if os.fstat(fd).st_ino == os.stat(f'{self.path}.lock').st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)  # Removed with its version while waiting for the lock, lock the new file
+
+    def _remove_unused_versions(self):
+        """Remove the databases of the other versions, unless a dataset still holds their lock."""
+        root, ext = os.path.splitext(self.database_path)
+        for path in glob.glob(f'{root}-*{ext}'):
+            if path == self.path:
+                continue
+            fd = os.open(f'{path}.lock', os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:  # Still used
+                continue
+            else:
+                logger.info('Removing unused dataset database %s', path)
+                for removed_path in [path, f'{path}.lock']:
+                    try:
+                        os.remove(removed_path)
+                    except OSError:
+                        pass
+            finally:
+                os.close(fd)
+
+    def _execute(self, query: Text, params: Iterable[Any] = ()) -> List[tuple]:
+        return self._connection.execute(query, tuple(params)).fetchall()
+
+    def _get_meta(self, key: Text) -> Optional[Text]:
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            rows = self._execute('SELECT value FROM meta WHERE key = ?', [key])
+        except sqlite3.Error:
+            return None
+        return rows[0][0] if len(rows) > 0 else None
+
+    def _build(self):
+        """Build the database from the source YAML files. The file is written atomically, as other processes can build the same version."""
+        logger.info('Building dataset database %s', self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.executescript(SCHEMA)
+            properties: Dict[tuple, int] = {}
+            n_recipes = 0
+            for recipe_id, r in enumerate(ingest.iter_recipes(self.recipes_path, progress=ingest.log_progress(f'Loading {self.recipes_path}'))):
+                tags = ingest.recipe_tags(r)
+                n_recipes += 1
+                connection.execute('INSERT INTO recipes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   (recipe_id, r['title'], r.get('image'), r.get('cuisine'), r['prep_time'], r['cook_time'], r['servings']))
+                connection.executemany('INSERT INTO ingredients (recipe_id, name, amount, unit) VALUES (?, ?, ?, ?)',
+                                       [ (recipe_id, ingr['name'], *quantities.parse_amount(ingr.get('amount'))) for ingr in r['ingredients'] ])
+                connection.executemany('INSERT INTO steps (recipe_id, step_index, description) VALUES (?, ?, ?)',
+                                       [ (recipe_id, j, desc) for j, desc in enumerate(r['steps']) ])
+                for kind, values in ((RecipeProperty.TAG.value, tags), (RecipeProperty.CUISINE.value, [r['cuisine']] if r.get('cuisine') is not None else [])):
+                    for position, value in enumerate(values):
+                        property_id = properties.setdefault((kind, value), len(properties))  # Properties are sorted by first appearance
+                        connection.execute('INSERT OR IGNORE INTO recipe_properties VALUES (?, ?, ?)', (property_id, recipe_id, position))
+            connection.executemany('INSERT INTO properties VALUES (?, ?, ?)', [ (i, kind, value) for (kind, value), i in properties.items() ])
+            with open(self.ingredients_substitutes_path, 'r', encoding='utf-8') as f:
+                raw_ingredients_substitutes = yaml.load(f, Loader=ingest.YAML_LOADER)
+            connection.executemany('INSERT INTO substitutes (name, substitute) VALUES (?, ?)', [ next(iter(i.items())) for i in raw_ingredients_substitutes ])
+            try:
+                connection.executescript(FTS_SCHEMA)
+                fts = True
+            except sqlite3.OperationalError as e:
+                logger.warning('Full-text search not available, falling back to table scans: %s', e)
+                fts = False
+            connection.executemany('INSERT INTO meta VALUES (?, ?)', [ ('version', self.version), ('n_recipes', str(n_recipes)), ('fts', str(int(fts))) ])
+            connection.commit()
+        finally:
+            connection.close()
+        self._close_connections()  # Opened on an incomplete file, if any
+        os.replace(tmp_path, self.path)
+        if fcntl is not None:
+            self._remove_unused_versions()
+
+    @property
+    def recipes(self) -> List[Text]:
+        """Returns a list of all the available recipes titles."""
+        return [ title for title, in self._execute('SELECT DISTINCT title FROM recipes ORDER BY title') ]
+
+    @property
+    def ingredients(self) -> List[Text]:
+        """Returns a list of all the available ingredients."""
+        return [ name for name, in self._execute('SELECT DISTINCT name FROM ingredients ORDER BY name') ]
+
+    @property
+    def tags(self) -> List[Text]:
+        """Returns a list of all the available tags."""
+        return [ value for value, in self._execute('SELECT value FROM properties WHERE kind = ? ORDER BY value', [RecipeProperty.TAG.value]) ]
+
+    @property
+    def cuisines(self) -> List[Text]:
+        """Returns a list of all the available cuisines."""
+        return [ value for value, in self._execute('SELECT value FROM properties WHERE kind = ? ORDER BY value', [RecipeProperty.CUISINE.value]) ]
+
+    def get_recipe(self, recipe_id: int) -> Recipe:
+        """Converts a recipe id to the corresponding Recipe objects. The returned recipe is cached and must not be modified."""
+        recipe_id = int(recipe_id)
+        rows = self._execute('SELECT title, image, cuisine, prep_time, cook_time, servings FROM recipes WHERE id = ?', [recipe_id])
+        if len(rows) == 0:
+            raise KeyError(recipe_id)
+        title, image, cuisine, prep_time, cook_time, servings = rows[0]
+        tags = self._execute('''SELECT p.value FROM recipe_properties rp JOIN properties p ON p.id = rp.property_id
+                                WHERE rp.recipe_id = ? AND p.kind = ? ORDER BY rp.position''', [recipe_id, RecipeProperty.TAG.value])
+        ingredients = self._execute('SELECT name, amount, unit FROM ingredients WHERE recipe_id = ? ORDER BY id', [recipe_id])
+        steps = self._execute('SELECT step_index, description FROM steps WHERE recipe_id = ? ORDER BY step_index', [recipe_id])
+        return Recipe(
+            id=recipe_id,
+            title=title,
+            image=image,
+            tags=tuple( tag for tag, in tags ),
+            cuisine=cuisine,
+            prep_time=prep_time,
+            cook_time=cook_time,
+            servings=servings,
+            ingredients=tuple( Ingredient(recipe_id, name, amount if amount is not None else float('nan'), unit) for name, amount, unit in ingredients ),
+            steps=tuple( Step(recipe_id, step_index, description) for step_index, description in steps ),
+        )
+
+    def _match_rows(self, table: Text, column: Text, terms: List[Text]) -> Tuple[Text, List[Text]]:
+        """Subquery selecting the rows of the given table whose column contains any of the terms (case-insensitive), and its parameters."""
+        conditions, params = like_conditions(column, terms)
+        if self._fts:
+            return ' UNION '.join( f'SELECT rowid FROM {table}_fts WHERE {condition}' for condition in conditions ), params
+        return f'SELECT id FROM {table} WHERE ' + ' OR '.join(conditions), params
+
+    def _search_titles(self, keywords: List[Text]) -> Set[int]:
+        subquery, params = self._match_rows('recipes', 'title', keywords)
+        return { recipe_id for recipe_id, in self._execute(f'SELECT id FROM recipes WHERE id IN ({subquery})', params) }
+
+    def _count_ingredients(self, ingredients: List[Text]) -> Counter:
+        subquery, params = self._match_rows('ingredients', 'name', ingredients)
+        return Counter(dict(self._execute(f'SELECT recipe_id, COUNT(*) FROM ingredients WHERE id IN ({subquery}) GROUP BY recipe_id', params)))
+
+    def _search_tags(self, tags: List[Text]) -> Set[int]:
+        query = f'''SELECT recipe_id FROM recipe_properties WHERE property_id IN (SELECT id FROM properties WHERE kind = ? AND value IN ({", ".join("?" * len(tags))}))
+                    GROUP BY recipe_id HAVING COUNT(*) = ?'''
+        return { recipe_id for recipe_id, in self._execute(query, [RecipeProperty.TAG.value, *tags, len(set(tags))]) }
+
+    def _search_cuisine(self, cuisine: Text) -> Set[int]:
+        condition, params = like_condition('value', cuisine)
+        query = f'SELECT recipe_id FROM recipe_properties WHERE property_id IN (SELECT id FROM properties WHERE kind = ? AND {condition})'
+        return { recipe_id for recipe_id, in self._execute(query, [RecipeProperty.CUISINE.value, *params]) }
+
+    def _search_ingredients_substitutes(self, ingredients: List[Text]) -> List[Text]:
+        conditions, params = like_conditions('name', ingredients)
+        condition = ' OR '.join(conditions) if len(conditions) > 0 else '1'
+        rows = self._execute(f'SELECT substitute FROM substitutes WHERE {condition} ORDER BY id', params)
+        return list(dict.fromkeys( substitute for substitute, in rows ))  # Unique, in order of appearance
+
+    def _properties_stats(self, rows: np.ndarray) -> List[tuple]:
+        query = f'''SELECT property_id, COUNT(*), MIN(recipe_id * {FIRST_KEY_BASE} + position) FROM recipe_properties
+                    WHERE recipe_id IN (SELECT value FROM json_each(?)) GROUP BY property_id'''
+        return self._execute(query, [json.dumps(rows.tolist())])
+
+    def _properties_counts(self, rows: np.ndarray) -> np.ndarray:
+        counts = np.zeros(len(self.property_columns), dtype=np.int64)
+        for property_id, count, _ in self._properties_stats(rows):
+            counts[property_id] = count
+        return counts
+
+    def _properties_first_keys(self, rows: np.ndarray) -> np.ndarray:
+        first_keys = np.full(len(self.property_columns), -1, dtype=np.int64)
+        for property_id, _, first_key in self._properties_stats(rows):
+            first_keys[property_id] = first_key
+        return first_keys
+
+    def _properties_mask(self, rows: np.ndarray, columns: List[int]) -> np.ndarray:
+        query = f'''SELECT DISTINCT recipe_id FROM recipe_properties
+                    WHERE property_id IN ({", ".join("?" * len(columns))}) AND recipe_id IN (SELECT value FROM json_each(?))'''
+        found = [ recipe_id for recipe_id, in self._execute(query, [*columns, json.dumps(rows.tolist())]) ]
+        return np.isin(rows, found)
@@ -0,0 +1,217 @@
+"""Cooking timers of the users, expired by a hierarchical timing wheel in the event loop of the actions server."""
+import math
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from dataclasses import dataclass, replace
+from typing import Awaitable, Callable, Dict, List, Optional, Text
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Timer:
+    id: int
+    sender_id: Text
+    name: Text
+    deadline: float  # Unix time
+    duration: float  # Seconds, including the extensions
+
+    def remaining(self, now: Optional[float] = None) -> float:
+        """Seconds left before the timer expires."""
+        return max(0.0, self.deadline - (now if now is not None else time.time()))
+
+
+class TimingWheel():
+    """Hierarchical timing wheel, storing the timers in buckets by the tick in which they expire.
+
+    Level l has `slots` buckets spanning `slots**l` ticks each. A timer is stored in the lowest level that spans its
+    delay, and moved to the lower levels as the wheel turns: when the current tick is a multiple of `slots**l`, the
+    timers of the matching bucket of level l are inserted again. Adding and cancelling a timer are O(1), and each tick
+    only visits the buckets whose timers expire or cascade, regardless of the number of active timers.
+    Timers farther than the span of the top level are parked in its last bucket and inserted again when reached.
+    """
+
+    def __init__(self, resolution: float = 1.0, slots: int = 64, levels: int = 4, start: Optional[float] = None):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self.tick = int((start if start is not None else time.time()) / resolution)  # Next tick to process
+        self._wheels: List[List[Dict[int, Timer]]] = [ [ {} for _ in range(slots) ] for _ in range(levels) ]
+        self._buckets: Dict[int, Dict[int, Timer]] = {}  # Bucket of each timer id
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def add(self, timer: Timer, now: Optional[float] = None):
+        """Add a timer, which expires in the first tick not earlier than its deadline."""
+        if timer.id in self._buckets:
+            self.cancel(timer.id)
+        if len(self._buckets) == 0:  # Fast-forward an idle wheel, instead of replaying the missed ticks in the next advance
+            self.tick = max(self.tick, int((now if now is not None else time.time()) / self.resolution))
+        self._insert(timer)
+
+    def _insert(self, timer: Timer):
+        expire_tick = max(int(math.ceil(timer.deadline / self.resolution)), self.tick)
+        delay = min(expire_tick - self.tick, self.slots ** self.levels - 1)
+        level = 0
+        while delay >= self.slots ** (level + 1):
+            level += 1
+        bucket = self._wheels[level][((self.tick + delay) // self.slots ** level) % self.slots]
+        bucket[timer.id] = timer
+        self._buckets[timer.id] = bucket
+
+    def cancel(self, timer_id: int) -> Optional[Timer]:
+        """Remove a timer, returns it or None if missing."""
+        bucket = self._buckets.pop(timer_id, None)
+        return bucket.pop(timer_id) if bucket is not None else None
+
+    def advance(self, now: Optional[float] = None) -> List[Timer]:
+        """Process the ticks until the given time, returns the expired timers."""
+        target = int((now if now is not None else time.time()) / self.resolution)
+        expired = []
+        while self.tick <= target:
+            if len(self._buckets) == 0:  # Nothing to cascade nor expire
+                self.tick = target + 1
+                break
+            # Cascade the higher levels first, so that their timers can cascade again in the same tick
+            for level in range(self.levels - 1, 0, -1):
+                if self.tick % self.slots ** level == 0:
+                    for timer in self._pop_bucket(self._wheels[level][(self.tick // self.slots ** level) % self.slots]):
+                        self._insert(timer)
+            expired += self._pop_bucket(self._wheels[0][self.tick % self.slots])
+            self.tick += 1
+        return expired
+
+    def _pop_bucket(self, bucket: Dict[int, Timer]) -> List[Timer]:
+        timers = list(bucket.values())
+        bucket.clear()
+        for timer in timers:
+            del self._buckets[timer.id]
+        return timers
+
+
+class TimerService():
+    """Named timers of each conversation, expired in batches: every tick, the timers expired in the wheel are passed
+    all at once to the dispatch coroutine.
+    """
+
+    def __init__(self, dispatch: Callable[[List[Timer]], Awaitable[None]], resolution: float = 1.0):
+        self.dispatch = dispatch
+        self.resolution = resolution
+        self.wheel = TimingWheel(resolution)
+        self._timers: Dict[Text, Dict[Text, Timer]] = {}  # Timers of each sender, by name
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self.wheel)
+
+    def start(self, sender_id: Text, name: Text, duration: float) -> Timer:
+        """Start a timer expiring after the given seconds, replacing the timer of the sender with the same name."""
+        timer = Timer(next(self._ids), sender_id, name, time.time() + duration, duration)
+        with self._lock:
+            previous = self._timers.setdefault(sender_id, {}).pop(name, None)
+            if previous is not None:
+                self.wheel.cancel(previous.id)
+            self._timers[sender_id][name] = timer
+            self.wheel.add(timer)
+        self._ensure_running()
+        return timer
+
+    def list(self, sender_id: Text) -> List[Timer]:
+        """Returns the active timers of the sender, sorted by deadline."""
+        with self._lock:
+            return sorted(self._timers.get(sender_id, {}).values(), key=lambda timer: timer.deadline)
+
+    def find(self, sender_id: Text, name: Optional[Text] = None) -> List[Timer]:
+        """Returns the timers of the sender matching the given name (all of them if None), exact matches first."""
+        timers = self.list(sender_id)
+        if name is None:
+            return timers
+        name = name.lower().strip()
+        exact = [ timer for timer in timers if timer.name.lower() == name ]
+        return exact if len(exact) > 0 else [ timer for timer in timers if name in timer.name.lower() ]
+
+    def cancel(self, timer: Timer) -> bool:
+        """Cancel a timer, returns False if it already expired."""
+        with self._lock:
+            if self._timers.get(timer.sender_id, {}).get(timer.name) != timer:
+                return False
+            del self._timers[timer.sender_id][timer.name]
+            self.wheel.cancel(timer.id)
+            return True
+
+    def extend(self, timer: Timer, seconds: float) -> Optional[Timer]:
+        """Move the deadline of a timer by the given seconds, returns the updated timer or None if it already expired."""
+        with self._lock:
+            if self._timers.get(timer.sender_id, {}).get(timer.name) != timer:
+                return None
+            timer = replace(timer, deadline=timer.deadline + seconds, duration=timer.duration + seconds)
+            self._timers[timer.sender_id][timer.name] = timer
+            self.wheel.add(timer)
+            return timer
+
+    def expire(self, now: Optional[float] = None) -> List[Timer]:
+        """Remove and return the timers expired until the given time."""
+        with self._lock:
+            expired = self.wheel.advance(now)
+            for timer in expired:
+                timers = self._timers[timer.sender_id]
+                del timers[timer.name]
+                if len(timers) == 0:
+                    del self._timers[timer.sender_id]
+        return expired
+
+    def _ensure_running(self):
+        """Start ticking in the current event loop, if not already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while len(self.wheel) > 0:
+            await asyncio.sleep(self.resolution)
+            expired = self.expire()
+            if len(expired) > 0:
+                logger.info('%d timers expired', len(expired))
+                asyncio.ensure_future(self._dispatch(expired))  # Do not delay the next tick
+
+    async def _dispatch(self, timers: List[Timer]):
+        try:
+            await self.dispatch(timers)
+        except Exception:
+            logger.exception('Failed to dispatch %d expired timers', len(timers))
+
+
+class TriggerIntentDispatcher():
+    """Notifies the expired timers by triggering an intent in their conversations through the HTTP API of the Rasa
+    server (enabled with `rasa run --enable-api`), with the name of the timer as entity.
+    """
+
+    def __init__(self, url: Text, intent: Text, entity: Text, token: Optional[Text] = None, max_concurrency: int = 32, timeout: float = 10):
+        self.url = url.rstrip('/')
+        self.intent = intent
+        self.entity = entity
+        self.token = token
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+    async def __call__(self, timers: List[Timer]):
+        import aiohttp  # Installed with rasa, only needed when the timers expire
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        params = dict(output_channel='latest', **(dict(token=self.token) if self.token else {}))
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            async def trigger(timer: Timer):
+                async with semaphore:
+                    url = f'{self.url}/conversations/{quote(timer.sender_id, safe="")}/trigger_intent'
+                    try:
+                        async with session.post(url, params=params, json=dict(name=self.intent, entities={ self.entity: timer.name })) as resp:
+                            if resp.status >= 400:
+                                logger.error('Could not notify timer "%s" of %s: HTTP %d', timer.name, timer.sender_id, resp.status)
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        logger.error('Could not notify timer "%s" of %s: %s', timer.name, timer.sender_id, e)
+            await asyncio.gather(*[ trigger(timer) for timer in timers ])
@@ -1,43 +1,118 @@
 """General actions utilities."""
-from typing import Text, List, Optional
-import numpy as np
-from word2number import w2n
+import re
+from datetime import timedelta
+from functools import lru_cache
+from typing import Text, List, Optional, Tuple
 
 
 UNIT_MAPPINGS = dict(
-    hours=['hours', 'hour'],
-    minutes=['minutes', 'minute', 'min'],
-    seconds=['seconds', 'second', 'sec']
+    hours=['hours', 'hour', 'hrs', 'hr', 'h'],
+    minutes=['minutes', 'minute', 'mins', 'min', 'm'],
+    seconds=['seconds', 'second', 'secs', 'sec', 's']
 )
+UNIT_SECONDS = dict(hours=3600, minutes=60, seconds=1)
+
+NUMBER_WORDS = dict(
+    zero=0, one=1, two=2, three=3, four=4, five=5, six=6, seven=7, eight=8, nine=9, ten=10, eleven=11, twelve=12, thirteen=13,
+    fourteen=14, fifteen=15, sixteen=16, seventeen=17, eighteen=18, nineteen=19, twenty=20, thirty=30, forty=40, fifty=50,
+    sixty=60, seventy=70, eighty=80, ninety=90, hundred=100, a=1, an=1, half=0.5, quarter=0.25,
+)
+
+ORDINAL_WORDS = dict(
+    first=1, second=2, third=3, fourth=4, fifth=5, sixth=6, seventh=7, eighth=8, ninth=9, tenth=10, eleventh=11, twelfth=12,
+    thirteenth=13, fourteenth=14, fifteenth=15, sixteenth=16, seventeenth=17, eighteenth=18, nineteenth=19, twentieth=20, last=-1,
+)
+
+# Tokens of the duration expressions, matched in a single pass. Units must not be followed by a letter, so that e.g.
+# "m" does not match the start of "more"
+DURATION_TOKEN = re.compile(r'(?P<number>\d+(?:[.,]\d+)?)|(?P<unit>{})(?![a-z])|(?P<word>[a-z]+)|(?P<other>\S)'.format(
+    '|'.join( re.escape(unit) for units in UNIT_MAPPINGS.values() for unit in units )))
+UNIT_NAMES = { unit: key for key, units in UNIT_MAPPINGS.items() for unit in units }
+SMALLER_UNIT = dict(hours='minutes', minutes='seconds')
+IGNORED_WORDS = {'and', 'of', 'for', 'in', 'about', 'another', 'more', 'just'}
+
+
+@lru_cache(maxsize=4096)
+def _parse_duration(time_str: Text) -> Optional[Tuple[float, Text]]:
+    """Parse a duration expression, returns the number of seconds and the smallest unit used, or None if invalid."""
+    total, smallest = 0.0, None
+    amount, last_unit = None, None
+    article, fraction = False, False  # Whether the amount is an article ("an hour") or ends with a fraction ("and a half")
+
+    def add(amount: float, unit: Text):
+        nonlocal total, smallest
+        total += amount * UNIT_SECONDS[unit]
+        smallest = unit if smallest is None or UNIT_SECONDS[unit] < UNIT_SECONDS[smallest] else smallest
+
+    for match in DURATION_TOKEN.finditer(time_str.lower()):
+        kind, token = match.lastgroup, match.group()
+        if kind == 'number' or (kind == 'word' and token in NUMBER_WORDS):
+            value = float(token.replace(',', '.')) if kind == 'number' else NUMBER_WORDS[token]
+            if token in ('a', 'an'):
+                if amount is None:
+                    amount, article = value, True
+            elif token in ('half', 'quarter'):
+                amount = value if amount is None or article else amount + value
+                article, fraction = False, True
+            elif token == 'hundred':
+                amount = (amount if amount is not None else 1) * value
+            else:
+                amount = value if amount is None or article else amount + value  # e.g. "twenty five"
+                article = False
+        elif kind == 'unit':
+            add(amount if amount is not None else 1, UNIT_NAMES[token])
+            amount, last_unit, article, fraction = None, UNIT_NAMES[token], False, False
+        elif kind == 'word' and token not in IGNORED_WORDS or kind == 'other' and token not in ',.?!-':  # Hyphens separate number words (e.g. "twenty-five")
+            return None
+    if amount is not None:
+        # Trailing amount: a fraction of the last unit (e.g. "an hour and a half"), or in the unit after it (e.g. "1h30"),
+        # minutes if there is no unit
+        if last_unit is None:
+            add(amount, 'minutes')
+        elif fraction:
+            add(amount, last_unit)
+        else:
+            add(amount, SMALLER_UNIT.get(last_unit, 'seconds'))
+    if smallest is None:
+        return None
+    return total, smallest
+
+
+def parse_duration(time_str: Text) -> Optional[timedelta]:
+    """Parse a duration expression (e.g. "20 minutes", "one hour and twenty minutes", "1h30" or "half an hour") into
+    the corresponding timedelta, None if it is not a valid duration. A number without unit is in minutes."""
+    parsed = _parse_duration(time_str)
+    return timedelta(seconds=parsed[0]) if parsed is not None else None
+
+
+def parse_position(text: Text) -> Optional[int]:
+    """Parse a cardinal or ordinal number (e.g. "5", "five", "5th", "fifth" or "twenty first"), -1 for "last", None if invalid."""
+    words = [ word for word in text.lower().replace('-', ' ').split() if word not in ('the', 'step', 'number') ]
+    position = 0
+    for i, word in enumerate(words):
+        ordinal = i == len(words) - 1  # Only the last word can be an ordinal (e.g. "twenty first")
+        if re.fullmatch(r'\d+(st|nd|rd|th)?', word):
+            position += int(re.match(r'\d+', word).group())
+        elif word == 'last' and ordinal:
+            return -1 if position == 0 else None
+        elif word in ORDINAL_WORDS and ordinal:
+            position += ORDINAL_WORDS[word]
+        elif word in NUMBER_WORDS and NUMBER_WORDS[word] >= 1 and word not in ('a', 'an', 'hundred'):
+            position += NUMBER_WORDS[word]
+        else:
+            return None
+    return position if position > 0 else None
 
 
-def lower_first_letter(text: Text):
-    """Lower the first letter of a string."""
-    return text[0].lower() + text[1:]
-
-
-def parse_time_unit(unit_str: Text):
-    """Parse a unit string to a standard time unit."""   
-    for key, units in UNIT_MAPPINGS.items():
-        for unit in units:
-            if unit in unit_str:
-                return key, unit
-    return None, None
-
-
-def parse_time_str(time_str: Text):
-    """Parse a time string into the corresponding time amount and unit."""
-    unit, original_unit = parse_time_unit(time_str)
-    amount = None
-    # If the unit is missing, assume minutes
-    if unit is None:
-        unit, original_unit = 'minutes', ''
-    # Try to parse time amount
-    try:
-        amount = w2n.word_to_num(time_str.replace(original_unit, '').strip())
-    except:
-        amount, unit = None, None
-    return amount, unit
+def format_duration(seconds: float) -> Text:
+    """Format a number of seconds as hours, minutes and seconds (e.g. "1 hour and 5 minutes")."""
+    seconds = int(round(seconds))
+    parts = []
+    for unit, size in (('hour', 3600), ('minute', 60), ('second', 1)):
+        amount, seconds = divmod(seconds, size)
+        if amount > 0:
+            parts.append(f'{amount} {unit}' + ('s' if amount > 1 else ''))
+    return join_list_str(parts) if len(parts) > 0 else '0 seconds'
 
 
 def join_list_str(list_str: List[Text], last_sep: Text = 'and'):
@@ -0,0 +1,91 @@
+"""Server-side cache of the last bot utterance of each conversation."""
+import time
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+# Fields of the bot events and of the dispatched messages that can be sent again
+MESSAGE_FIELDS = ['text', 'buttons', 'image', 'elements', 'attachment']
+
+
+class UtteranceCache():
+    """Bounded LRU store of the last bot utterance of each sender, with expiration.
+
+    The cache is updated on each action call with the events added to the tracker since the previous call of the same
+    sender, and with the messages dispatched by the action, so that finding the last utterance does not scan the
+    whole conversation.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 24 * 60 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Sender -> (last update time, number of tracker events seen, last utterance)
+        self._utterances: 'OrderedDict[Text, Tuple[float, int, Optional[Dict[Text, Any]]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._utterances)
+
+    def _get(self, sender_id: Text) -> Tuple[int, Optional[Dict[Text, Any]]]:
+        item = self._utterances.get(sender_id)
+        if item is None or time.monotonic() - item[0] > self.ttl:
+            return 0, None
+        return item[1], item[2]
+
+    def _set(self, sender_id: Text, n_events: int, utterance: Optional[Dict[Text, Any]]):
+        self._utterances[sender_id] = (time.monotonic(), n_events, utterance)
+        self._utterances.move_to_end(sender_id)
+        while len(self._utterances) > self.max_size:
+            self._utterances.popitem(last=False)  # Evict the least recently active sender
+
+    def observe(self, tracker: Tracker):
+        """Update the last utterance of the sender with the events added to its tracker since the previous call."""
+        with self._lock:
+            n_seen, utterance = self._get(tracker.sender_id)
+            events = tracker.events
+            if n_seen > len(events):  # The tracker has been reset
+                n_seen, utterance = 0, None
+            for i in range(len(events) - 1, n_seen - 1, -1):
+                if events[i].get('event') == 'bot':
+                    utterance = dict(text=events[i].get('text'), **{ key: value for key, value in (events[i].get('data') or {}).items() if key in MESSAGE_FIELDS and value })
+                    break
+            self._set(tracker.sender_id, len(events), utterance)
+
+    def record(self, sender_id: Text, messages: List[Dict[Text, Any]]):
+        """Set the last utterance of the sender to the last message with a text dispatched by an action."""
+        messages = [ message for message in messages if message.get('text') ]
+        if len(messages) == 0:
+            return
+        with self._lock:
+            n_seen, _ = self._get(sender_id)
+            self._set(sender_id, n_seen, { key: value for key, value in messages[-1].items() if key in MESSAGE_FIELDS and value })
+
+    def last(self, sender_id: Text) -> Optional[Dict[Text, Any]]:
+        """Returns the last utterance sent to the sender, or None if unknown."""
+        with self._lock:
+            return self._get(sender_id)[1]
+
+    def observed(self, run: Callable) -> Callable:
+        """Decorator of the run method of the actions, updating the cache with the tracker and the dispatched messages."""
+        if inspect.iscoroutinefunction(run):
+            @functools.wraps(run)
+            async def async_wrapper(action, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]):
+                self.observe(tracker)
+                n_messages = len(dispatcher.messages)
+                result = await run(action, dispatcher, tracker, domain)
+                self.record(tracker.sender_id, dispatcher.messages[n_messages:])
+                return result
+            return async_wrapper
+        @functools.wraps(run)
+        def wrapper(action, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]):
+            self.observe(tracker)
+            n_messages = len(dispatcher.messages)
+            result = run(action, dispatcher, tracker, domain)
+            self.record(tracker.sender_id, dispatcher.messages[n_messages:])
+            return result
+        return wrapper
@@ -0,0 +1,190 @@
+"""Script to benchmark the dataset operations used by the actions, on synthetic recipes collections of increasing size."""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import itertools
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Text
+
+import yaml
+import numpy as np
+
+from actions import ingest
+from actions.cache import QueryCache
+from actions.dataset import load_dataset, shopping_list, RecipeProperty, RECIPES_PATH, INGREDIENTS_SUBSTITUTES_PATH
+from gazetteer_automaton import Gazetteer
+
+parser = argparse.ArgumentParser(description="Benchmark the dataset operations on synthetic recipes collections.")
+parser.add_argument('--n-recipes', '-n', type=int, nargs='+', default=[66, 1000, 10000], help="Sizes of the generated recipes collections (default: %(default)s).")
+parser.add_argument('--backend', '-b', type=str, nargs='+', default=['pandas'], choices=['pandas', 'compact', 'sqlite'], help="Dataset backends to benchmark (default: %(default)s, choices: %(choices)s).")
+parser.add_argument('--min-time', '-t', type=float, default=0.5, help="Minimum time in seconds spent on each operation (default: %(default)s).")
+parser.add_argument('--seed', '-s', type=int, default=0, help="Random seed of the generated recipes and queries (default: %(default)s).")
+parser.add_argument('--out', '-o', type=str, default=None, help="Path of the JSON results file (default: benchmarks/<timestamp>.json).")
+parser.add_argument('--baseline', type=str, default=None, help="Path of a previous JSON results file to compare with.")
+parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown ratio w.r.t. the baseline reported as a regression (default: %(default)s).")
+parser.add_argument('--generate-only', action='store_true', help="Only generate the synthetic recipes files.")
+
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+WORK_DIR = os.path.join(PROJECT_ROOT, '.cache', 'benchmark')
+
+
+def generate_recipes(path: Text, n_recipes: int, seed: int = 0, source_path: Text = RECIPES_PATH):
+    """Generate a file with n_recipes synthetic recipes, with the same structure and vocabulary of the source recipes.
+
+    Titles, ingredients, tags and cuisines are sampled from the source recipes, so that the generated collection has
+    realistic matches and overlaps. Recipes are written one at a time, to generate files larger than the memory.
+    """
+    rng = random.Random(seed)
+    source = ingest.parse_recipes(source_path)
+    title_words = sorted({ word for r in source for word in r['title'].split() })
+    ingredients = [ ingr for r in source for ingr in r['ingredients'] ]
+    tags = sorted({ tag for r in source for tag in r['tags'] })
+    cuisines = sorted({ r['cuisine'] for r in source if r.get('cuisine') is not None })
+    dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# List of synthetic cooking recipes\n\n')
+        for i in range(n_recipes):
+            base = source[i] if i < len(source) else rng.choice(source)  # Include the source recipes as they are
+            if i >= len(source):
+                base = dict(base,
+                    title=' '.join(rng.sample(title_words, rng.randint(2, 4))),
+                    tags=rng.sample(tags, rng.randint(0, 3)),
+                    cuisine=rng.choice(cuisines),
+                    prep_time=rng.randint(0, 60),
+                    cook_time=rng.randint(0, 120),
+                    ingredients=rng.sample(ingredients, rng.randint(3, 12)),
+                )
+            f.write(yaml.dump([base], Dumper=dumper, sort_keys=False, allow_unicode=True, width=120))
+            f.write('\n')
+
+
+def timeit(fn: Callable[[Any], Any], args: List[Any], min_time: float) -> Dict[Text, float]:
+    """Call fn on the given arguments (cycling over them) for at least min_time seconds, returns the time per call."""
+    times = []
+    start = time.perf_counter()
+    for arg in itertools.cycle(args):
+        t = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - t)
+        if time.perf_counter() - start >= min_time and len(times) >= len(args):
+            break
+    times = np.array(times) * 1e6
+    return dict(calls=len(times), mean_us=float(times.mean()), median_us=float(np.median(times)), p95_us=float(np.percentile(times, 95)), min_us=float(times.min()))
+
+
+def benchmark_dataset(dataset, seed: int, min_time: float) -> Dict[Text, Dict[Text, float]]:
+    """Time each operation of the dataset on random queries. Caches are disabled, to time the actual computation."""
+    rng = random.Random(seed)
+    words = sorted({ word.lower() for title in dataset.recipes for word in title.split() })
+    queries = dict(
+        keywords=lambda: rng.sample(words, 1),
+        ingredients=lambda: rng.sample(dataset.ingredients, rng.randint(1, 2)),
+        tags=lambda: rng.sample(dataset.tags, 1),
+        cuisine=lambda: rng.choice(dataset.cuisines),
+    )
+    n_queries = 50
+    results = {}
+    # Search with each combination of filters
+    for mask in itertools.product([False, True], repeat=len(queries)):
+        if not any(mask):
+            continue
+        name = '+'.join( filter_name for filter_name, enabled in zip(queries, mask) if enabled )
+        args = [ [ queries[filter_name]() if enabled else ([] if filter_name != 'cuisine' else None) for filter_name, enabled in zip(queries, mask) ] for _ in range(n_queries) ]
+        results[f'search_recipes[{name}]'] = timeit(lambda a: dataset.search_recipes(*a), args, min_time)
+    args = [ [queries['keywords'](), [], [], None] for _ in range(n_queries) ]
+    results['search_recipes[keywords,top_k=100]'] = timeit(lambda a: dataset.search_recipes(*a, top_k=100), args, min_time)
+    # Recipes
+    recipes_ids = [ rng.randrange(dataset.n_recipes) for _ in range(n_queries) ]
+    results['get_recipe'] = timeit(dataset.get_recipe, recipes_ids, min_time)
+    recipes = [ dataset.get_recipe(recipe_id) for recipe_id in recipes_ids ]
+    results['set_servings'] = timeit(lambda r: r.set_servings(r.servings * 2), recipes, min_time)
+    meal_plans = [ [ (recipe, rng.randint(1, 8)) for recipe in rng.sample(recipes, min(10, len(recipes))) ] for _ in range(n_queries) ]
+    results['shopping_list[10]'] = timeit(shopping_list, meal_plans, min_time)
+    # Refinement, on candidates sets of different sizes
+    for size in [10, 100, 1000]:
+        if size > dataset.n_recipes:
+            continue
+        candidates = [ rng.sample(range(dataset.n_recipes), size) for _ in range(n_queries) ]
+        results[f'get_discriminative_properties[{size}]'] = timeit(dataset.get_discriminative_properties, candidates, min_time)
+        results[f'plan_refinement_question[{size}]'] = timeit(dataset.plan_refinement_question, candidates, min_time)
+        args = [ (c, RecipeProperty.TAG, rng.choice(dataset.tags)) for c in candidates ]
+        results[f'filter_recipes_by_property[{size}]'] = timeit(lambda a: dataset.filter_recipes_by_property(*a), args, min_time)
+    args = [ rng.sample(dataset.ingredients, 1) for _ in range(n_queries) ]
+    results['search_ingredients_substitutes'] = timeit(dataset.search_ingredients_substitutes, args, min_time)
+    # Entity extraction on the vocabulary of the dataset, with the gazetteer and with the patterns of RegexEntityExtractor
+    tables = dict(recipe=dataset.recipes, ingredient=dataset.ingredients, tag=dataset.tags, cuisine=dataset.cuisines)
+    gazetteer = Gazetteer.from_tables(tables)
+    regexes = [ re.compile('(\\b' + '\\b|\\b'.join(map(re.escape, items)) + '\\b)', re.IGNORECASE) for items in tables.values() ]
+    messages = [ f'I would like to cook {rng.choice(dataset.recipes)} with {" and ".join(rng.sample(dataset.ingredients, 2))}' for _ in range(n_queries) ]
+    results['extract_entities[gazetteer]'] = timeit(gazetteer.find, messages, min_time)
+    results['extract_entities[regex]'] = timeit(lambda m: [ match for regex in regexes for match in regex.finditer(m) ], messages, min_time)
+    return results
+
+
+def compare(results: List[Dict[Text, Any]], baseline: List[Dict[Text, Any]], threshold: float) -> int:
+    """Print the slowdown of each operation w.r.t. the baseline, returns the number of regressions."""
+    baseline = { (r['backend'], r['n_recipes'], r['operation']): r for r in baseline }
+    n_regressions = 0
+    print(f'\n{"backend":8} {"n_recipes":>9} {"operation":48} {"baseline":>11} {"current":>11} {"ratio":>6}')
+    for r in results:
+        b = baseline.get((r['backend'], r['n_recipes'], r['operation']))
+        if b is None:
+            continue
+        ratio = r['median_us'] / b['median_us'] if b['median_us'] > 0 else float('inf')
+        regression = ratio > threshold
+        n_regressions += regression
+        print(f'{r["backend"]:8} {r["n_recipes"]:9d} {r["operation"]:48} {b["median_us"]:9.1f}us {r["median_us"]:9.1f}us {ratio:6.2f}{" REGRESSION" if regression else ""}')
+    return n_regressions
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    results = []
+    for n_recipes in args.n_recipes:
+        recipes_path = os.path.join(WORK_DIR, f'recipes-{n_recipes}-{args.seed}.yml')
+        if not os.path.exists(recipes_path):
+            print(f'Generating {n_recipes} recipes...')
+            generate_recipes(recipes_path, n_recipes, seed=args.seed)
+        if args.generate_only:
+            continue
+        for backend in args.backend:
+            print(f'Benchmarking {backend} dataset with {n_recipes} recipes...')
+            paths = dict(recipes_path=recipes_path, ingredients_substitutes_path=INGREDIENTS_SUBSTITUTES_PATH, recipes_cache_size=0, query_cache=QueryCache(max_size=0))
+            if backend == 'pandas':
+                paths.update(snapshot_path=None)
+            elif backend == 'compact':
+                paths.update(corpus_path=os.path.join(WORK_DIR, f'recipes-{n_recipes}-{args.seed}.corpus'))
+            else:
+                paths.update(database_path=os.path.join(WORK_DIR, f'recipes-{n_recipes}-{args.seed}.sqlite'))
+            start = time.perf_counter()
+            dataset = load_dataset(backend, **paths)
+            load_time = (time.perf_counter() - start) * 1e6
+            timings = dict(load=dict(calls=1, mean_us=load_time, median_us=load_time, p95_us=load_time, min_us=load_time))
+            timings.update(benchmark_dataset(dataset, args.seed, args.min_time))
+            for operation, timing in timings.items():
+                results.append(dict(backend=backend, n_recipes=n_recipes, operation=operation, **timing))
+                print(f'  {operation:48} {timing["median_us"]:12.1f}us')
+    if args.generate_only:
+        sys.exit(0)
+    # Save the results
+    out_path = args.out or os.path.join(PROJECT_ROOT, 'benchmarks', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, 'w') as f:
+        json.dump(dict(
+            meta=dict(date=datetime.now().isoformat(), python=platform.python_version(), platform=platform.platform(), seed=args.seed, min_time=args.min_time),
+            results=results,
+        ), f, indent=2)
+    print(f'\nResults saved to {out_path}')
+    # Compare with the baseline
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            n_regressions = compare(results, json.load(f)['results'], args.threshold)
+        print(f'\n{n_regressions} regressions (threshold {args.threshold:.2f}x)')
+        sys.exit(1 if n_regressions > 0 else 0)
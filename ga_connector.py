@@ -1,5 +1,8 @@
 """Google Assistant connector for Rasa"""
+import asyncio
 import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Text
+
 from sanic import Blueprint, response
 
 from rasa.core.channels.channel import UserMessage
@@ -8,32 +11,115 @@ from rasa.core.channels.channel import CollectingOutputChannel
 
 logger = logging.getLogger(__name__)
 
+WELCOME_TEXT = 'Hello! Welcome to the Cooking assistant! What would you like to prepare today?'
+OVERLOADED_TEXT = "I'm sorry, I'm a bit busy right now. Could you please repeat that in a moment?"
+
+
+class Overloaded(Exception):
+    """Raised when a message is rejected because too many messages are pending."""
+
+
+class ConversationScheduler():
+    """Runs the messages of the same conversation one at a time and in order of arrival, and the messages of different
+    conversations in parallel, up to max_concurrency at once.
+
+    At most max_pending messages (and max_pending_per_conversation for each conversation) can be running or waiting:
+    the following ones are rejected immediately with Overloaded, so that the clients get a fast answer instead of
+    timing out in a growing queue.
+    """
+
+    def __init__(self, max_concurrency: int = 32, max_pending: int = 256, max_pending_per_conversation: int = 4):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.max_pending_per_conversation = max_pending_per_conversation
+        self.pending = 0
+        self._conversations: Dict[Text, List[Any]] = {}  # Lock and number of pending messages of each conversation
+        self._semaphore: Optional[asyncio.Semaphore] = None  # Created in the event loop of the server
+
+    async def run(self, conversation_id: Text, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn after the previous messages of the conversation, or raise Overloaded if too many messages are pending."""
+        conversation = self._conversations.get(conversation_id)
+        if self.pending >= self.max_pending or (conversation is not None and conversation[1] >= self.max_pending_per_conversation):
+            raise Overloaded()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if conversation is None:
+            conversation = self._conversations[conversation_id] = [asyncio.Lock(), 0]
+        self.pending += 1
+        conversation[1] += 1
+        try:
+            async with conversation[0]:  # asyncio locks are fair, so the messages run in order of arrival
+                async with self._semaphore:
+                    return await fn()
+        finally:
+            self.pending -= 1
+            conversation[1] -= 1
+            if conversation[1] == 0:
+                del self._conversations[conversation_id]
+
+
 class GoogleConnector(InputChannel):
-    """Custom connector to Google Assistant."""
+    """Custom connector to Google Assistant.
+
+    Each Google Assistant conversation is a separate Rasa conversation, its messages are processed in order, while
+    different conversations are processed concurrently (see ConversationScheduler for the limits, which can be set
+    in the credentials of the connector).
+    """
 
     @classmethod
     def name(cls):
         return 'google_assistant'
 
+    @classmethod
+    def from_credentials(cls, credentials: Optional[Dict[Text, Any]]) -> InputChannel:
+        return cls(**(credentials or {}))
+
+    def __init__(self, max_concurrency: int = 32, max_pending: int = 256, max_pending_per_conversation: int = 4):
+        self.scheduler = ConversationScheduler(max_concurrency, max_pending, max_pending_per_conversation)
+
+    @staticmethod
+    def conversation_id(payload: Dict[Text, Any]) -> Optional[Text]:
+        """Returns the id of the conversation of a webhook request, or of the user if missing."""
+        return (payload.get('conversation') or {}).get('conversationId') or (payload.get('user') or {}).get('userId')
+
+    @staticmethod
+    def response(items: List[Dict[Text, Any]]) -> Dict[Text, Any]:
+        return {
+            'expectUserResponse': 'true',
+            'expectedInputs': [{
+                'possibleIntents': [ { 'intent': 'actions.intent.TEXT' } ],
+                'inputPrompt': {
+                    'richInitialPrompt': {
+                        'items': items
+                    }
+                }
+            }]
+        }
+
     def blueprint(self, on_new_message):
         google_webhook = Blueprint('google_webhook', __name__)
 
         @google_webhook.route('/', methods=['GET'])
         async def health(request):
-            return response.json({'status': 'ok'})
+            return response.json({'status': 'ok', 'pending': self.scheduler.pending})
 
         @google_webhook.route('/webhook', methods=['POST'])
         async def receive(request):
-            payload = request.json	
-            intent = payload['inputs'][0]['intent'] 			
-            text = payload['inputs'][0]['rawInputs'][0]['query'] 
-	
+            payload = request.json
+            intent = payload['inputs'][0]['intent']
+            text = payload['inputs'][0]['rawInputs'][0]['query']
+            sender_id = self.conversation_id(payload)
+
             items = []
             if intent == 'actions.intent.MAIN':
-                items.append({'simpleResponse': { 'textToSpeech': 'Hello! Welcome to the Cooking assistant! What would you like to prepare today?'	}})
+                items.append({'simpleResponse': { 'textToSpeech': WELCOME_TEXT }})
             else:
                 out = CollectingOutputChannel()
-                await on_new_message(UserMessage(text, out))
+                try:
+                    await self.scheduler.run(sender_id or 'default', lambda: on_new_message(UserMessage(text, out, sender_id=sender_id, input_channel=self.name())))
+                except Overloaded:
+                    logger.warning("Rejected message of conversation %s, %d messages pending", sender_id, self.scheduler.pending)
+                    return response.json(self.response([{'simpleResponse': { 'textToSpeech': OVERLOADED_TEXT }}]))
                 logger.info("Received message: %s", out.messages)
                 for m in out.messages:
                     if 'text' in m:
@@ -42,17 +128,6 @@ class GoogleConnector(InputChannel):
                         items.append({'basicCard': { 'image': { 'url': m['image'] } }})
                     else:
                         logger.error("Unknown message type: %s", m)
-            r = {
-                'expectUserResponse': 'true',
-                'expectedInputs': [{
-                    'possibleIntents': [ { 'intent': 'actions.intent.TEXT' } ],
-                    'inputPrompt': {
-                        'richInitialPrompt': {
-                            'items': items
-                        }
-                    }
-                }]
-            }
-            return response.json(r)				
-	
+            return response.json(self.response(items))
+
         return google_webhook
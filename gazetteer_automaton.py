@@ -0,0 +1,125 @@
+"""Aho-Corasick automaton matching a vocabulary of entities in the messages, without depending on Rasa."""
+import re
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+SPACES_PATTERN = re.compile(r'\s+')
+IRREGULAR_SPACES_PATTERN = re.compile(r'\s\s|[^\S ]')  # Whitespaces other than a single space
+
+
+def normalize(text: Text) -> Text:
+    """Lowercase a text keeping its length, so that the matches can be mapped back to the original text."""
+    lowered = text.lower()
+    if len(lowered) != len(text):  # Some characters change length when lowercased
+        lowered = ''.join( c.lower()[0] for c in text )
+    return lowered
+
+
+def collapse_spaces(text: Text) -> Tuple[Text, Optional[List[int]]]:
+    """Replace the runs of whitespaces with a single space, as in the items of the gazetteer. Returns the collapsed text
+    and the offset in the original text of each of its characters (None if the text is unchanged)."""
+    if not IRREGULAR_SPACES_PATTERN.search(text):
+        return text, None
+    parts, offsets, position = [], [], 0
+    for match in SPACES_PATTERN.finditer(text):
+        parts += [text[position:match.start()], ' ']
+        offsets += [*range(position, match.start()), match.start()]
+        position = match.end()
+    parts.append(text[position:])
+    offsets += [*range(position, len(text)), len(text)]
+    return ''.join(parts), offsets
+
+
+def normalize_item(text: Text) -> Text:
+    """Key of an item of the gazetteer, lowercased and with single spaces between its words."""
+    return SPACES_PATTERN.sub(' ', normalize(text).strip())
+
+
+class Gazetteer():
+    """Aho-Corasick automaton over a vocabulary of (text, entity, value) items, finding all the items in a message
+    with a single pass over its characters, whatever the size of the vocabulary.
+
+    Matches are case-insensitive and on whole words only. Overlapping matches are resolved keeping the leftmost and
+    longest ones, with all the entities of the same text (e.g. a name that is both a recipe and an ingredient).
+    """
+
+    def __init__(self, items: Iterable[Tuple[Text, Text, Optional[Text]]]):
+        self.patterns: List[Tuple[int, Text, Optional[Text]]] = []  # Length, entity, value (None to keep the text)
+        self.goto: List[Dict[Text, int]] = [{}]  # Transitions of each state of the trie
+        self.out: List[List[int]] = [[]]  # Patterns ending in each state
+        for text, entity, value in items:
+            key = normalize_item(text)
+            if len(key) == 0:
+                continue
+            state = 0
+            for c in key:
+                if c not in self.goto[state]:
+                    self.goto[state][c] = len(self.goto)
+                    self.goto.append({})
+                    self.out.append([])
+                state = self.goto[state][c]
+            if all( self.patterns[i][1] != entity for i in self.out[state] ):  # The first value of the same item wins
+                self.out[state].append(len(self.patterns))
+                self.patterns.append((len(key), entity, value))
+        # Failure links, in breadth-first order so that the links of the shorter suffixes are already set
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(c, 0)
+                self.out[next_state] = self.out[next_state] + self.out[self.fail[next_state]]
+
+    @classmethod
+    def from_tables(cls, tables: Dict[Text, Iterable[Text]], synonyms: Optional[Dict[Text, Text]] = None) -> 'Gazetteer':
+        """Build the gazetteer from the lists of items of each entity, and the synonyms of the items (synonym -> item)."""
+        items = [ (text, entity, None) for entity, texts in tables.items() for text in texts ]
+        entities = {}  # Normalized item -> its entities
+        for text, entity, _ in items:
+            entities.setdefault(normalize_item(text), []).append(entity)
+        items += [ (synonym, entity, value) for synonym, value in (synonyms or {}).items() for entity in entities.get(normalize_item(value), []) ]
+        return cls(items)
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def find(self, text: Text) -> List[Dict[Text, Any]]:
+        """Returns the entities found in the text, in order. The words of the items can be separated by any whitespaces."""
+        lowered, offsets = collapse_spaces(normalize(text))
+        goto, fail, out, patterns = self.goto, self.fail, self.out, self.patterns
+        matches = []  # (start, end, pattern)
+        state = 0
+        for i, c in enumerate(lowered):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state] and (i + 1 == len(lowered) or not lowered[i + 1].isalnum()):
+                for pattern in out[state]:
+                    start = i + 1 - patterns[pattern][0]
+                    if start == 0 or not lowered[start - 1].isalnum():
+                        matches.append((start, i + 1, pattern))
+        entities, last = [], (0, 0)
+        for start, stop, pattern in sorted(matches, key=lambda m: (m[0], m[0] - m[1])):
+            if start < last[1] and (start, stop) != last:
+                continue  # Overlaps a previous match
+            last = (start, stop)
+            if offsets is not None:  # Back to the positions in the original text
+                start, stop = offsets[start], offsets[stop - 1] + 1
+            _, entity, value = patterns[pattern]
+            entities.append(dict(start=start, end=stop, value=value if value is not None else text[start:stop], entity=entity))
+        return entities
+
+    def to_dict(self) -> Dict[Text, Any]:
+        return dict(patterns=self.patterns, goto=self.goto, fail=self.fail, out=self.out)
+
+    @classmethod
+    def from_dict(cls, data: Dict[Text, Any]) -> 'Gazetteer':
+        """Restore a compiled automaton, without building it again."""
+        gazetteer = cls([])
+        gazetteer.patterns = [ tuple(pattern) for pattern in data['patterns'] ]
+        gazetteer.goto, gazetteer.fail, gazetteer.out = data['goto'], data['fail'], data['out']
+        return gazetteer
@@ -1,61 +1,144 @@
-"""Simple script to generate data using chatette and convert it to the rasa YAML format."""
+"""Simple script to generate data using chatette and convert it to the rasa YAML format.
+
+The generation is incremental: each step is skipped if the content hash of its inputs did not change since its last
+run, outputs are written only if their content changed, and the steps that do not depend on each other run in parallel.
+"""
 import os
+import json
 import shutil
-from typing import List, Text
-from chatette.facade import Facade as ChatetteFacade
-from rasa.nlu.convert import convert_training_data
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Text
+
+from actions.dataset import Dataset, RECIPES_PATH
+from actions.snapshot import hash_files
 
-from actions.dataset import Dataset
+parser = argparse.ArgumentParser(description="Generate the NLU data from the recipes and the chatette templates.")
+parser.add_argument('--force', '-f', action='store_true', help="Run all the steps, even if their inputs did not change.")
 
 PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
 DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
+CHATETTE_DIR = os.path.join(DATA_DIR, 'chatette')
+STATE_PATH = os.path.join(PROJECT_ROOT, '.cache', 'generate_data.json')  # Inputs hash of the last run of each step
 
 
-def generate_entities_file(entity_name: Text, items: List[Text], file_path: Text, mode: Text = 'w'):
-    """Generate a file containing a list of entities."""
-    with open(file_path, mode, encoding='utf-8') as file:
-        file.write(f'@[{entity_name}]\n')
-        for item in items:
-            file.write(f'    {item}\n')
-        file.write('\n')
+def generate_entities_file(entity_name: Text, items: List[Text]) -> Text:
+    """Generate the content of a file containing a list of entities."""
+    content = f'@[{entity_name}]\n'
+    for item in items:
+        content += f'    {item}\n'
+    return content + '\n'
 
 
-def generate_lookup_tables(entity_name: Text, items: List[Text], file_path: Text, mode: Text = 'w'):
-    """Generate base file for chatette with entity synonyms and lookup tables (yaml.dump does no supports Rasa format)."""
-    with open(file_path, mode, encoding='utf-8') as file:
-        if mode == 'w': # Write the header only at the beggining of the file
-            file.write('version: "2.0"\nnlu:\n') 
-        file.write(f'- lookup: {entity_name}\n  examples: |\n')
-        for item in items:
-            file.write(f'    - {item}\n')
-        file.write('\n')
+def generate_lookup_tables(entity_name: Text, items: List[Text], header: bool = True) -> Text:
+    """Generate the content of a file with entity synonyms and lookup tables (yaml.dump does no supports Rasa format)."""
+    content = 'version: "2.0"\nnlu:\n' if header else ''  # Write the header only at the beggining of the file
+    content += f'- lookup: {entity_name}\n  examples: |\n'
+    for item in items:
+        content += f'    - {item}\n'
+    return content + '\n'
 
 
-if __name__ == '__main__':
-    # Init dataset
-    dataset = Dataset()
-
-    # Generate entities for recipes names
-    print('Generating recipes keyword entities...')
-    generate_entities_file('recipe', dataset.recipes, os.path.join(DATA_DIR, 'chatette', 'recipes.chatette'))
-
-    # Generate entities for ingredient names
-    print('Generating ingredients entities...')
-    generate_entities_file('ingredient', dataset.ingredients, os.path.join(DATA_DIR, 'chatette', 'ingredients.chatette'))
-
-    # Generate entities for recipe tags
-    print('Generating tags lookup tables and entities...')
-    generate_lookup_tables('tag', dataset.tags, os.path.join(DATA_DIR, 'tags.yml'))
-    generate_lookup_tables('cuisine', dataset.cuisines, os.path.join(DATA_DIR, 'tags.yml'), mode='a')
-    generate_entities_file('tag', dataset.tags, os.path.join(DATA_DIR, 'chatette', 'tags.chatette'))
-    generate_entities_file('cuisine', dataset.cuisines, os.path.join(DATA_DIR, 'chatette', 'tags.chatette'), mode='a')
-
-    # Generate NLU data with Chatette
-    print('Generating data with Chatette...')
-    chatette = ChatetteFacade(os.path.join(DATA_DIR, 'chatette', 'main.chatette'), '.out', adapter_str='rasa', seed='0', force_overwriting=True, local=True)
+def write_if_changed(path: Text, content: Text) -> bool:
+    """Write the content to the file only if different, so that its modification time (used by rasa train) changes only when needed."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            if file.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    return True
+
+
+_dataset, _dataset_lock = None, threading.Lock()
+def get_dataset() -> Dataset:
+    """Load the dataset once, shared by the steps that need it."""
+    global _dataset
+    with _dataset_lock:
+        if _dataset is None:
+            _dataset = Dataset()
+        return _dataset
+
+
+def generate_nlu(output_path: Text):
+    """Generate NLU data with Chatette, converted to the yaml format supported by rasa."""
+    from chatette.facade import Facade as ChatetteFacade
+    from rasa.nlu.convert import convert_training_data
+    chatette = ChatetteFacade(os.path.join(CHATETTE_DIR, 'main.chatette'), '.out', adapter_str='rasa', seed='0', force_overwriting=True, local=True)
     chatette.run()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        convert_training_data(os.path.join(CHATETTE_DIR, '.out'), os.path.join(tmp_dir, 'nlu.yml'), 'yml', 'en')
+        with open(os.path.join(tmp_dir, 'nlu.yml'), 'r', encoding='utf-8') as file:
+            write_if_changed(output_path, file.read())
+    shutil.rmtree(os.path.join(CHATETTE_DIR, '.out'))
+
+
+class Step():
+    """Generation step, producing the outputs from the inputs files after the steps it depends on."""
+
+    def __init__(self, name: Text, inputs: Callable[[], List[Text]], outputs: List[Text], run: Callable[[], None], deps: Optional[List[Text]] = None):
+        self.name = name
+        self.inputs = inputs  # Called after the dependencies ran, since they can write the inputs
+        self.outputs = outputs
+        self.run = run
+        self.deps = list(deps or [])
+
+
+def run_steps(steps: List[Step], state: Dict[Text, Text], force: bool = False):
+    """Run the steps whose inputs changed, in waves of steps whose dependencies are done, in parallel within each wave."""
+    done = set()
+    def run_step(step: Step):
+        digest = hash_files(sorted(step.inputs()), step.name)
+        if not force and state.get(step.name) == digest and all(os.path.exists(path) for path in step.outputs):
+            print(f'Skipping {step.name}, inputs unchanged')
+            return
+        print(f'Running {step.name}...')
+        step.run()
+        state[step.name] = digest
+    with ThreadPoolExecutor() as executor:
+        while len(done) < len(steps):
+            wave = [ step for step in steps if step.name not in done and all(dep in done for dep in step.deps) ]
+            if len(wave) == 0:
+                raise ValueError('Circular dependencies between the steps')
+            for future in [ executor.submit(run_step, step) for step in wave ]:
+                future.result()
+            done.update( step.name for step in wave )
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    try:
+        with open(STATE_PATH, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
 
-    # Read Chatette output and convert it to the yaml format supported by rasa
-    print('Converting data to YAML format...')
-    convert_training_data(os.path.join(DATA_DIR, 'chatette', '.out'), os.path.join(DATA_DIR, 'nlu.yml'), 'yml', 'en')
-    shutil.rmtree(os.path.join(DATA_DIR, 'chatette', '.out'))
+    recipes_inputs = lambda: [RECIPES_PATH, __file__]
+    chatette_path = lambda name: os.path.join(CHATETTE_DIR, name)
+    steps = [
+        # Entities for recipes names
+        Step('recipes entities', recipes_inputs, [chatette_path('recipes.chatette')],
+             lambda: write_if_changed(chatette_path('recipes.chatette'), generate_entities_file('recipe', get_dataset().recipes))),
+        # Entities for ingredient names
+        Step('ingredients entities', recipes_inputs, [chatette_path('ingredients.chatette')],
+             lambda: write_if_changed(chatette_path('ingredients.chatette'), generate_entities_file('ingredient', get_dataset().ingredients))),
+        # Entities and lookup tables for recipe tags
+        Step('tags entities', recipes_inputs, [chatette_path('tags.chatette')],
+             lambda: write_if_changed(chatette_path('tags.chatette'), generate_entities_file('tag', get_dataset().tags) + generate_entities_file('cuisine', get_dataset().cuisines))),
+        Step('tags lookup tables', recipes_inputs, [os.path.join(DATA_DIR, 'tags.yml')],
+             lambda: write_if_changed(os.path.join(DATA_DIR, 'tags.yml'), generate_lookup_tables('tag', get_dataset().tags) + generate_lookup_tables('cuisine', get_dataset().cuisines, header=False))),
+        # NLU data generated by Chatette from all the templates
+        Step('nlu data', lambda: [ chatette_path(name) for name in os.listdir(CHATETTE_DIR) if name.endswith('.chatette') ] + [__file__],
+             [os.path.join(DATA_DIR, 'nlu.yml')], lambda: generate_nlu(os.path.join(DATA_DIR, 'nlu.yml')),
+             deps=['recipes entities', 'ingredients entities', 'tags entities']),
+    ]
+    try:
+        run_steps(steps, state, force=args.force)
+    finally:
+        os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+        with open(STATE_PATH, 'w') as f:
+            json.dump(state, f, indent=2)
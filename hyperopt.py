@@ -1,12 +1,16 @@
 """Script to run hyperparameters optimization of a Rasa model."""
 import os
-import tempfile
+import math
 import glob
+import time
+import queue
 import yaml
 import json
 import argparse
+import threading
 import subprocess
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 import pandas as pd
 from sklearn.model_selection import ParameterSampler
@@ -15,10 +19,18 @@ parser = argparse.ArgumentParser(description="Run hyperparameters optimization o
 parser.add_argument('--n-iter', '-n', type=int, default=100, help="Total number of iterations to run (default: %(default)s).")
 parser.add_argument('--n-runs', '-r', type=int, default=3, help="Total number of experiments per run (default: %(default)s).")
 parser.add_argument('--percentages', '-p', type=int, nargs="+", default=[0, 50, 75], help="Fractions of training data to held-out during training (default: %(default)s).")
-parser.add_argument('--component', '-c', type=str, default=None, choices=['all', 'nlu', 'core'], help="Which component to train (default: %(default)s, choices: %(choices)s).")
+parser.add_argument('--component', '-c', type=str, default='all', choices=['all', 'nlu', 'core'], help="Which component to train (default: %(default)s, choices: %(choices)s).")
+parser.add_argument('--threads-per-job', '-t', type=int, default=2, help="Cores and threads used by each training or testing job (default: %(default)s).")
+parser.add_argument('--strategy', '-s', type=str, default='random', choices=['random', 'halving', 'hyperband'], help="Search strategy (default: %(default)s, choices: %(choices)s).")
+parser.add_argument('--eta', type=int, default=3, help="Fraction of configs promoted to the next rung, and budget increase, of halving and hyperband (default: 1/%(default)s).")
+parser.add_argument('--min-budget', type=float, default=1/9, help="Budget of the first rung of halving and hyperband, as a fraction of the full budget (default: %(default).3f).")
+parser.add_argument('--budget-param', type=str, default='epochs', help="Hyperparameter scaled by the budget (default: %(default)s).")
+parser.add_argument('--jobs', '-j', type=int, default=None, help="Number of jobs to run in parallel (default: number of cores / threads per job).")
 
 
 PROJECT_ROOT = os.path.dirname(__file__)
+# Thread pools sizes of TensorFlow (read by Rasa) and of the BLAS libraries used by numpy and sklearn
+THREADS_ENV_VARS = ['TF_INTRA_OP_PARALLELISM_THREADS', 'TF_INTER_OP_PARALLELISM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
 
 def set_hyperparams(config: dict, params: dict) -> dict:
     """Set the given hyperparams in the config dictionary."""
@@ -38,8 +50,185 @@ def listdir(path: str, exclude: list = []):
             yield dir_name, dir_path
 
 
-def run_hyperopts(exp_name: str, n_iter: int, n_runs: int, percentages: list):
-    """Run hyperparameters search."""
+class Job():
+    """Commands to run one after the other, independent from the other jobs."""
+
+    def __init__(self, name: str, commands: list):
+        self.name = name
+        self.commands = commands
+
+
+def run_jobs(jobs: list, log_dir: str, n_workers: int, threads_per_job: int):
+    """Run the jobs on a pool of n_workers, each pinned to its own threads_per_job cores and with the thread pools of
+    TensorFlow and of the BLAS libraries capped to them, so that the concurrent jobs do not oversubscribe the cores.
+    The output of each job is written to its log file, the failed jobs are reported at the end."""
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    slots = queue.Queue()  # Cores of the free workers
+    for i in range(n_workers):
+        slots.put(cpus[i * threads_per_job % len(cpus):][:threads_per_job] or cpus[:threads_per_job])
+    env = dict(os.environ, **{ var: str(threads_per_job) for var in THREADS_ENV_VARS })
+    os.makedirs(log_dir, exist_ok=True)
+    start, done, failed, lock = time.time(), 0, [], threading.Lock()
+
+    def run_job(job: Job):
+        nonlocal done
+        cores = slots.get()
+        if hasattr(os, 'sched_setaffinity'):
+            # Pin this worker thread (pid 0 is the calling thread on Linux): the processes it starts inherit its affinity,
+            # so that the commands and all their threads start on the cores
+            os.sched_setaffinity(0, cores)
+        try:
+            with open(os.path.join(log_dir, f'{job.name}.log'), 'w') as log:
+                for command in job.commands:
+                    log.write(f'$ {" ".join(command)}\n')
+                    log.flush()
+                    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+                    if process.wait() != 0:
+                        failed.append(job.name)
+                        break
+        finally:
+            slots.put(cores)
+        with lock:
+            done += 1
+            elapsed = time.time() - start
+            print(f'[{done}/{len(jobs)}] {job.name} {"FAILED" if job.name in failed else "done"} '
+                  f'({elapsed:.0f}s elapsed, ~{elapsed / done * (len(jobs) - done):.0f}s left)', flush=True)
+
+    with ThreadPoolExecutor(n_workers) as executor:
+        list(executor.map(run_job, jobs))
+    if len(failed) > 0:
+        raise RuntimeError(f'{len(failed)} jobs failed, see their logs in {log_dir}: {", ".join(failed)}')
+
+
+def nlu_jobs(work_dir: str, configs: list, n_runs: int, percentages: list) -> tuple:
+    """Jobs splitting the NLU data of each run (train/test, then the held-out fractions of train), and jobs training and
+    testing each config on each split, with the same output layout of "rasa test nlu" in comparison mode."""
+    split_jobs, jobs = [], []
+    for run in range(1, n_runs + 1):
+        split_dir = os.path.join(work_dir, 'splits', f'run_{run}')
+        commands = [['rasa', 'data', 'split', 'nlu', '--nlu', os.path.join(PROJECT_ROOT, 'data'), '--training-fraction', '0.8',
+                     '--random-seed', str(run), '--out', split_dir]]
+        for percentage in percentages:
+            if percentage > 0:
+                commands.append(['rasa', 'data', 'split', 'nlu', '--nlu', os.path.join(split_dir, 'training_data.yml'),
+                                 '--training-fraction', str(1 - percentage / 100), '--random-seed', str(run),
+                                 '--out', os.path.join(split_dir, f'{percentage}%_exclusion')])
+        split_jobs.append(Job(f'nlu-split-run_{run}', commands))
+        for percentage in percentages:
+            train_path = os.path.join(split_dir, f'{percentage}%_exclusion' if percentage > 0 else '', 'training_data.yml')
+            for config_path in configs:
+                config_name = os.path.basename(config_path).replace('.yml', '')
+                models_dir = os.path.join(work_dir, 'models', 'nlu', f'run_{run}', f'{percentage}%_exclusion')
+                jobs.append(Job(f'nlu-{config_name}-run_{run}-{percentage}%', [
+                    ['rasa', 'train', 'nlu', '--config', config_path, '--nlu', train_path, '--out', models_dir, '--fixed-model-name', config_name],
+                    ['rasa', 'test', 'nlu', '--model', os.path.join(models_dir, f'{config_name}.tar.gz'), '--nlu', os.path.join(split_dir, 'test_data.yml'),
+                     '--no-plot', '--out', os.path.join(work_dir, 'nlu', f'run_{run}', f'{percentage}%_exclusion', f'{config_name}_report')],
+                ]))
+    return split_jobs, jobs
+
+
+def core_jobs(work_dir: str, configs: list, n_runs: int, stories_path: str) -> list:
+    """Jobs training each config on each run, and testing it on the train and test stories."""
+    jobs = []
+    for run in range(1, n_runs + 1):
+        for config_path in configs:
+            config_name = os.path.basename(config_path).replace('.yml', '')
+            model_name = f'{config_name}__percentage__0'  # Same names of "rasa train core" in comparison mode
+            models_dir = os.path.join(work_dir, 'core', 'models', f'run_{run}')
+            commands = [['rasa', 'train', 'core', '--domain', os.path.join(PROJECT_ROOT, 'domain.yml'), '--stories', stories_path,
+                         '--config', config_path, '--out', models_dir, '--fixed-model-name', model_name]]
+            for split, stories_dir in dict(train='data', test='tests').items():
+                commands.append(['rasa', 'test', 'core', '--model', os.path.join(models_dir, f'{model_name}.tar.gz'),
+                                 '--stories', os.path.join(PROJECT_ROOT, stories_dir, 'stories.yml'),
+                                 '--out', os.path.join(work_dir, 'core', f'run_{run}', model_name, split)])
+            jobs.append(Job(f'core-{config_name}-run_{run}', commands))
+    return jobs
+
+
+def run_experiment(work_dir: str, configs: list, n_runs: int, percentages: list, component: str, n_workers: int, threads_per_job: int):
+    """Train and test the given configs, training and testing each config on each run and split in parallel."""
+    jobs = []
+    # Train and test NLU models with cross-validation
+    if component in ['all', 'nlu']:
+        split_jobs, nlu_train_jobs = nlu_jobs(work_dir, configs, n_runs, percentages)
+        print('\nSplitting NLU data...')
+        run_jobs(split_jobs, os.path.join(work_dir, 'logs'), n_workers, threads_per_job)
+        jobs += nlu_train_jobs
+
+    if component in ['all', 'core']:
+        # Merge stories and rules in a single file to support rasa training with multiple stories
+        tmp_stories_path = os.path.join(work_dir, 'stories.yml')
+        with open(tmp_stories_path, 'w') as tmp_file:
+            with open(os.path.join(PROJECT_ROOT, 'data', 'stories.yml'), 'r') as stories_file, \
+                open(os.path.join(PROJECT_ROOT, 'data', 'rules.yml'), 'r') as rules_file:
+                tmp_file.write(stories_file.read())
+                rules_file.readline() # Skip first line with "version"
+                tmp_file.write(rules_file.read())
+        jobs += core_jobs(work_dir, configs, n_runs, tmp_stories_path)
+
+    print(f'\nTraining and testing models ({len(jobs)} jobs on {n_workers} workers, {threads_per_job} threads each)...')
+    run_jobs(jobs, os.path.join(work_dir, 'logs'), n_workers, threads_per_job)
+
+
+def write_configs(work_dir: str, config: dict, params: dict, budget: float = 1, budget_param: str = 'epochs') -> list:
+    """Write the config file of each set of hyperparams (config id -> hyperparams), with budget_param scaled by the budget."""
+    configs = []
+    os.makedirs(os.path.join(work_dir, 'configs'), exist_ok=True)
+    for config_id, config_params in params.items():
+        scaled_params = dict(config_params)
+        if budget < 1 and budget_param in scaled_params:
+            scaled_params[budget_param] = max(1, round(scaled_params[budget_param] * budget))
+        hyperparams = dict(config_params, budget=budget) if budget < 1 else config_params
+        with open(os.path.join(work_dir, 'configs', f'{config_id}.yml'), 'w') as f:
+            yaml.dump(dict(**set_hyperparams(config, scaled_params), hyperparams=hyperparams), f)
+            configs.append(f.name)
+    return configs
+
+
+def random_search(params: dict, evaluate, **kwargs) -> pd.Series:
+    """Evaluate all the configs with the full budget."""
+    return evaluate(None, params, 1)
+
+
+def successive_halving(params: dict, evaluate, eta: int = 3, min_budget: float = 1 / 9, bracket: int = 0, **kwargs) -> pd.Series:
+    """Evaluate all the configs with min_budget, then only the best 1/eta of them with eta times the budget, and so on
+    up to the full budget. Returns the scores of the configs evaluated with the full budget."""
+    min_budget = min(1, min_budget)
+    n_rungs = int(round(math.log(1 / min_budget, eta))) + 1
+    for rung in range(n_rungs):
+        budget = min_budget * eta ** rung if rung < n_rungs - 1 else 1
+        scores = evaluate(f'rung_{bracket}-{rung}', params, budget)
+        if rung < n_rungs - 1:
+            promoted = scores.sort_values(ascending=False).index[:max(1, len(params) // eta)]
+            params = { config_id: params[config_id] for config_id in promoted }
+    return scores
+
+
+def hyperband(params: dict, evaluate, eta: int = 3, min_budget: float = 1 / 9, **kwargs) -> pd.Series:
+    """Run successive halving in brackets starting from decreasing numbers of configs with increasing budgets, to hedge
+    against configs that are bad with small budgets only. The configs are split between the brackets as in Hyperband."""
+    s_max = int(round(math.log(1 / min_budget, eta)))
+    sizes = [ math.ceil((s_max + 1) / (s + 1) * eta ** s) for s in range(s_max, -1, -1) ]
+    ids, scores, start = list(params), [], 0
+    for i, s in enumerate(range(s_max, -1, -1)):
+        n_configs = max(1, round(len(ids) * sizes[i] / sum(sizes))) if i < s_max else len(ids) - start
+        bracket_ids = ids[start:start + n_configs]
+        start += n_configs
+        if len(bracket_ids) > 0:
+            scores.append(successive_halving({ config_id: params[config_id] for config_id in bracket_ids }, evaluate, eta, eta ** -s, bracket=i))
+    return pd.concat(scores)
+
+
+STRATEGIES = dict(random=random_search, halving=successive_halving, hyperband=hyperband)
+
+
+def run_hyperopts(exp_name: str, n_iter: int, n_runs: int, percentages: list, component: str, n_workers: int = 1, threads_per_job: int = 1,
+                  strategy: str = 'random', eta: int = 3, min_budget: float = 1 / 9, budget_param: str = 'epochs'):
+    """Run hyperparameters search.
+
+    With the halving and hyperband strategies, the configs are first evaluated with a fraction of the budget: fewer
+    epochs (budget_param), runs and training data. Each evaluation is a sub-experiment in its own rung directory.
+    """
     work_dir = os.path.join(PROJECT_ROOT, 'hyperopts', exp_name)
     os.makedirs(work_dir)
     print(f'Experiment name: {exp_name}')
@@ -50,67 +239,54 @@ def run_hyperopts(exp_name: str, n_iter: int, n_runs: int, percentages: list):
         hyperparams = config['hyperparams']
         del config['hyperparams']
 
-    # Generate the config files to compare
-    configs = []
+    # Sample the configs to compare
     sampler = ParameterSampler(hyperparams, n_iter=n_iter, random_state=0)
-    os.makedirs(os.path.join(work_dir, 'configs'))
-    print(f'Generating {len(sampler)} pipeline configs...')
-    for i, params in enumerate(sampler):
-        with open(os.path.join(work_dir, 'configs', f'{i+1}.yml'), 'w') as f:
-            yaml.dump(dict(**set_hyperparams(config, params), hyperparams=params), f)
-            configs.append(f.name)
+    params = { i + 1: config_params for i, config_params in enumerate(sampler) }
+    print(f'Generating {len(params)} pipeline configs...')
 
-    # Train and test NLU models with cross-validation
-    if args.component in ['all', 'nlu']:
-        print('\nTraining and testing NLU models...')
-        subprocess.run(['rasa', 'test', 'nlu',
-            '--domain', os.path.join(PROJECT_ROOT, 'domain.yml'),
-            '--nlu', os.path.join(PROJECT_ROOT, 'data'),
-            '--config', *configs,
-            '--cross-validation',
-            '--no-plot',
-            '--runs', str(n_runs),
-            '--percentages', *map(str, percentages),
-            '--out',  os.path.join(work_dir, 'nlu'),
-            '--model',  os.path.join(work_dir, 'nlu', 'models')
-        ], check=True).returncode
-
-    if args.component in ['all', 'core']:
-        # Merge stories and rules in a single file to support rasa training with multiple stories
-        with tempfile.NamedTemporaryFile(suffix='.yml', mode='w', delete=False) as tmp_file:
-            tmp_stories_path = tmp_file.name
-            with open(os.path.join(PROJECT_ROOT, 'data', 'stories.yml'), 'r') as stories_file, \
-                open(os.path.join(PROJECT_ROOT, 'data', 'rules.yml'), 'r') as rules_file:
-                tmp_file.write(stories_file.read())
-                rules_file.readline() # Skip first line with "version"
-                tmp_file.write(rules_file.read())
+    def evaluate(rung_name: str, rung_params: dict, budget: float) -> pd.Series:
+        """Evaluate the configs with the given budget, returns their scores."""
+        rung_dir = work_dir if rung_name is None else os.path.join(work_dir, rung_name)
+        if rung_name is not None:
+            print(f'\n{rung_name}: evaluating {len(rung_params)} configs with budget {budget:.3g}...')
+        configs = write_configs(rung_dir, config, rung_params, budget, budget_param)
+        rung_percentages = percentages if budget >= 1 else [ round(100 * (1 - budget)) ]  # Train on a fraction of the data
+        run_experiment(rung_dir, configs, max(1, math.ceil(n_runs * budget)), rung_percentages, component, n_workers, threads_per_job)
+        return score_results(*process_results(os.path.relpath(rung_dir, os.path.join(PROJECT_ROOT, 'hyperopts'))))
+
+    scores = STRATEGIES[strategy](params, evaluate, eta=eta, min_budget=min_budget)
+    if strategy != 'random':
+        write_configs(work_dir, config, params)  # All the sampled configs, to process the results of all the rungs
+    if len(scores) == 0:
+        print('\nNo results to compare the configs')
+        return
+    best = scores.idxmax()
+    print(f'\nBest config: {best} (score {scores[best]:.2f}) {params[best]}')
 
-        # Train dialogue models
-        print('\nTraining dialogue models...')
-        subprocess.run(['rasa', 'train', 'core',
-            '--domain', os.path.join(PROJECT_ROOT, 'domain.yml'),
-            '--stories', tmp_stories_path,
-            '--config', *configs,
-            '--runs', str(n_runs),
-            '--percentages', '0',
-            '--out', os.path.join(work_dir, 'core', 'models')
-        ], check=True).returncode
-
-        # Test dialogue models
-        print('\nTesting dialogue models...')
-        for run_name, run_path in listdir(os.path.join(work_dir, 'core', 'models')):
-            for model_path in glob.iglob(os.path.join(run_path, '*.tar.gz')):
-                model_name = os.path.basename(model_path).replace('.tar.gz', '')
-                for split, stories_dir in dict(train='data', test='tests').items():
-                    subprocess.run(['rasa', 'test', 'core',
-                        '--model', model_path,
-                        '--stories', os.path.join(PROJECT_ROOT, stories_dir, 'stories.yml'),
-                        '--out', os.path.join(work_dir, 'core', run_name, model_name, split)
-                    ], check=True).returncode
+
+def score_results(nlu_results: pd.DataFrame = None, core_results: pd.DataFrame = None) -> pd.Series:
+    """Score of each config, averaging the F1 scores of the NLU components with the least held-out data and the F1 score
+    of the action prediction on the test stories."""
+    scores = []
+    if nlu_results is not None:
+        for component_name in nlu_results.columns.get_level_values(0).unique():
+            if component_name != '':
+                fractions = [ fraction for name, fraction in nlu_results.columns if name == component_name ]
+                scores.append(nlu_results[(component_name, min(fractions, key=lambda f: int(f.rstrip('%'))))])
+    if core_results is not None:
+        scores.append(core_results[('test', 'f1_action_prediction')])
+    if len(scores) == 0:
+        return pd.Series(dtype=float)
+    return pd.concat(scores, axis=1).mean(axis=1)
  
 
-def process_results(exp_name):
-    """Process the results of hyperparams search."""
+def process_results(exp_name: str) -> tuple:
+    """Process the results of hyperparams search, returns the NLU and core results (None if not run).
+
+    The results of the rungs of the halving and hyperband strategies are summarized in the rungs report, with the
+    score and budget of each config in each rung.
+    """
+    nlu_results, core_results = None, None
     # Read results from the output files
     work_dir = os.path.join(PROJECT_ROOT, 'hyperopts', exp_name)
     # Load configs hyperparameters
@@ -124,9 +300,11 @@ def process_results(exp_name):
         runs_paths = list(listdir(os.path.join(work_dir, 'nlu')))
         runs_count = len(runs_paths)
         nlu_results = defaultdict(lambda: defaultdict(int))
+        fractions = set()
         for run_name, run_path in runs_paths:
             for fold_name, fold_path in listdir(run_path):
                 exclusion_fraction = fold_name.replace('_exclusion', '')
+                fractions.add(exclusion_fraction)
                 for report_name, report_path in listdir(fold_path, exclude='train'):
                     config_name = int(report_name.replace('_report', ''))
                     nlu_results[config_name].update({ ('', k): v for k, v in configs[config_name].items() })
@@ -137,7 +315,8 @@ def process_results(exp_name):
                             component_report = json.load(f)
                         f1_score = component_report['weighted avg']['f1-score'] * 100
                         nlu_results[config_name][(component_name, exclusion_fraction)] += f1_score / runs_count # Average over the runs
-        nlu_results = pd.DataFrame.from_dict(nlu_results, orient='index').sort_index(axis=1, ascending=True).sort_values((component_name, '0%'), ascending=False)
+        fraction = min(fractions, key=lambda f: int(f.rstrip('%')))  # The least held-out data
+        nlu_results = pd.DataFrame.from_dict(nlu_results, orient='index').sort_index(axis=1, ascending=True).sort_values((component_name, fraction), ascending=False)
         nlu_results.to_csv(os.path.join(work_dir, 'nlu_report.csv'), sep='\t', float_format='%.2f')
     # Parse core results
     if os.path.exists(os.path.join(work_dir, 'core')):
@@ -156,10 +335,26 @@ def process_results(exp_name):
                     core_results[config_name][(split_name, 'story_accuracy')] += (split_report['conversation_accuracy']['accuracy'] * 100) / runs_count # Average over the runs
         core_results = pd.DataFrame.from_dict(core_results, orient='index').sort_index(axis=1, ascending=True).sort_values(('test', 'f1_action_prediction'), ascending=False)
         core_results.to_csv(os.path.join(work_dir, 'core_report.csv'), sep='\t', float_format='%.2f')
+    # Summarize the rungs
+    rungs_results = []
+    rungs_names = [ dir_name for dir_name, _ in listdir(work_dir) if dir_name.startswith('rung_') ]
+    for rung_name in sorted(rungs_names, key=lambda name: [ int(i) for i in name.replace('rung_', '').split('-') ]):  # rung_[bracket]-[rung]
+        rung_nlu_results, rung_core_results = process_results(os.path.join(exp_name, rung_name))
+        rung_results = pd.DataFrame(dict(rung=rung_name, score=score_results(rung_nlu_results, rung_core_results)))
+        params = rung_nlu_results if rung_nlu_results is not None else rung_core_results
+        rung_results['budget'] = params[('', 'budget')] if ('', 'budget') in params.columns else 1
+        rungs_results.append(rung_results)
+    if len(rungs_results) > 0:
+        rungs_results = pd.concat(rungs_results).rename_axis('config')
+        rungs_results.to_csv(os.path.join(work_dir, 'rungs_report.csv'), sep='\t', float_format='%.3f')
+    return nlu_results, core_results
         
 
 if __name__ == "__main__":
     args = parser.parse_args()
     exp_name = datetime.now().strftime('%Y%m%d-%H%M%S')
-    run_hyperopts(exp_name, args.n_iter, args.n_runs, args.percentages)
+    n_cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    n_workers = args.jobs or max(1, n_cores // args.threads_per_job)
+    run_hyperopts(exp_name, args.n_iter, args.n_runs, args.percentages, args.component, n_workers, args.threads_per_job,
+                  args.strategy, args.eta, args.min_budget, args.budget_param)
     process_results(exp_name)
@@ -0,0 +1,188 @@
+"""Script to load-test the Google Assistant webhook offline, replaying synthetic conversations against the connector
+with a stub in place of the Rasa agent."""
+import copy
+import json
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Text
+
+import numpy as np
+import aiohttp
+from sanic import Sanic
+from rasa.core.channels.channel import UserMessage
+
+from ga_connector import GoogleConnector, OVERLOADED_TEXT
+
+parser = argparse.ArgumentParser(description="Load-test the Google Assistant webhook with synthetic conversations and a stub agent.")
+parser.add_argument('--rate', '-r', type=float, nargs='+', default=[50, 100, 200, 400, 800], help="Offered loads to test, in requests per second (default: %(default)s).")
+parser.add_argument('--duration', '-d', type=float, default=10, help="Duration of each load in seconds (default: %(default)s).")
+parser.add_argument('--conversations', '-c', type=int, default=200, help="Number of concurrent conversations (default: %(default)s).")
+parser.add_argument('--client-concurrency', type=int, default=1000, help="Max requests in flight from the load generator (default: %(default)s).")
+parser.add_argument('--agent-latency', type=float, default=50, help="Mean processing time of a message by the stub agent, in ms (default: %(default)s).")
+parser.add_argument('--agent-jitter', type=float, default=0.5, help="Relative standard deviation of the stub agent processing time (default: %(default)s).")
+parser.add_argument('--max-concurrency', type=int, default=32, help="Connector max_concurrency (default: %(default)s).")
+parser.add_argument('--max-pending', type=int, default=256, help="Connector max_pending (default: %(default)s).")
+parser.add_argument('--max-pending-per-conversation', type=int, default=4, help="Connector max_pending_per_conversation (default: %(default)s).")
+parser.add_argument('--payload', '-p', type=str, default=None, help="JSON (or JSON lines) file with captured webhook payloads to use as templates.")
+parser.add_argument('--port', type=int, default=5099, help="Local port of the webhook server (default: %(default)s).")
+parser.add_argument('--max-error-rate', type=float, default=0.01, help="Error and overload rate above which the webhook is saturated (default: %(default)s).")
+parser.add_argument('--seed', '-s', type=int, default=0, help="Random seed (default: %(default)s).")
+parser.add_argument('--out', '-o', type=str, default=None, help="Path of the JSON results file.")
+
+WEBHOOK_PATH = '/webhooks/google_assistant/webhook'
+
+# Webhook request of the Actions SDK (fulfillment API v2), used when no captured payload is given
+PAYLOAD_TEMPLATE = {
+    'user': { 'userId': '', 'locale': 'en-US', 'userVerificationStatus': 'VERIFIED' },
+    'conversation': { 'conversationId': '', 'type': 'ACTIVE' },
+    'inputs': [{
+        'intent': 'actions.intent.TEXT',
+        'rawInputs': [ { 'inputType': 'VOICE', 'query': '' } ],
+        'arguments': [ { 'name': 'text', 'rawText': '', 'textValue': '' } ],
+    }],
+    'surface': { 'capabilities': [ { 'name': 'actions.capability.AUDIO_OUTPUT' } ] },
+    'isInSandbox': True,
+}
+QUERIES = ['I want to cook pasta', 'What ingredients do I need?', 'We are four people', "Let's start cooking", 'Next', 'Set a timer for 10 minutes', 'Next', 'Thanks']
+
+
+def load_payloads(path: Optional[Text]) -> List[Dict[Text, Any]]:
+    """Returns the captured payloads in the given JSON or JSON lines file (keeping only the webhook requests), or the default template."""
+    if path is None:
+        return [ PAYLOAD_TEMPLATE ]
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    try:
+        items = json.loads(content)
+        items = items if isinstance(items, list) else [ items ]
+    except ValueError:
+        items = [ json.loads(line) for line in content.splitlines() if line.strip() ]
+    payloads = [ item for item in items if isinstance(item, dict) and 'inputs' in item ]
+    if len(payloads) == 0:
+        raise ValueError(f'No webhook payloads found in {path}')
+    return payloads
+
+
+def make_payload(template: Dict[Text, Any], conversation_id: Text, query: Text) -> Dict[Text, Any]:
+    """Copy of a captured payload, moved to the given conversation and query."""
+    payload = copy.deepcopy(template)
+    payload.setdefault('conversation', {})['conversationId'] = conversation_id
+    payload.setdefault('user', {})['userId'] = conversation_id
+    payload['inputs'][0]['intent'] = 'actions.intent.TEXT'
+    payload['inputs'][0]['rawInputs'][0]['query'] = query
+    return payload
+
+
+class StubAgent():
+    """Stand-in for the Rasa agent: answers each message after a random delay, and checks that the messages of each
+    conversation arrive one at a time and in order."""
+
+    def __init__(self, latency: float, jitter: float, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.active: Dict[Text, int] = {}
+        self.last_turn: Dict[Text, int] = {}
+        self.overlaps = 0
+        self.reorders = 0
+
+    async def __call__(self, message: UserMessage):
+        sender_id = message.sender_id
+        self.overlaps += self.active.get(sender_id, 0) > 0
+        self.active[sender_id] = self.active.get(sender_id, 0) + 1
+        turn = int(message.text.rsplit('#', 1)[1])
+        self.reorders += turn < self.last_turn.get(sender_id, -1)
+        self.last_turn[sender_id] = turn
+        try:
+            await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.latency * self.jitter)) / 1000)
+            await message.output_channel.send_text_message(sender_id, f'Answer to {message.text}')
+        finally:
+            self.active[sender_id] -= 1
+
+
+async def run_load(session: aiohttp.ClientSession, url: Text, payloads: List[Dict[Text, Any]], rate: float, duration: float,
+                   n_conversations: int, client_concurrency: int, seed: int) -> Dict[Text, Any]:
+    """Send requests at the given rate, round robin over the conversations. Latencies are measured from the scheduled
+    send time, so that the queueing in the load generator is accounted for."""
+    rng = random.Random(seed)
+    semaphore = asyncio.Semaphore(client_concurrency)
+    n_requests = int(rate * duration)
+    latencies, statuses = [], dict(ok=0, overloaded=0, error=0)
+
+    async def send(i: int, scheduled: float):
+        conversation, turn = i % n_conversations, i // n_conversations
+        payload = make_payload(rng.choice(payloads), f'loadtest-{seed}-{conversation}', f'{QUERIES[turn % len(QUERIES)]} #{turn}')
+        async with semaphore:
+            try:
+                async with session.post(url, json=payload) as resp:
+                    body = await resp.json() if resp.status == 200 else None
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                body = None
+        latencies.append(time.perf_counter() - scheduled)
+        if body is None:
+            statuses['error'] += 1
+        elif OVERLOADED_TEXT in json.dumps(body):
+            statuses['overloaded'] += 1
+        else:
+            statuses['ok'] += 1
+
+    start = time.perf_counter()
+    tasks = []
+    for i in range(n_requests):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(i, scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return dict(
+        offered_rate=rate, requests=n_requests, throughput=statuses['ok'] / elapsed,
+        p50_ms=float(np.percentile(latencies, 50)), p95_ms=float(np.percentile(latencies, 95)), p99_ms=float(np.percentile(latencies, 99)), max_ms=float(latencies.max()),
+        error_rate=statuses['error'] / n_requests, overload_rate=statuses['overloaded'] / n_requests,
+    )
+
+
+async def main(args: argparse.Namespace) -> List[Dict[Text, Any]]:
+    payloads = load_payloads(args.payload)
+    agent = StubAgent(args.agent_latency, args.agent_jitter, seed=args.seed)
+    connector = GoogleConnector(args.max_concurrency, args.max_pending, args.max_pending_per_conversation)
+    app = Sanic('loadtest')
+    app.blueprint(connector.blueprint(agent), url_prefix='/webhooks/google_assistant')
+    server = await app.create_server(host='127.0.0.1', port=args.port, return_asyncio_server=True, access_log=False)
+    if hasattr(server, 'startup'):  # Sanic 21+ does not start serving on creation
+        await server.startup()
+        await server.start_serving()
+    results = []
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.client_concurrency)) as session:
+            print(f'{"offered":>8} {"throughput":>10} {"p50":>9} {"p95":>9} {"p99":>9} {"errors":>7} {"overload":>8}')
+            for rate in args.rate:
+                r = await run_load(session, f'http://127.0.0.1:{args.port}{WEBHOOK_PATH}', payloads, rate, args.duration,
+                                   args.conversations, args.client_concurrency, args.seed)
+                results.append(r)
+                print(f'{rate:6.0f}/s {r["throughput"]:8.1f}/s {r["p50_ms"]:7.1f}ms {r["p95_ms"]:7.1f}ms {r["p99_ms"]:7.1f}ms {r["error_rate"]:7.2%} {r["overload_rate"]:8.2%}')
+    finally:
+        server.close()
+        await server.wait_closed()
+    print(f'\nOrdering violations: {agent.overlaps} concurrent messages in the same conversation, {agent.reorders} out of order')
+    # The webhook is saturated by the first load it can't serve, i.e. dropping requests or falling behind the offered rate
+    saturated = [ r for r in results if r['error_rate'] + r['overload_rate'] > args.max_error_rate or r['throughput'] < 0.95 * r['offered_rate'] ]
+    if len(saturated) > 0:
+        print(f'Saturation point: {saturated[0]["offered_rate"]:.0f} requests/s (max throughput {max(r["throughput"] for r in results):.1f} requests/s)')
+    else:
+        print('Not saturated at the tested loads')
+    return results
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    results = asyncio.get_event_loop().run_until_complete(main(args))
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(dict(meta=dict(date=datetime.now().isoformat(), **vars(args)), results=results), f, indent=2)
+        print(f'\nResults saved to {args.out}')
@@ -0,0 +1,40 @@
+"""Tests of the in-memory dataset."""
+import numpy as np
+import pytest
+
+from actions.pandas_dataset import Dataset
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    return Dataset(snapshot_path=None)
+
+
+def test_steps_left(dataset):
+    steps = dataset.get_step_index(0)
+    assert steps.steps_left(-1) == len(steps)  # Not started yet
+    assert steps.steps_left(0) == len(steps) - 1
+    assert steps.steps_left(len(steps) - 1) == 0
+
+
+def test_search_recipes_ignores_duplicates(dataset):
+    # The same entity can be extracted twice (e.g. by the gazetteer and by DIET)
+    assert dataset.search_recipes([], ['garlic', 'Garlic'], [], None) == dataset.search_recipes([], ['garlic'], [], None)
+    assert dataset.search_recipes(['pasta', 'pasta'], [], [], None) == dataset.search_recipes(['pasta'], [], [], None)
+
+
+def test_search_recipes_intersects_filters(dataset):
+    assert dataset.search_recipes([], [], [], None) == list(range(dataset.n_recipes))
+    assert dataset.search_recipes([], [], ['unknown tag'], None) == []
+    tag = dataset.tags[0]
+    with_tag = dataset.search_recipes([], [], [tag], None)
+    with_garlic = dataset.search_recipes([], ['garlic'], [], None)
+    assert dataset.search_recipes([], ['garlic'], [tag], None) == sorted(set(with_tag) & set(with_garlic))
+
+
+def test_set_servings(dataset):
+    recipe = dataset.get_recipe(28)
+    scaled = recipe.set_servings(recipe.servings * 2)
+    assert [ ingredient.name for ingredient in scaled.ingredients ] == [ ingredient.name for ingredient in recipe.ingredients ]
+    assert np.allclose(scaled.amounts, np.ceil(recipe.amounts * 2), equal_nan=True)
+    assert dataset.get_recipe(28) is recipe and recipe.servings != scaled.servings  # The cached recipe is not modified
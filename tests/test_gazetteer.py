@@ -0,0 +1,48 @@
+"""Tests of the Aho-Corasick automaton of the gazetteer entity extractor."""
+import json
+
+import pytest
+
+from gazetteer_automaton import Gazetteer
+
+
+@pytest.fixture(scope='module')
+def gazetteer():
+    tables = dict(ingredient=['olive oil', 'oil', 'garlic', 'Pasta'], recipe=['Pasta', 'pasta aglio e olio'], cuisine=['italian'])
+    return Gazetteer.from_tables(tables, synonyms={ 'evoo': 'olive oil', 'spaghetti': 'pasta', 'tuscan': 'unknown' })
+
+
+def spans(entities):
+    return [ (e['start'], e['end'], e['value'], e['entity']) for e in entities ]
+
+
+def test_overlaps_keep_leftmost_longest(gazetteer):
+    text = 'Pasta aglio e olio with olive oil'
+    assert spans(gazetteer.find(text)) == [(0, 18, 'Pasta aglio e olio', 'recipe'), (24, 33, 'olive oil', 'ingredient')]
+
+
+def test_same_text_keeps_all_entities(gazetteer):
+    assert { e['entity'] for e in gazetteer.find('some pasta please') } == {'ingredient', 'recipe'}
+
+
+def test_whole_words_only(gazetteer):
+    assert gazetteer.find('boil the garlicky water') == []
+    assert spans(gazetteer.find('oil, garlic.')) == [(0, 3, 'oil', 'ingredient'), (5, 11, 'garlic', 'ingredient')]
+
+
+def test_synonyms(gazetteer):
+    assert spans(gazetteer.find('a drizzle of EVOO')) == [(13, 17, 'olive oil', 'ingredient')]
+    assert { e['entity'] for e in gazetteer.find('spaghetti') } == {'ingredient', 'recipe'}
+    assert gazetteer.find('tuscan') == []  # Synonym of an unknown item
+
+
+def test_any_whitespace_between_words(gazetteer):
+    text = 'Italian  olive\toil\n and garlic'
+    assert spans(gazetteer.find(text)) == [(0, 7, 'Italian', 'cuisine'), (9, 18, 'olive\toil', 'ingredient'), (24, 30, 'garlic', 'ingredient')]
+
+
+def test_round_trip(gazetteer):
+    restored = Gazetteer.from_dict(json.loads(json.dumps(gazetteer.to_dict())))  # Persisted as JSON by the extractor
+    assert len(restored) == len(gazetteer)
+    for text in ['Pasta aglio e olio with olive oil', 'EVOO and  garlic', 'nothing here']:
+        assert restored.find(text) == gazetteer.find(text)
@@ -0,0 +1,36 @@
+"""Tests of the server-side search results."""
+from actions.results import SearchResults
+
+
+def test_put_and_get():
+    results = SearchResults()
+    cursor = results.put([3, 1, 2], 'v1', [['pasta'], [], [], None])
+    assert results.get(cursor, 'v1') == [3, 1, 2]
+    assert results.get(SearchResults.move(cursor, 4), 'v1') == [3, 1, 2]
+    assert SearchResults.move(cursor, 4)['position'] == 1
+
+
+def test_stale_or_missing_results():
+    results = SearchResults()
+    cursor = results.put([3, 1, 2], 'v1', [['pasta'], [], [], None])
+    assert results.get(cursor, 'v2') is None  # Ids of another version of the dataset
+    assert results.get(dict(cursor, handle='missing'), 'v1') is None  # E.g. after a restart
+    assert results.get(None, 'v1') is None
+
+
+def test_same_query_replaces_results():
+    results = SearchResults()
+    query = [['pasta'], [], [], None]
+    first = results.put([3, 1, 2], 'v1', query)
+    second = results.put([3, 1, 2], 'v1', query)
+    filtered = results.put([3], 'v1', query, [['tag', 'vegan', False]])
+    assert first['handle'] == second['handle'] != filtered['handle']
+    assert len(results) == 2
+    assert filtered['filters'] == [['tag', 'vegan', False]]
+
+
+def test_eviction():
+    results = SearchResults(max_size=2)
+    cursors = [ results.put([i], 'v1', [[str(i)], [], [], None]) for i in range(3) ]
+    assert results.get(cursors[0], 'v1') is None
+    assert results.get(cursors[2], 'v1') == [2]
@@ -0,0 +1,57 @@
+"""Tests of the SQLite dataset backend."""
+import os
+import threading
+
+import pytest
+
+from actions.dataset import RECIPES_PATH
+from actions.sqlite_dataset import SqliteDataset, fcntl
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    return SqliteDataset(database_path=str(tmp_path_factory.mktemp('sqlite') / 'dataset.sqlite'))
+
+
+@pytest.mark.parametrize('table, column', [('recipes', 'title'), ('ingredients', 'name')])
+def test_match_rows_uses_trigram_index(dataset, table, column):
+    if not dataset._fts:
+        pytest.skip('SQLite without FTS5 trigram tokenizer')
+    subquery, params = dataset._match_rows(table, column, ['garlic', '100%_pure'])
+    plan = [ row[-1] for row in dataset._execute(f'EXPLAIN QUERY PLAN {subquery}', params) ]
+    assert sum('INDEX 0:L0' in detail for detail in plan) == 2, plan
+
+
+def test_like_wildcards_match_literally(dataset):
+    assert len(dataset._count_ingredients(['garlic'])) > 0
+    assert len(dataset._count_ingredients(['gar_ic'])) == 0
+    assert len(dataset._count_ingredients(['%'])) == 0
+    assert dataset._search_cuisine('ital_an') == set()
+
+
+
+@pytest.mark.skipif(fcntl is None, reason='Versions are not locked without fcntl')
+def test_unused_versions_removed_on_build(tmp_path):
+    recipes_path = tmp_path / 'recipes.yml'
+    original = open(RECIPES_PATH, encoding='utf-8').read()
+    recipes_path.write_text(original, encoding='utf-8')
+    first = SqliteDataset(recipes_path=str(recipes_path), database_path=str(tmp_path / 'dataset.sqlite'))
+    recipes_path.write_text(original + '\n# Second version\n', encoding='utf-8')
+    second = first.reload()
+    assert os.path.exists(first.path) and os.path.exists(second.path)  # The first version is still open
+    # Back to the first version before the second one is closed: the closed instance does not remove the shared file
+    recipes_path.write_text(original, encoding='utf-8')
+    first_again = second.reload()
+    assert first_again.path == first.path
+    first.close()
+    recipes_path.write_text(original + '\n# Third version\n', encoding='utf-8')
+    second.close()
+    third = first_again.reload()
+    assert os.path.exists(first_again.path) and not os.path.exists(second.path)
+    results = []
+    thread = threading.Thread(target=lambda: results.append(first_again.get_recipe(0)))  # New connection after the builds
+    thread.start()
+    thread.join()
+    assert results[0].title == third.get_recipe(0).title
+    first_again.close()
+    third.close()
@@ -0,0 +1,50 @@
+"""Tests of the timing wheel of the cooking timers."""
+import math
+import random
+
+from actions.timers import Timer, TimingWheel
+
+
+def make_timer(timer_id: int, deadline: float) -> Timer:
+    return Timer(timer_id, 'user', f'timer {timer_id}', deadline, deadline)
+
+
+def test_late_add_to_idle_wheel():
+    wheel = TimingWheel(start=0)
+    assert wheel.advance(10) == []
+    # Idle for a long time, the missed ticks are skipped instead of replayed
+    now = 10 ** 7
+    wheel.add(make_timer(1, now + 5), now=now)
+    assert wheel.tick == now
+    assert wheel.advance(now + 4) == []
+    assert [ timer.id for timer in wheel.advance(now + 5) ] == [1]
+    assert len(wheel) == 0
+
+
+def test_expire_in_order_and_never_early():
+    rng = random.Random(0)
+    wheel = TimingWheel(start=0)
+    pending, now, fired = {}, 0.0, []
+    for timer_id in range(2000):
+        if rng.random() < 0.5:
+            timer = make_timer(timer_id, now + rng.choice([0.5, 3, 70, 5000, 300000]) * rng.random())
+            wheel.add(timer, now=now)
+            pending[timer_id] = timer
+        now += rng.choice([1, 1, 1, 30, 1000])
+        for timer in wheel.advance(now):
+            assert math.ceil(timer.deadline) <= int(now)  # Not early
+            fired.append(timer)
+            del pending[timer.id]
+        assert all( math.ceil(timer.deadline) > int(now) for timer in pending.values() )  # Not late
+    ticks = [ max(math.ceil(timer.deadline), 0) for timer in fired ]
+    assert ticks == sorted(ticks)
+
+
+def test_cancel_and_replace():
+    wheel = TimingWheel(start=0)
+    wheel.add(make_timer(1, 10), now=0)
+    wheel.add(make_timer(2, 20), now=0)
+    assert wheel.cancel(1).id == 1 and wheel.cancel(1) is None
+    wheel.add(make_timer(2, 5), now=0)  # Moved earlier
+    assert [ timer.id for timer in wheel.advance(5) ] == [2]
+    assert wheel.advance(30) == []
@@ -0,0 +1,22 @@
+"""Tests of the parsing utilities of the actions."""
+from datetime import timedelta
+
+import pytest
+
+from actions.utils import parse_duration
+
+
+@pytest.mark.parametrize('time_str, expected', [
+    ('20 minutes', timedelta(minutes=20)),
+    ('twenty five minutes', timedelta(minutes=25)),
+    ('twenty-five minutes', timedelta(minutes=25)),
+    ('thirty-five', timedelta(minutes=35)),
+    ('fifty-five seconds', timedelta(seconds=55)),
+    ('one hour and forty-five minutes', timedelta(minutes=105)),
+    ('two hours and twenty-two minutes', timedelta(hours=2, minutes=22)),
+    ('an hour and a half', timedelta(hours=1.5)),
+    ('1h30', timedelta(minutes=90)),
+    ('banana', None),
+])
+def test_parse_duration(time_str, expected):
+    assert parse_duration(time_str) == expected